@@ -10,6 +10,7 @@ from string import Template
 import java.lang.Class
 import java.sql.DriverManager
 import java.sql.SQLException
+import java.text.ParseException
 import javax.swing.JOptionPane
 
 from hec.heclib.util import HecTime
@@ -17,6 +18,7 @@ from hec.heclib.util import HecTime
 from rtsutils import go
 from rtsutils.cavi.jython import jutil, status
 from rtsutils import USGS_SQL_DB
+from rtsutils.utils import hectime
 
 # set the provider
 PROVIDER = "" # your district (MSC)
@@ -50,6 +52,17 @@ SCHEME = "https"
 HOST = "water-api.corps.cloud"
 TIMEOUT = 300
 
+# Water API time stamps, in UTC
+ISO8601 = "yyyy-MM-dd'T'HH:mm:ssXXX"
+
+
+def hec_minutes(t):
+    """HecTime value (minute granularity) of a Water API time stamp"""
+    try:
+        return hectime.minutes(hectime.parse_millis(t, ISO8601))
+    except java.text.ParseException:
+        return HecTime(t, HecTime.MINUTE_GRANULARITY).value()
+
 # get the time window
 # after = "" # "YYYY-MM-DDTHH:MM:SSZ"
 # before = "" # "YYYY-MM-DDTHH:MM:SSZ"
@@ -139,10 +152,7 @@ for iter_byte in iter(partial(sub.stdout.read, 1), b""):
         except Exception as e:
             print(e)
 
-        hec_times = [
-            HecTime(t, HecTime.MINUTE_GRANULARITY).value()
-            for t in times
-        ]
+        hec_times = [hec_minutes(t) for t in times]
 
         msg = jutil.put_timeseries(
             dssfilename=DSSFILENAME,
@@ -8,6 +8,7 @@ from collections import namedtuple
 import os
 import tempfile
 from rtsutils.usgs import USGS_EXTRACT_CODES
+from rtsutils.utils import timeseries
 
 try:
     from hec.lang import TimeStep
@@ -64,11 +65,7 @@ def put_timeseries(
     
     try:
         # map times and values
-        timestep_min = None
-        for t_time in range(len(times) - 1):
-            time_step = abs(times[t_time + 1] - times[t_time])
-            if time_step < timestep_min or timestep_min is None:
-                timestep_min = time_step
+        timestep_min = timeseries.detect_interval(times, timeseries.SMALLEST)
         epart = TimeStep().getEPartFromIntervalMinutes(timestep_min)
 
         pathname = "/{0}/{1}/{2}//{3}/{4}/".format(
@@ -1,12 +1,15 @@
 from hec.heclib.dss  import HecDss
 from hec.heclib.util import Heclib
-from hec.heclib.util import HecTime
 from hec.io          import TimeSeriesContainer
 from hec.script      import Constants
 from java.lang       import System
 from java.text       import SimpleDateFormat
 from java.util       import Calendar
 from java.util       import TimeZone
+from rtsutils.utils  import hectime
+from rtsutils.utils  import http
+from rtsutils.utils  import retry
+from rtsutils.utils  import tsbuilder
 import getopt, json, os, re, string, sys, traceback, urllib, urllib2
 
 progName  = os.path.split(sys.argv[0])[1]
@@ -94,6 +97,14 @@ def usage(message=None) :
 	              Specifies the time zone. This is used to interpretet the
 	              begin_time and end_time, as well as the times of the values
 	              retrieved. Defaults to UTC.
+
+	          -r retries
+	          --retries retries
+	              Specifies the number of times to retry a request that fails
+	              with a connection or server error, waiting exponentially
+	              longer (with randomization) between retries. After 5 failures
+	              in a row, no requests are made for 60 seconds, so the
+	              remaining requests fail immediately. Defaults to 5.
 	''' % (progName, version, verDate, progName)
 	if message : print("\n%s" % message)
 	print(blurb)
@@ -111,13 +122,10 @@ def makeTimeSeriesContainer(tsData, timeZone, pathname=None) :
 	tsc = None
 	try :
 		tz = TimeZone.getTimeZone(timeZone)
-		sdf8601 = SimpleDateFormat("yyyy-MM-dd'T'HH:mm:ssXXX")
-		sdfHecTime = SimpleDateFormat("ddMMMyyyy, HH:mm")
+		sdf8601 = hectime.date_format("yyyy-MM-dd'T'HH:mm:ssXXX", tz)
 		cal = Calendar.getInstance()
-		for obj in sdf8601, sdfHecTime, cal :
-			obj.setTimeZone(tz)
-		ht = HecTime()
-		times, values, qualities = [], [], []
+		cal.setTimeZone(tz)
+		builder = tsbuilder.ContainerBuilder(quality=True)
 		#------------------#
 		# process the data #
 		#------------------#
@@ -152,20 +160,14 @@ def makeTimeSeriesContainer(tsData, timeZone, pathname=None) :
 			cal.setTimeInMillis(sdf8601.parse(rts["segments"][0]["first-time"]).getTime())
 			for i in range(segmentCount) :
 				for j in range(rts["segments"][i]["value-count"]) :
-					ht.set(sdfHecTime.format(cal.getTimeInMillis()))
 					v, q = rts["segments"][i]["values"][j]
-					times.append(ht.value())
-					values.append(v)
-					qualities.append(q)
+					builder.append(hectime.minutes(cal.getTimeInMillis(), tz), v, q)
 					cal.add(field, intvlNum)
 				if i < segmentCount - 1 :
 					nextBegin = sdf8601.parse(rts["segments"][i+1]["first-time"]).getTime()
 					time = cal.getTimeInMillis()
 					while time < nextBegin :
-						ht.set(sdfHecTime.format(time))
-						times.append(ht.value())
-						values.append(Constants.UNDEFINED)
-						qualities.append(0)
+						builder.append(hectime.minutes(time, tz), Constants.UNDEFINED, 0)
 						cal.add(field, intvlNum)
 						time = cal.getTimeInMillis()
 		elif tsData.has_key("irregular-interval-values") :
@@ -176,22 +178,15 @@ def makeTimeSeriesContainer(tsData, timeZone, pathname=None) :
 			unit = its["unit"].split()[0]
 			intvl = 0
 			for t, v, q in its["values"] :
-				ht.set(sdfHecTime.format(sdf8601.parse(t)))
-				times.append(ht.value())
-				values.append(v)
-				qualities.append(q)
+				builder.append(hectime.minutes(sdf8601.parse(t).getTime(), tz), v, q)
 		else :
 			raise Exception("Time series has no values")
 		#--------------------------------------------------#
 		# code common to regular and irregular time series #
 		#--------------------------------------------------#
-		tsc = TimeSeriesContainer()
-		tsc.times             = times
-		tsc.values            = values
-		tsc.quality           = qualities
-		tsc.numberValues      = len(times)
-		tsc.startTime         = times[0]
-		tsc.endTime           = times[-1]
+		if not len(builder) :
+			raise Exception("Time series has no values")
+		tsc = builder.fill(TimeSeriesContainer())
 		tsc.interval          = intvl
 		tsc.units             = unit
 		tsc.timeZoneID        = timeZone
@@ -236,6 +231,29 @@ def makeTimeSeriesContainer(tsData, timeZone, pathname=None) :
 		output(traceback.format_exc())
 	return tsc
 
+def retrieve(url, retryPolicy, breaker) :
+	'''
+	Retrieves the text at a URL, retrying connection and server errors, or
+	returns None if it couldn't be retrieved
+	'''
+	def onRetry(attempt, error, delay) :
+		output("Error retrieving data (%s), retry %d in %.1f seconds" % (error, attempt, delay))
+	def onClose(response) :
+		if response.compressed :
+			output("Received %d bytes (%d compressed)" % (response.decoded, response.received))
+		else :
+			output("Received %d bytes (not compressed)" % response.decoded)
+	try :
+		session = retry.open_url(urllib2.Request(url, headers=http.ACCEPT_ENCODING), retryPolicy, breaker, onRetry, http.shared_client().open)
+	except Exception as exc :
+		output("Error retrieving data: %s" % exc)
+		return None
+	session = http.DecodedResponse(session, onClose)
+	try :
+		return session.read()
+	finally :
+		session.close()
+
 def main() :
 	#-------#
 	# setup #
@@ -251,6 +269,7 @@ def main() :
 	duration     = None
 	timeZoneStr  = None
 	timeZone     = None
+	retries      = 5
 	beginTimeCal = None
 	endTimeCal   = None
 	inputLines   = None
@@ -260,7 +279,7 @@ def main() :
 	# process the command line #
 	#--------------------------#
 	try :
-		opts, args = getopt.getopt(sys.argv[1:], "i:d:v:b:e:z:", ["in=", "dss-file=", "dss-version=", "begin=", "end=", "tz="])
+		opts, args = getopt.getopt(sys.argv[1:], "i:d:v:b:e:z:r:", ["in=", "dss-file=", "dss-version=", "begin=", "end=", "tz=", "retries="])
 		if args : raise Exception("Unexpected argument(s) encountered: %s" % args)
 	except Exception as exc :
 		usage(str(exc))
@@ -271,6 +290,7 @@ def main() :
 		elif opt in ("-b", "--begin")       : beginTime   = arg
 		elif opt in ("-e", "--end")         : endTime     = arg
 		elif opt in ("-z", "--tz")          : timeZoneStr = arg
+		elif opt in ("-r", "--retries")     : retries     = arg
 	#--------------------#
 	# validate arguments #
 	#--------------------#
@@ -279,6 +299,13 @@ def main() :
 		if dssVersion not in (6, 7) : raise Exception
 	except :
 		usage("Invalid DSS version: %s" % dssVersion)
+	try :
+		retries = int(retries)
+		if retries < 0 : raise Exception
+	except :
+		usage("Invalid retries: %s" % retries)
+	retryPolicy = retry.RetryPolicy(retries)
+	breaker = retry.CircuitBreaker()
 	if beginTime :
 		if not reTime.match(beginTime) and not reDuration.match(beginTime) :
 			usage("Invalid time for begin_time: %s" % beginTime)
@@ -337,10 +364,10 @@ def main() :
 			if nameStr and len(nameStr) + len(tsid) > 1500 :
 				output("Retrieving %d time series for office %s" % (count, office))
 				url = urlTemplate % (office, urllib.quote(nameStr))
-				session = urllib2.urlopen(url)
-				names.append((office, nameStr))
-				jsonData.append(session.read())
-				session.close()
+				data = retrieve(url, retryPolicy, breaker)
+				if data is not None :
+					names.append((office, nameStr))
+					jsonData.append(data)
 				nameStr = ""
 				count = 0
 			else :
@@ -350,12 +377,13 @@ def main() :
 		if nameStr :
 			output("Retrieving %d time series for office %s" % (count, office))
 			url = urlTemplate % (office, urllib.quote(nameStr))
-			session = urllib2.urlopen(url)
-			names.append((office, nameStr))
-			jsonData.append(session.read())
-			session.close()
+			data = retrieve(url, retryPolicy, breaker)
+			if data is not None :
+				names.append((office, nameStr))
+				jsonData.append(data)
 			nameStr = ""
 			count = 0
+	for line in breaker.report() : output(line)
 	#--------------#
 	# write to DSS #
 	#--------------#
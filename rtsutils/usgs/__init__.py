@@ -9,7 +9,6 @@ import os
 import sys
 import csv
 import tempfile
-import threading
 
 from java.util import TimeZone
 
@@ -24,12 +23,6 @@ USGS_EXTRACT_CODES = {
 }
 
 
-
-
-#getusgs_path = getusgs.__file__.replace("$py.class", ".py")
-getusgs_path = os.path.join(os.path.dirname(__file__), 'getusgs.py')
-#getusgs. = os.path.split(getusgs_path)[1]
-
 class USGSDataRetrieve():
     """
     class to define parameters for HEC's 'getUsgs.py' module
@@ -40,21 +33,38 @@ class USGSDataRetrieve():
         """
         self.mod_dir = os.path.dirname(__file__)
         self.locations_file = None
+        self.locations_temp = None
         self.parameters_file = os.path.join(self.mod_dir, 'parameters.csv')
         self.aliases_file = os.path.join(self.mod_dir, 'parameter_aliases.csv')
         self.dss_filename = os.path.join(tempfile.gettempdir(), 'usgs-data.dss')
         self.tzdss = None
+        self.skip_unchanged = None
         self.begin_date = None
         self.end_date = None
         self.timezone = None
         self.forget = None
         self.loglevel = None
+        self.workers = None
+        self.batch = None
+        self.chunk_days = None
+        self.interval = None
+        self.cache_dir = None
+        self.cache_ttl = None
+        self.incremental = None
+        self.overlap = None
+        self.notfound_ttl = None
+        self.retries = None
+        self.retry_budget = None
         self.working_directory = os.path.dirname(__file__)
         self.arg_dict = None
+        self.engine = None
+        self.engine_argv = None
 
     def run(self):
         """
-        Set the sys.argv and then execute the HEC provided 'getUsgs.py' module
+        Run the HEC provided 'getUsgs.py' module with the options set,
+        returning the stations processed keyed by outcome ("successful",
+        "nodata", "notfound", and "haserror")
         """
         self.arg_dict = {
             'workdir': self.working_directory,
@@ -63,31 +73,44 @@ class USGSDataRetrieve():
             'aliases': self.aliases_file,
             'dss': self.dss_filename,
             'tzdss': self.tzdss,
+            'skip-unchanged': self.skip_unchanged,
             'begindate': self.begin_date,
             'enddate': self.end_date,
             'timezone': self.timezone,
             'forget': self.forget,
-            'output': self.loglevel
+            'output': self.loglevel,
+            'workers': self.workers,
+            'batch': self.batch,
+            'chunk-days': self.chunk_days,
+            'interval': self.interval,
+            'cache-dir': self.cache_dir,
+            'cache-ttl': self.cache_ttl,
+            'incremental': self.incremental,
+            'overlap': self.overlap,
+            'notfound-ttl': self.notfound_ttl,
+            'retries': self.retries,
+            'retry-budget': self.retry_budget
         }
         
-        sys.argv = [getusgs_path]
+        argv = []
         for key, val in self.arg_dict.iteritems():
-            if val is not None:
-                sys.argv.append('--' + key)
-                sys.argv.append(val)
-        
-        # Threading with getusgs ending with sys.exit() is needed to run the
-        # script multiple times in the CAVI environment
-        thread = threading.Thread(target=self.run_seperate)
-        thread.start()
-        thread.join()
-        
-    def run_seperate(self):
-        """
-        Run (import) getusgs as a seperate thread so it terminates itself and not
-        all other scripts
-        """
-        import rtsutils.usgs.getusgs
+            if val is True:
+                argv.append('--' + key)
+            elif val is not None:
+                argv.append('--' + key)
+                argv.append(val)
+
+        # The engine is kept while the options are unchanged, so running again
+        # in the same CAVI session reuses the configuration files already read,
+        # the not found locations and the cached responses
+        from rtsutils.usgs import getusgs
+        if self.engine is None or argv != self.engine_argv:
+            specs, errors = getusgs.parseCommandLine(argv)
+            if errors:
+                raise getusgs.ConfigurationError(errors)
+            self.engine = getusgs.GetUsgsEngine(**specs)
+            self.engine_argv = argv
+        return self.engine.run()
 
     def is_forget(self):
         """
@@ -142,6 +165,13 @@ class USGSDataRetrieve():
             #raise Exception('Incompatible timezone.\n Application quitting.')
         self.tzdss = tz
 
+    def set_skip_unchanged(self):
+        """
+        Specifies reading each HEC-DSS record before storing it and not storing
+        the record if the HEC-DSS file already has the same values.
+        """
+        self.skip_unchanged = True
+
     def set_locations(self, loc_parameters):
         """
         Specifies locations input file.
@@ -149,14 +179,20 @@ class USGSDataRetrieve():
         headers = ['[USGS_LOC]','SHEF_LOC','DSS_A-PART','DSS_B-PART',
             'DSS_F-PART', 'CWMS_LOC', 'CWMS_VER', 'PARAMETERS']
             
-        file_path = os.path.join(tempfile.gettempdir(), 'usgs-locations.csv')
-    
+        # A file of its own, so other instances running at the same time
+        # don't overwrite it, replacing the one written by a previous call
+        fd, file_path = tempfile.mkstemp(prefix='usgs-locations-', suffix='.csv')
+        os.close(fd)
+
         with open(file_path, 'wb') as csvfile:
             csvwriter = csv.DictWriter(csvfile, fieldnames=headers)
             csvwriter.writeheader()
             for loc_parameter in loc_parameters:
                 csvwriter.writerow(loc_parameter)
-        
+
+        if self.locations_temp and os.path.exists(self.locations_temp):
+            os.remove(self.locations_temp)
+        self.locations_temp = file_path
         self.set_locations_file(file_path)
 
     def set_locations_file(self, file_path):
@@ -179,6 +215,72 @@ class USGSDataRetrieve():
         """
         self.aliases_file = a
         
+    def set_workers(self, n):
+        """
+        Specifies the number of stations to retrieve and parse concurrently.
+        Data are still stored to DSS one station at a time.
+        """
+        self.workers = str(int(n))
+
+    def set_batch(self, n):
+        """
+        Specifies the maximum number of stations to retrieve with each request
+        to the USGS.
+        """
+        self.batch = str(int(n))
+
+    def set_chunk_days(self, n):
+        """
+        Specifies the longest time window, in days, to retrieve with each
+        request to the USGS; longer windows are retrieved in concurrent
+        chunks. 0 retrieves the whole window with each request.
+        """
+        self.chunk_days = str(int(n))
+
+    def set_interval_policy(self, policy):
+        """
+        Specifies how the interval of each time series is determined:
+        SMALLEST-DOMINANT (default), SMALLEST, MODE, or GCD.
+        """
+        self.interval = policy
+
+    def set_cache(self, cache_dir, ttl=None):
+        """
+        Specifies caching the USGS responses in cache_dir, relative to the
+        working directory, and optionally the number of minutes a cached
+        response is used before revalidating it; default is 15.
+        """
+        self.cache_dir = cache_dir
+        if ttl is not None:
+            self.cache_ttl = str(int(ttl))
+
+    def set_incremental(self, overlap=None):
+        """
+        Specifies retrieving only the data after the last time stored for each
+        station, less overlap minutes to pick up revisions; default is 60.
+        """
+        self.incremental = True
+        if overlap is not None:
+            self.overlap = str(int(overlap))
+
+    def set_notfound_ttl(self, hours):
+        """
+        Specifies the number of hours a station the USGS reported as not found
+        is skipped before checking whether it has data again. The hours double
+        each time the station is still not found, up to 30 days; default is 24.
+        """
+        self.notfound_ttl = str(int(hours))
+
+    def set_retries(self, n, budget=None):
+        """
+        Specifies the number of times to retry a request to the USGS that fails
+        with a connection or server error; default is 5. The optional budget
+        limits the retries for all requests together; default is 100.
+        """
+        self.retries = str(int(n))
+        if budget is not None:
+            self.retry_budget = str(int(budget))
+
     def set_working_dir(self, wkdir):
         """
         Specifies the working directory for the program. Any relative filenames
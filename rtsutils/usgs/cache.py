@@ -0,0 +1,216 @@
+"""On-disk cache of USGS NWIS responses
+
+Each response body is stored as a file so it can be read exactly like an
+input file given to getusgs with -i/--input.  Entries are revalidated with
+If-None-Match/If-Modified-Since once they are older than the time to live,
+and evicted by age and total size, least recently used first.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def _remove(path):
+    """remove a file that another engine or process may have removed"""
+    try:
+        os.remove(path)
+    except OSError:
+        if os.path.exists(path):
+            raise
+
+
+class ResponseCache:
+    """Cache of response bodies keyed by site(s) and time window
+
+    Parameters
+    ----------
+    directory : str
+        directory holding the cached bodies and their metadata
+    ttl : int, optional
+        seconds a cached body is used without revalidating, by default 900
+    max_age : int, optional
+        seconds after which an entry is evicted, by default 7 days
+    max_size : int, optional
+        bytes the cached bodies may use before the least recently used are
+        evicted, by default 100 MB
+    """
+
+    def __init__(self, directory, ttl=900, max_age=7 * 86400, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.directory})".format(self=self)
+
+    def key(self, sites, window, parameters=None):
+        """cache key for the sites, a normalized time window and the
+        parameter codes requested
+
+        Parameters
+        ----------
+        sites : str
+            site number or comma-separated site numbers
+        window : str
+            normalized time window, e.g. "PT24H" or "<begin>/<end>"
+        parameters : str, optional
+            comma-separated parameter codes, by default None for all
+
+        Returns
+        -------
+        str
+            key used for the file names of the entry
+        """
+        key = "{}|{}".format(sites, window)
+        if parameters:
+            key += "|" + parameters
+        return hashlib.md5(key).hexdigest()
+
+    def body_path(self, key):
+        """path of the cached body for key"""
+        return os.path.join(self.directory, key + ".rdb")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def lookup(self, key):
+        """metadata of the entry for key
+
+        Returns
+        -------
+        dict
+            url, etag, last_modified and fetched (epoch seconds) of the
+            entry, or None if there is no usable entry
+        """
+        try:
+            with open(self._meta_path(key), "r") as meta_file:
+                meta = json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+        if not os.path.isfile(self.body_path(key)):
+            return None
+        return meta
+
+    def is_fresh(self, meta):
+        """whether the entry may be used without revalidating"""
+        return meta is not None and time.time() - meta["fetched"] < self.ttl
+
+    def conditional_headers(self, meta):
+        """request headers to revalidate the entry
+
+        Returns
+        -------
+        dict
+            If-None-Match and/or If-Modified-Since headers, empty if the
+            entry can't be revalidated
+        """
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def store(self, key, url, response, headers, chunk_size=65536):
+        """copy a response body into the cache
+
+        The body is written to a temporary file and moved into place so
+        concurrent readers never see a partial body.
+
+        Parameters
+        ----------
+        key : str
+            key of the entry
+        url : str
+            URL the response is for
+        response : file
+            open response to read the body from
+        headers : mimetools.Message
+            response headers
+        """
+        body_path = self.body_path(key)
+        tmp_path = "{}.{}.{}.tmp".format(body_path, os.getpid(), threading.currentThread().getName())
+        with open(tmp_path, "wb") as body_file:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                body_file.write(chunk)
+        with self.lock:
+            _remove(body_path)
+            os.rename(tmp_path, body_path)
+            self._write_meta(key, {"url": url}, headers)
+
+    def refresh(self, key, meta, headers):
+        """mark an entry as revalidated by a 304 (not modified) response"""
+        with self.lock:
+            self._write_meta(key, meta, headers)
+
+    def open(self, key):
+        """open the cached body for reading, marking it as used
+
+        The modification time of the body is the time it was last used, by
+        which entries are evicted, so a body that is revalidated by a 304
+        (not modified) response or used while fresh is kept.
+        """
+        path = self.body_path(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return open(path, "rb")
+
+    def _write_meta(self, key, meta, headers):
+        meta = dict(meta)
+        meta["fetched"] = time.time()
+        for name, field in (("ETag", "etag"), ("Last-Modified", "last_modified")):
+            value = headers.get(name) if headers else None
+            if value:
+                meta[field] = value
+        with open(self._meta_path(key), "w") as meta_file:
+            json.dump(meta, meta_file)
+
+    def evict(self):
+        """remove entries not used for the maximum age, then the least
+        recently used entries until the bodies fit in the maximum size
+
+        Returns
+        -------
+        int
+            number of entries removed
+        """
+        entries = []
+        now = time.time()
+        with self.lock:
+            for name in os.listdir(self.directory):
+                if not name.endswith(".rdb"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-4]))
+            entries.sort()
+            total = sum([entry[1] for entry in entries])
+            removed = 0
+            for mtime, size, key in entries:
+                if now - mtime <= self.max_age and total <= self.max_size:
+                    break
+                for path in (self.body_path(key), self._meta_path(key)):
+                    _remove(path)
+                total -= size
+                removed += 1
+        return removed
@@ -0,0 +1,77 @@
+"""anydbm files shared by getusgs processes and engines
+
+The file is opened only while holding a lock file next to it, and closed
+before the lock is released, so any number of getusgs processes - and any
+number of engines in one process - can read and update the same file
+without losing each other's updates.
+"""
+
+import anydbm
+import contextlib
+import errno
+import os
+import threading
+import time
+
+
+class LockedDbm:
+    """anydbm file opened under a lock file
+
+    Parameters
+    ----------
+    path : str
+        anydbm file
+    lock_timeout : int, optional
+        seconds to wait for the lock file, after which a lock file that old
+        is taken to be left over from a process that died, by default 30
+    """
+
+    def __init__(self, path, lock_timeout=30):
+        self.path = path
+        self.lock_timeout = lock_timeout
+        self.lock_path = path + ".lock"
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.path})".format(self=self)
+
+    def _acquire(self):
+        self.lock.acquire()
+        deadline = time.time() + self.lock_timeout
+        while True:
+            try:
+                os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    self.lock.release()
+                    raise
+            try:
+                if time.time() - os.path.getmtime(self.lock_path) > self.lock_timeout:
+                    os.remove(self.lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                self.lock.release()
+                raise IOError("Timed out waiting for lock file {}".format(self.lock_path))
+            time.sleep(0.05)
+
+    def _release(self):
+        try:
+            os.remove(self.lock_path)
+        finally:
+            self.lock.release()
+
+    @contextlib.contextmanager
+    def opened(self):
+        """the open anydbm file, holding the lock file until it is closed"""
+        self._acquire()
+        try:
+            db = anydbm.open(self.path, "c")
+            try:
+                yield db
+            finally:
+                db.close()
+        finally:
+            self._release()
@@ -20,6 +20,9 @@ Command Line
 
   * -l locations_filename (or --locations locations_filename) - specifies
 	   locations input file. Defaults to Locations.csv in the working directory.
+	   The parsed locations, parameters, and parameter aliases are saved to
+	   locations_filename.compiled and loaded from it until one of the files
+	   changes.
 
   * -p parameters_filename (or --parameters parameters_filename) - specifies
 	   parameters  input file. Defaults to Parameters.csv in the working
@@ -31,12 +34,89 @@ Command Line
 
   * -r retry_count (or --retries retry_count) - specifies number of times to 
 	   retry connecting to the USGS if a connection error is encountered.
-	   Defaults to 5.
+	   Defaults to 5. The waits between retries double from about half a
+	   second, up to 30 seconds, and are randomized. Server errors (HTTP
+	   status 5xx, 408, and 429) are retried like connection errors. After 5
+	   failures in a row for the same host, requests to that host are not made
+	   for 60 seconds, so the remaining stations fail immediately while the
+	   host is down.
+
+  * --retry-budget retry_budget - specifies the total number of retries for
+	   all requests made by one execution of the program. Defaults to 100.
+
+  * --workers worker_count - specifies the number of stations to retrieve
+	   and parse concurrently. Data are still output and stored one station at
+	   a time, in the order the stations are processed. Requests reuse open
+	   connections to the USGS, and at most 8 requests to a host are open at
+	   once. Defaults to 1.
+
+  * --batch batch_size - specifies the maximum number of stations to retrieve
+	   with each request to the USGS. The number of stations in a request is
+	   also limited by the length of the request URL. Any station requested in
+	   a batch but missing from the response is retrieved by itself. Defaults
+	   to 1. Only the parameters in the PARAMETERS column of the locations file
+	   are requested, so a batch holds only stations with the same parameters.
+
+  * --chunk-days day_count - specifies splitting a time window longer than
+	   day_count days into chunks of that many days, which are retrieved
+	   concurrently (up to 4 at a time) and merged. Each chunk is retried by
+	   itself, so a chunk that can't be retrieved doesn't lose the others;
+	   the data of the others are still output and stored, but the station
+	   is reported as having errors and its watermarks aren't advanced.
+	   0 retrieves the whole window with one request. Defaults to 30.
+
+  * --interval interval_policy - specifies how the interval of each time
+	   series is determined from the differences between its times. Defaults
+	   to SMALLEST-DOMINANT. Valid values for interval_policy are:
+		 + SMALLEST-DOMINANT - the smallest difference, if it accounts for more
+		   than 75% of the differences, otherwise irregular
+		 + SMALLEST - the smallest difference
+		 + MODE - the most common difference
+		 + GCD - the greatest common divisor of the differences
+
+  * --cache-dir cache_directory - specifies caching the responses from the
+	   USGS in cache_directory. Relative directory names are relative to the
+	   working directory. A cached response is used without contacting the
+	   USGS until it is older than the cache time to live, after which it is
+	   revalidated with the USGS and only retrieved again if it has changed.
+	   Cached responses are read the same way as the input file (-i) and are
+	   removed after 7 days or when the cache exceeds 100 MB. If not
+	   specified, responses are not cached.
+
+  * --cache-ttl cache_minutes - specifies the number of minutes a cached
+	   response is used without revalidating it with the USGS. Defaults to 15.
+
+  * --incremental - specifies retrieving only the data after the last time
+	   previously stored for each station, less the overlap. The last time
+	   stored is recorded for each station, USGS time series, and parameter
+	   whenever data are stored to a HEC-DSS file or a CWMS database, whether
+	   or not this option is specified. A station is retrieved for the whole
+	   time window if it has no recorded times for any of the HEC-DSS file or
+	   CWMS database being stored to. A time series that had no data the last
+	   time its station was retrieved doesn't hold back the others. The
+	   interval of each regular time series is recorded with its last time
+	   and is used when too few values are retrieved to determine it.
+
+  * --overlap overlap_minutes - specifies the number of minutes before the
+	   last time stored to retrieve with --incremental, so that revised data
+	   are also retrieved. Defaults to 60.
 
   * -u (or --usgs) - specifies outputting data as USGS RDB format text.
 
   * -s (or --shef) - specifies outputting data as SHEF format text.
 
+  * --shef-file shef_filename - specifies writing the SHEF text to a file
+	   instead of standard output. Relative filenames are relative to the
+	   working directory. The file is appended to if it exists.
+
+  * --shef-flush record_count - specifies the number of SHEF records to buffer
+	   before they are flushed. Defaults to 100. A value of 0 flushes the
+	   records only at the end of the program.
+
+  * --shef-rotate megabytes - specifies the size at which the SHEF file is
+	   rotated, keeping up to 5 previous files as shef_filename.1, etc.
+	   Defaults to 0, which never rotates the file.
+
   * --tzshef shef_time_zone - specifies time zone to use for SHEF messages. If
 	   not specified, the SHEF messages will be in the time zone specified in
 	   the USGS text.
@@ -59,7 +139,11 @@ Command Line
 
   * -d dss_filename (or --dss dss_filename) - specifies storing data to a
 	   HEC-DSS file. dss_filename specifies the HEC-DSS file to use. Relative
-	   filenames are relative to the working directory.
+	   filenames are relative to the working directory. The USGS qualifiers
+	   of the values are stored as quality codes: approved values are
+	   screened okay, estimated values are screened questionable,
+	   provisional values are not screened, and flagged values (e.g., Ice)
+	   are missing. The same quality codes are stored to a CWMS database.
 
   * --tzdss dss_time_zone - specifies time zone to use for data stored to a
 	   HEC-DSS file. If not specified, the data will be stored to the HEC-DSS
@@ -67,8 +151,18 @@ Command Line
 	   dss_time_zone are valid shef_time_zone values plus any valid Java time
 	   zone ID (https://en.wikipedia.org/wiki/List_of_tz_database_time_zones).
 
+  * --skip-unchanged - specifies reading each HEC-DSS record's time window
+	   before storing it and not storing the record if the HEC-DSS file
+	   already has the same values. This saves writes when most of the data
+	   retrieved are already stored, at the cost of a read of each record.
+
   * -c (or --cwms) - specifies storing data to a CWMS Oracle database
 
+  * --cwms-batch cwms_batch_size - specifies the maximum number of time series
+	   to store to a CWMS Oracle database together, on one connection. The
+	   time series of a batch that can't be stored are retried once, without
+	   storing again those that were. Defaults to 50.
+
   * --rule store_rule - specifies CWMS store rule to use for data stored to a
 	  CWMS Oracle database. If not specified, REPLACE ALL will be used.
 	  Valid values for store_rule are:
@@ -139,9 +233,25 @@ Command Line
 		 + NORMAL
 		 + VERBOSE
 
+  * --log-format log_format - specifies the format of the messages generated by
+	   the program. Defaults to TEXT. Valid values for log_format are:
+		 + TEXT - time stamped lines of text
+		 + JSON - one JSON object per line with the time, level, message, and
+		   the station being processed, if any
+
   * -f (or --forget) - forget stored information about locations that were
 	   marked as "not found" in previous executions of the program
 
+  * --notfound-ttl notfound_hours - specifies the number of hours a location
+	   that the USGS reported as "not found" is skipped before checking
+	   whether the USGS has data for it again. The check is a request for the
+	   site information only, and the location is retrieved normally if the
+	   site has data. Each time the location is still not found the number
+	   of hours is doubled, up to 30 days. Defaults to 24. The USGS reports
+	   a location that has no data for the parameters requested the same
+	   way, so a location is only taken as not found if the site information
+	   request doesn't list it either.
+
   * -i input_filename (or --input input_filename) - specifies a file name to use
 	   as input instead of using the USGS NWIS web sites. If this option is
 	   used, any value specified with -h or --hours is ignored, and the entire
@@ -152,6 +262,22 @@ Command Line
 	   relative to this directory. If not specified, the current directory is
 	   used as the working directory.
 
+Python
+
+  The program can also be run from Python by importing it and creating a
+  GetUsgsEngine with the options as keyword arguments, named as in cmdlineOpts
+  and with the values used on the command line (True for the options without
+  a value), for example
+
+	engine = getusgs.GetUsgsEngine(workdir="/data", dssfile="usgs.dss", hours="48")
+	results = engine.run()
+
+  Invalid options raise a ConfigurationError. Each call to run() or
+  run_station(station) retrieves the data again, reusing the configuration
+  files (until they change), not found locations, and cached responses of the
+  previous runs. Engines keep no state outside themselves, so several may run
+  at once in different threads, e.g., for different DSS files.
+
 More information can be found at: https://cwms.usace.army.mil/dokuwiki/doku.php?id=usgs_data_retrieval:getusgs
 
 '''
@@ -287,19 +413,34 @@ from hec.script      import Constants
 from java.lang       import System
 from java.text       import SimpleDateFormat
 from java.util       import Calendar
+from java.util       import Date
 from java.util       import TimeZone
-import anydbm
+from rtsutils.usgs   import cache
+from rtsutils.usgs   import notfound as notfoundStore
+from rtsutils.usgs   import rdbvalues
+from rtsutils.usgs   import watermarks as watermarkStore
+from rtsutils.utils  import hectime
+from rtsutils.utils  import http
+from rtsutils.utils  import retry
+from rtsutils.utils  import shef
+from rtsutils.utils  import timeseries
+from rtsutils.utils  import tsbuilder
 import array
+import cPickle
 import getopt
+import hashlib
+import json
 import os
-import urllib
+import Queue
+import re
+import threading
 import string
-import StringIO
 import sys
 import time
 import traceback
 import types
 import operator
+import urllib2
 #-------------#
 # "constants" #
 #-------------#
@@ -307,50 +448,42 @@ A,B,C,D,E,F = 1,2,3,4,5,6
 IRREGULAR_INTERVAL = -1
 USGS_TEXT, SHEF_TEXT, DSS_FILE, CWMS_DB = 1, 2, 4, 8
 NONE, NORMAL, VERBOSE = 0, 1, 2
+OUTPUT_LEVELS = {"NONE" : NONE, "NORMAL" : NORMAL, "VERBOSE" : VERBOSE}
 URL_TEMPLATE_REL = "https://waterdata.usgs.gov/nwis/iv/?format=rdb,1.0&site=%s&period=PT%dH"
 URL_TEMPLATE_ABS = "https://waterdata.usgs.gov/nwis/iv/?format=rdb,1.0&site=%s&startDT=%s&endDT=%s"
+URL_TEMPLATE_BEG = "https://waterdata.usgs.gov/nwis/iv/?format=rdb,1.0&site=%s&startDT=%s"
+URL_TEMPLATE_SITE = "https://waterdata.usgs.gov/nwis/site/?format=rdb&site=%s&siteStatus=active&hasDataTypeCd=iv"
+MAX_URL_LENGTH   = 2000
+NOT_FOUND_TEXT   = "No sites/data found using the selection criteria specified"
+DSS_QUEUE_LIMIT  = 500
+BREAKER_THRESHOLD = 5
+BREAKER_RESET    = 60
+NOTFOUND_MAX_TTL = 30 * 86400
+CONFIG_SNAPSHOT_VERSION = 1
+CHUNK_WORKERS    = 4
+MIN_DETECT_VALUES = 5
+ISO_8601_FORMAT  = "yyyy-MM-dd'T'HH:mmX"
 #------------------#
 # program defaults #
 #------------------#
 programVersion     = "3.1"
 programDate        = "01-SEP-2021"
-programName        = os.path.abspath(sys.argv[0])
-programDir         = os.path.dirname(programName)
-dbmFilename        = os.path.join(programDir, "getUsgs.notfound")
-locationsFilename  = "Locations.csv"
-parametersFilename = "Parameters.csv"
-paramAliasFilename = "Parameter_Aliases.csv"
+programDir         = os.path.dirname(os.path.abspath(__file__))
 dfltRetryCount     = 5
-retryCount         = None
-usgsSpec           = None
-dssspec            = None
-shefSpec           = None
-cwmsSpec           = None
-shefTimezone       = None
-dssFilename        = None
-dssTimezone        = None
-inputFilename      = None
-storeRule          = "REPLACE ALL"
-outputFormat       = NONE
-outputLevel        = NORMAL
+dfltRetryBudget    = 100
+dfltWorkerCount    = 1
+dfltBatchSize      = 1
+dfltChunkDays      = 30
+dfltCwmsBatchSize  = 50
+dfltCacheTtl       = 15
+dfltOverlap        = 60
+dfltShefFlush      = 100
 dfltHourCount      = 24
-hourCount          = None
-forget             = False
-workdir            = None
-beginTime          = None
-endTime            = None
-timeZone           = TimeZone.getDefault()
+dfltNotfoundTtl    = 24
 agencies           = ["USGS", "USCE"]
 #-----------------------#
 # other initializations #
 #-----------------------#
-startTime          = time.time()
-dssfile            = None
-db                 = None
-errorLines         = []
-notfoundDb         = anydbm.open(dbmFilename, "c")
-storeToCwmsDbSuccessful = None
-successful, nodata, notfound, haserror = [], [], [], []
 storeRules = [
 	"REPLACE ALL",
 	"DO NOT REPLACE",
@@ -378,23 +511,39 @@ tzInfo = {
 timezoneNames = tzInfo.keys()
 timezoneNames.sort()
 #--------------------------#
-# process the command line #
+# command line options     #
 #--------------------------#
 cmdlineOpts = {
 	"locationsfile"  : {"short" : "l:", "long" : "locations=" },
 	"parametersfile" : {"short" : "p:", "long" : "parameters="},
 	"aliasfile"      : {"short" : "a:", "long" : "aliases="   },
 	"retrycount"     : {"short" : "r:", "long" : "retries="   },
+	"retrybudget"    : {"short" : "",   "long" : "retry-budget=" },
+	"workercount"    : {"short" : "",   "long" : "workers="   },
+	"batchsize"      : {"short" : "",   "long" : "batch="     },
+	"cwmsbatchsize"  : {"short" : "",   "long" : "cwms-batch="},
+	"chunkdays"      : {"short" : "",   "long" : "chunk-days="},
+	"intervalpolicy" : {"short" : "",   "long" : "interval="  },
+	"cachedir"       : {"short" : "",   "long" : "cache-dir=" },
+	"cachettl"       : {"short" : "",   "long" : "cache-ttl=" },
+	"incremental"    : {"short" : "",   "long" : "incremental"},
+	"overlap"        : {"short" : "",   "long" : "overlap="   },
 	"usgsspec"       : {"short" : "u",  "long" : "usgs"       },
 	"shefspec"       : {"short" : "s",  "long" : "shef"       },
 	"cwmsspec"       : {"short" : "c",  "long" : "cwms"       },
 	"dssfile"        : {"short" : "d:", "long" : "dss="       },
 	"hours"          : {"short" : "h:", "long" : "hours="     },
 	"output"         : {"short" : "o:", "long" : "output="    },
+	"logformat"      : {"short" : "",   "long" : "log-format="},
 	"tzshef"         : {"short" : "",   "long" : "tzshef="    },
+	"sheffile"       : {"short" : "",   "long" : "shef-file=" },
+	"shefflush"      : {"short" : "",   "long" : "shef-flush="},
+	"shefrotate"     : {"short" : "",   "long" : "shef-rotate="},
 	"tzdss"          : {"short" : "",   "long" : "tzdss="     },
+	"skipunchanged"  : {"short" : "",   "long" : "skip-unchanged"},
 	"storerule"      : {"short" : "",   "long" : "rule="      },
 	"forget"         : {"short" : "f",  "long" : "forget"     },
+	"notfoundttl"    : {"short" : "",   "long" : "notfound-ttl=" },
 	"inputfile"      : {"short" : "i:", "long" : "input="     },
 	"workdir"        : {"short" : "w:", "long" : "workdir="   },
 	"begindate"      : {"short" : "b:", "long" : "begindate=" },
@@ -404,188 +553,103 @@ cmdlineOpts = {
 cmdlineKeys = sorted(cmdlineOpts.keys())
 shortopts = "".join([cmdlineOpts[k]["short"] for k in cmdlineKeys if cmdlineOpts[k]["short"]])
 longopts = [cmdlineOpts[k]["long"] for k in cmdlineKeys if cmdlineOpts[k]["long"]]
-cmdlineSpecs = {}
-opts, args = [], []
-try :
-	opts, args = getopt.getopt(sys.argv[1:], shortopts, longopts)
-except Exception, e:
-	errorLines.append("Invalid command line: %s" % str(e))
-for opt, val in opts :
-	for k in cmdlineKeys :
-		if opt.strip("-") in map(lambda s : s.strip("=:"), cmdlineOpts[k].values()) :
-			cmdlineSpecs[k] = val.strip("=")
-			break
-if args :
-	errorLines.append("Unexpected command line argument(s): %s" % ",".join(args))
-#---------------------------------------------#
-# override program defaults from command line #
-#---------------------------------------------#
-if cmdlineSpecs.has_key("locationsfile")  : locationsFilename  = cmdlineSpecs["locationsfile"]
-if cmdlineSpecs.has_key("parametersfile") : parametersFilename = cmdlineSpecs["parametersfile"]
-if cmdlineSpecs.has_key("aliasfile")      : paramAliasFilename = cmdlineSpecs["aliasfile"]
-if cmdlineSpecs.has_key("retrycount")     : retryCount         = cmdlineSpecs["retrycount"]
-if cmdlineSpecs.has_key("usgsspec")       : usgsSpec           = cmdlineSpecs["usgsspec"]
-if cmdlineSpecs.has_key("dssfile")        : dssFilename        = cmdlineSpecs["dssfile"]
-if cmdlineSpecs.has_key("shefspec")       : shefSpec           = cmdlineSpecs["shefspec"]
-if cmdlineSpecs.has_key("cwmsspec")       : cwmsSpec           = cmdlineSpecs["cwmsspec"]
-if cmdlineSpecs.has_key("hours")          : hourCount          = cmdlineSpecs["hours"]
-if cmdlineSpecs.has_key("output")         : outputLevel        = cmdlineSpecs["output"].upper()
-if cmdlineSpecs.has_key("tzshef")         : shefTimezone       = cmdlineSpecs["tzshef"].upper()
-if cmdlineSpecs.has_key("tzdss")          : dssTimezone        = cmdlineSpecs["tzdss"].upper()
-if cmdlineSpecs.has_key("storerule")      : storeRule          = cmdlineSpecs["storerule"].upper()
-if cmdlineSpecs.has_key("forget")         : forget             = True
-if cmdlineSpecs.has_key("inputfile")      : inputFilename      = cmdlineSpecs["inputfile"]
-if cmdlineSpecs.has_key("workdir")        : workdir            = cmdlineSpecs["workdir"]
-if cmdlineSpecs.has_key("begindate")      : beginTime          = cmdlineSpecs["begindate"]
-if cmdlineSpecs.has_key("enddate")        : endTime            = cmdlineSpecs["enddate"]
-if cmdlineSpecs.has_key("timezone")       : timeZone           = TimeZone.getTimeZone(cmdlineSpecs["timezone"])
-#-----------------#
-# process workdir #
-#-----------------#
-if workdir is None : workdir = programDir
-workdir = os.path.abspath(workdir)
-if not os.path.isabs(locationsFilename)  : locationsFilename  = os.path.join(workdir, locationsFilename)
-if not os.path.isabs(parametersFilename) : parametersFilename = os.path.join(workdir, parametersFilename)
-if not os.path.isabs(paramAliasFilename) : paramAliasFilename = os.path.join(workdir, paramAliasFilename)
-if dssFilename :
-	if not os.path.isabs(dssFilename) : dssFilename = os.path.join(workdir, dssFilename)
-if inputFilename :
-	if not os.path.isabs(inputFilename) : inputFilename = os.path.join(workdir, inputFilename)
-#---------------------------------#
-# setup for input time processing #
-#---------------------------------#
-cal = Calendar.getInstance()
-sdfHecTime = SimpleDateFormat("ddMMMyyyy, HH:mm")
-sdfIso8601 = SimpleDateFormat("yyyy-MM-dd'T'HH:mmX")
-for sdf in sdfHecTime, sdfIso8601 : sdf.setTimeZone(timeZone)
-#-----------------------------#
-# validate command line specs #
-#-----------------------------#
-if type(outputLevel) == types.StringType :
-	if outputLevel not in ("NONE", "NORMAL", "VERBOSE") :
-		errorLines.append("Invalid output level (%s), must be NONE, NORMAL, or VERBOSE ")
-	outputLevel = eval(outputLevel)
-if not locationsFilename :
-	errorLines.append("Locations file parameter specified without file name")
-elif not os.path.exists(locationsFilename) or not os.path.isfile(locationsFilename) :
-	errorLines.append("Locations file does not exist: %s" % locationsFilename)
-if not parametersFilename :
-	errorLines.append("Parameters file parameter specified without file name")
-elif not os.path.exists(parametersFilename) or not os.path.isfile(parametersFilename) :
-	errorLines.append("Parameters file does not exist: %s" % parametersFilename)
-if not paramAliasFilename :
-	errorLines.append("Parameter alias file parameter specified without file name")
-elif not os.path.exists(paramAliasFilename) or not os.path.isfile(paramAliasFilename) :
-	errorLines.append("Parameter alias file does not exist: %s" % paramAliasFilename)
-if retryCount is None :
-	retryCount = dfltRetryCount
-else :
-	try :
-		retryCount = int(retryCount)
-		if not 0 <= retryCount < 100 :
-			errorLines.append("Retry count must be in the range of [0..99]")
-	except :
-		errorLines.append("Invalid retry count parameter {}".format(retryCount))
-if dssFilename is not None :
-	outputFormat |= DSS_FILE
-	if os.path.exists(dssFilename) and not os.path.isfile(dssFilename) :
-		errorLines.append("DSS parameter specified with invalid file name")
-if usgsSpec is not None :
-	outputFormat |= USGS_TEXT
-if shefSpec is not None :
-	outputFormat |= SHEF_TEXT
-if cwmsSpec is not None :
-	outputFormat |= CWMS_DB
-if shefTimezone is not None and shefTimezone not in timezoneNames :
-	errorLines.append("SHEF time zone (%s) not in valid time zones (%s)" % (shefTimezone, ",".join(timezoneNames)))
-if storeRule is not None and storeRule not in storeRules :
-	errorLines.append("CWMS store rule (%s) not in valid store rules (%s)" % (storeRule, ",".join(storeRules)))
-if hourCount is None :
-	hourCount = dfltHourCount
-else :
-	if beginTime is not None and endTime is not None :
-		errorLines.append("Can specify only zero, one, or two of hours, begindate, and enddate - all three are specified")
-	else :
-		try :
-			hourCount = int(hourCount)
-		except :
-			errorLines.append("Invalid hour count parameter: %s" % hourCount)
-		else :
-			if hourCount < 1 :
-				errorLines.append("Hour count (%d) must be greater than 0")
-if beginTime is not None :
-	t = HecTime()
-	try :
-		if t.set(beginTime) != 0 : raise Exception
-		if not t.isTimeDefined() : t.set("%s 00:00" % beginTime)
-		cal.setTime(sdfHecTime.parse(t.dateAndTime(4)))
-		beginTime = sdfIso8601.format(cal.getTime())
-	except :
-		errorLines.append("Invalid beginddate format: %s" % beginTime)
-if endTime is not None :
-	t = HecTime()
-	try :
-		if t.set(endTime) != 0 : raise Exception
-		if not t.isTimeDefined() : t.set("%s 24:00" % endTime)
-		cal.setTime(sdfHecTime.parse(t.dateAndTime(4)))
-		endTime = sdfIso8601.format(cal.getTime())
-	except :
-		errorLines.append("Invalid endddate format: %s" % endTime)
-if not outputFormat :
-	errorLines.append("No output format(s) specified")
-if inputFilename is not None :
-	if not os.path.isfile(inputFilename) :
-		errorLines.append("Invalid input file specified")
-if not os.path.isdir(workdir) :
-	errorLines.append("Invalid working directory specified")
-
-if errorLines :
-	sys.stderr.write(__doc__)
-	sys.stderr.write("***\n")
-	for errorLine in errorLines :
-		sys.stderr.write("*** ERROR : %s\n" % errorLine)
-	sys.stderr.write("***\n")
-	System.exit(-1)
-os.chdir(workdir)
-#-----------------------#
-# normalize time window #
-#-----------------------#
-if beginTime and not endTime :
-	cal.setTime(sdfIso8601.parse(beginTime))
-	cal.add(Calendar.HOUR_OF_DAY, hourCount)
-	endTime = sdfIso8601.format(cal.getTime())
-elif endTime and not beginTime :
-	cal.setTime(sdfIso8601.parse(endTime))
-	cal.add(Calendar.HOUR_OF_DAY, -hourCount)
-	beginTime = sdfIso8601.format(cal.getTime())
 #----------------------#
 # function definitions #
 #----------------------#
 class Logger :
-	def __init__(self) :
+	'''
+	Leveled logger. The normal() and verbose() methods format their message
+	only if the level is enabled, and output() writes regardless of the level
+	for callers that have already checked it. Messages are buffered and
+	written to the stream every bufferSize characters and by flush(). In JSON
+	mode each message is written as one JSON object per line with its time,
+	level, and the fields of the current thread's context (the station).
+	'''
+	def __init__(self, stream, level=NORMAL, jsonLines=False, bufferSize=8192) :
+		self.stream      = stream
+		self.level       = level
+		self.jsonLines   = jsonLines
+		self.bufferSize  = bufferSize
+		self.buffer      = []
+		self.buffered    = 0
 		self.lastnewline = True
+		self.second      = None
+		self.stamps      = None
+		self.lock        = threading.Lock()
+		self.context     = threading.local()
+
+	def normal(self, message, *args) :
+		if self.level >= NORMAL : self.write(NORMAL, message, args)
+
+	def verbose(self, message, *args) :
+		if self.level >= VERBOSE : self.write(VERBOSE, message, args)
 
 	def output(self, text, newline=True) :
-		buf = StringIO.StringIO()
-		linesSkipped = 0
-		for c in text :
-			if c != "\n" : break
-			linesSkipped += 1
-		buf.write("\n" * linesSkipped)
-		for line in text[linesSkipped:].split("\n") :
-			if self.lastnewline :
-				buf.write(time.ctime() + " : ")
-			buf.write(line + "\n")
-		output = buf.getvalue()
-		buf.close()
-		if not newline :
-			sys.stderr.write(output[:-1])
+		self.write(NORMAL, text, None, newline)
+
+	def setContext(self, **fields) :
+		'''
+		Set the fields added to the JSON messages of the current thread
+		'''
+		self.context.fields = fields
+
+	def write(self, level, message, args, newline=True) :
+		if args : message = message % args
+		self.lock.acquire()
+		try :
+			if self.jsonLines :
+				self._writeJson(level, message)
+			else :
+				self._writeText(message, newline)
+			if self.buffered >= self.bufferSize : self._flush()
+		finally :
+			self.lock.release()
+
+	def flush(self) :
+		self.lock.acquire()
+		try :
+			self._flush()
+		finally :
+			self.lock.release()
+
+	def _flush(self) :
+		if self.buffer :
+			self.stream.write("".join(self.buffer))
+			self.buffer = []
+			self.buffered = 0
+		self.stream.flush()
+
+	def _timestamps(self) :
+		'''
+		The ctime and ISO 8601 time stamps, formatted once per second
+		'''
+		now = int(time.time())
+		if now != self.second :
+			self.second = now
+			self.stamps = (time.ctime(now), time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)))
+		return self.stamps
+
+	def _writeText(self, text, newline) :
+		body = text.lstrip("\n")
+		if self.lastnewline :
+			prefix = self._timestamps()[0] + " : "
 		else :
-			sys.stderr.write(output)
+			prefix = ""
+		output = "\n" * (len(text) - len(body)) + "".join([prefix + line + "\n" for line in body.split("\n")])
+		if not newline : output = output[:-1]
+		self.buffer.append(output)
+		self.buffered += len(output)
 		self.lastnewline = newline
 
-log = Logger()
-
+	def _writeJson(self, level, message) :
+		message = message.strip("\n")
+		if not message : return
+		record = {"time" : self._timestamps()[1], "level" : ("NONE", "NORMAL", "VERBOSE")[level], "message" : message}
+		fields = getattr(self.context, "fields", None)
+		if fields : record.update(fields)
+		output = json.dumps(record) + "\n"
+		self.buffer.append(output)
+		self.buffered += len(output)
 def fmtFloat(v) :
 	'''
 	Format a floating-point to remove trailing zeros after decimal
@@ -596,741 +660,2192 @@ def fmtFloat(v) :
 		if val[-1] == '.' : val = val[:-1]
 	return val
 
+quotePattern = re.compile("[\'\"]")
+
 def parseCsv(line) :
-	quoteChar = None
-	chars = list(zip(*line)[0])
-	for i in range(len(line)) :
-		if chars[i] in '\'"' :
+	'''
+	Split a CSV line into fields. Commas within single or double quotes don't
+	split fields, double quotes are removed, and the brackets around a field
+	(e.g., "[USGS_LOC]") are removed.
+	'''
+	fields = line.split(",")
+	if '"' in line or "'" in line :
+		#-------------------------------------------------#
+		# rejoin the fields split at commas within quotes #
+		#-------------------------------------------------#
+		joined = []
+		quoteChar = None
+		for field in fields :
 			if quoteChar :
-				if chars[i] == quoteChar : quoteChar = None
+				joined[-1] += "," + field
 			else :
-				quoteChar = chars[i]
-		elif chars[i] == ',' and not quoteChar :
-			chars[i] = '\0'
-	fields = ''.join(chars).replace('"', '').split('\0')
+				joined.append(field)
+			for c in quotePattern.findall(field) :
+				if quoteChar :
+					if c == quoteChar : quoteChar = None
+				else :
+					quoteChar = c
+		fields = [field.replace('"', '') for field in joined]
 	for i in range(len(fields)) :
-		if len(fields[i]) > 0 and fields[i][0] == '[' and fields[i][-1] == ']' :
+		if fields[i][:1] == '[' and fields[i][-1:] == ']' :
 			fields[i] = fields[i][1:-1]
 	return fields
 
-def outputShefRecord(record, maxLen = 80) :
+def fileDigest(filename) :
 	'''
-	Output as shef record, splitting it as necessary
+	The MD5 digest of a file's contents
 	'''
-	recordType = record[1]
-	i = 0
-	while len(record) > maxLen :
-		i += 1
-		last = record[:maxLen].rfind("/")
-		last += 1
-		sys.stdout.write("%s\n" % record[:last])
-		record = ".%s%d %s" % (recordType, i % 10, record[last:])
-	sys.stdout.write("%s\n" % record)
-	sys.stdout.flush()
-
-def getData(station, seq=None, total=None) :
+	f = open(filename, 'rb')
+	try :
+		return hashlib.md5(f.read()).hexdigest()
+	finally :
+		f.close()
+
+def readConfigSnapshot(snapshotFilename, configFiles) :
 	'''
-	Get the rdb-formatted table from the USGS
+	The configuration saved in a snapshot by writeConfigSnapshot(), or None if
+	there isn't a snapshot of this version for the configuration files as they
+	are now. A file whose time has changed but whose contents haven't is still
+	current.
 	'''
-	connection = None
-	data = None
-	if beginTime and endTime :
-		url = URL_TEMPLATE_ABS % (station, beginTime, endTime)
-	else:
-		url = URL_TEMPLATE_REL % (station, hourCount)
-	if outputLevel > NONE :
-		if seq and total :
-			log.output("\nRetrieving data for station %s (%d of %d)" % (station, seq, total))
-		else :
-			log.output("\nRetrieving data for station %s" % station)
-		log.output("URL= %s" % url)
-	for i in range(retryCount+1) :
-		try : 
-			connection = urllib.urlopen(url)
-			break
-		except : 
-			if outputLevel > NONE : log.output("*** Connection error {} ***".format(i+1))
-			time.sleep(.2)
-	if connection :			
-		data = connection.read()
-		connection.close()
-	return data
-
-def storeToCwmsDb(station, interval, tz, records, decodeInfo) :
-	global db, locations, parameters, storeToCwmsDbSuccessful
-
-	storeToCwmsDbSuccessful = False
-
-	#-----------------------------------------#
-	# delay CWMS imports until they're needed #
-	#-----------------------------------------#
-	try    : DBAPI
-	except : import DBAPI
-	try    : TimeSeriesContainer
-	except : from hec.io import TimeSeriesContainer
-
-	if not db :
-		db = DBAPI.open()
-		db.setStoreRule(storeRule)
-	paramInfo, decodeInfo = decodeInfo
-	usgsTsid, paramName = paramInfo
-	location = locations[station]["CWMS_LOC"]
-	try    : location += "-%s" % locations[station]["CWMS_SUB-LOCATIONS"][usgsTsid]
-	except : pass
-	version  = locations[station]["CWMS_VER"]
-	factor = decodeInfo["CWMS_FACTOR"]
-	unit   = decodeInfo["CWMS_UNIT"]
-	param  = decodeInfo["CWMS_PARAMETER"]
-	try    : param += "-%s" % locations[station]["CWMS_SUB-PARAMETERS"][usgsTsid]
-	except : pass
-	paramType  = decodeInfo["CWMS_TYPE"]
-	if interval == IRREGULAR_INTERVAL :
-		intvl = "0"
-	else :
-		intvl = Interval(interval).getInterval()
-	if paramType == "Inst" :
-		duration = "0"
-	else :
-		duration = intvl
-	cwmsTsid = "%s.%s.%s.%s.%s.%s" % (location, param, paramType, intvl, duration, version)
-	times, values, quality = [], [], None
-	t = HecTime()
-	for j in range(len(records)) :
-		millis, value = records[j]
-		t.setTimeInMillis(millis)
-		try    : values.append(float(value) * factor)
-		except : pass
-		else   : times.append(t.value())
-	if not times :
-		log.output("*** No values in time window for %s. ***" % cwmsTsid)
-	else :
-		if outputLevel > NONE : log.output("Storing %s (%d values)" % (cwmsTsid, len(values)))
-
-		try:
-			tsc = TimeSeriesContainer()
-			tsc.fullName     = cwmsTsid
-			tsc.location     = location
-			tsc.parameter    = param
-			tsc.type         = paramType
-			tsc.version      = version
-			tsc.interval     = interval
-			tsc.units        = unit
-			tsc.times        = times
-			tsc.values       = values
-			tsc.quality      = quality
-			tsc.numberValues = len(times)
-			tsc.startTime    = times[0]
-			tsc.endTime      = times[-1]
-			db.put(tsc)
-			storeToCwmsDbSuccessful = True
-			log.output("*** Saved record: %s to CWMS Database. ***" % cwmsTsid)
-		except:
-			log.output("*** Unable to Save record: %s to CWMS Database. ***" % cwmsTsid)
-			if outputLevel > NONE : log.output(traceback.format_exc())
-	return storeToCwmsDbSuccessful
-
-def storeToDss(_tsc, station, decodeInfo) :
-	global dssFilename, dssfile, locations, parameters
-
-	if not dssfile :
-		Heclib.zset("MLVL", "", 0)
-#         Heclib.zset("DSSV", "", 6)
-		dssfile = HecDss.open(dssFilename)
-	paramInfo, decodeInfo = decodeInfo
-	tsid, paramName = paramInfo
-	parts = ["" for i in range(8)]
-	parts[A] = locations[station]["DSS_A-PART"]
-	parts[B] = locations[station]["DSS_B-PART"]
-	try    : parts[B] += "-%s" % locations[station]["DSS_SUB-LOCATIONS"][tsid]
-	except : pass
-	parts[F] = locations[station]["DSS_F-PART"]
-	tsc = _tsc.clone()
-	parts[C] = decodeInfo["DSS_PARAMETER"]
-	try    : parts[C] += "-%s" % locations[station]["DSS_SUB-PARAMETERS"][tsid]
-	except : pass
-	if tsc.interval == IRREGULAR_INTERVAL :
-		parts[E] = "IR-MONTH"
-	else :
-		parts[E] = Interval(tsc.interval).getInterval().upper().replace("S","").replace("MINUTE","MIN").replace("MONTH","MON")
-	tsc.units = decodeInfo["DSS_UNIT"]
-	tsc.type  = decodeInfo["DSS_TYPE"]
-	tsc.fullName = "/".join(parts)
-	tsc.watershed = parts[A]
-	try    : tsc.location, tsc.subLocation = parts[B].split("-", 1)
-	except : tsc.location = parts[B]
-	try    : tsc.parameter, tsc.subParameter = parts[C].split("-", 1)
-	except : tsc.parameter = parts[B]
-	tsc.fileName = dssFilename
-	if outputLevel > NONE : log.output("Storing %s:%s (%d values)" % (tsc.fileName, tsc.fullName, tsc.numberValues))
-	dssfile.put(tsc)
-
-def makeTimeSeriesContainer(station, interval, tz, records, decodeInfo) :
-	global timezones
-	sdf = SimpleDateFormat("ddMMMyyyy, HH:mm")
-	if dssTimezone :
-		if not timezones["DSS"] :
-			if tzInfo.hasKey(dssTimezone) :
-				timezones["DSS"] = TimeZone.getTimeZone(tzInfo[dssTimezone]["JAVA"])
-			else :
-				timezones["DSS"] = TimeZone.getTimeZone(dssTimezone)
-				if timezones["DSS"].getID() != dssTimezone and outputLevel > NONE :
-					log.output("WARNING: Couldn't set DSS time zone to %s, using %s" % (dssTimezone,timezones["DSS"].getID()))
-				if timezones["DSS"].observesDaylightTime() and outputLevel > NONE :
-					log.output("WARNING: DSS time zone observes daylight saving time")
-		sdf.setTimeZone(timezones["DSS"])
-	else :
-		sdf.setTimeZone(timezones["USGS"])
-	decodeInfo = decodeInfo[1]
-	cal = Calendar.getInstance()
-	t = HecTime()
-	tsc = TimeSeriesContainer()
-	tsc.interval = interval
-	times = []
-	values = []
-	tsc.quality = None
-	factor = decodeInfo["DSS_FACTOR"]
-	for j in range(len(records)) :
-		millis, value = records[j]
-		cal.setTimeInMillis(millis)
-		t.set(sdf.format(cal.getTime()))
-		times.append(t.value())
-		try    : values.append(float(value) * factor)
-		except : values.append(Constants.UNDEFINED)
-	tsc.times = times
-	tsc.values = values
-	tsc.startTime = times[0]
-	tsc.endTime = times[-1]
-	tsc.numberValues = len(values)
-	tsc.timeZoneID = sdf.getTimeZone().getID()
-	tsc.timeZoneRawOffset = sdf.getTimeZone().getRawOffset()
-	return tsc
-
-def outputShefText(station, interval, tz, records, decodeInfo) :
+	try :
+		f = open(snapshotFilename, 'rb')
+		try :
+			version, sources, config = cPickle.load(f)
+		finally :
+			f.close()
+	except Exception :
+		return None
+	if version != CONFIG_SNAPSHOT_VERSION or len(sources) != len(configFiles) : return None
+	for (filename, mtime, size, digest), configFile in zip(sources, configFiles) :
+		if filename != configFile or os.path.getsize(configFile) != size : return None
+		if os.path.getmtime(configFile) != mtime and fileDigest(configFile) != digest : return None
+	return config
+
+def writeConfigSnapshot(snapshotFilename, configFiles, config) :
 	'''
-	Output the rdb-formatted data retrieved from the USGS
+	Save the configuration parsed from the configuration files, with their times,
+	sizes, and digests, so it can be loaded with a single read until they change
 	'''
-	global locations, timezones
-	paramInfo, decodeInfo = decodeInfo
-	tsid, paramName = paramInfo
-	cal = Calendar.getInstance()
-	sdfDate = SimpleDateFormat("yyyyMMdd")
-	sdfTime = SimpleDateFormat("HHmm")
-	if shefTimezone :
-		tz = tzInfo[shefTimezone]["SHEF"]
-		if not timezones["SHEF"] :
-			timezones["SHEF"] = TimeZone.getTimeZone(tzInfo[shefTimezone]["JAVA"])
-		for sdf in (sdfDate, sdfTime) : sdf.setTimeZone(timezones["SHEF"])
-	else :
-		for sdf in (sdfDate, sdfTime) : sdf.setTimeZone(timezones["USGS"])
-
-	recordCount = len(records)
-	if interval == IRREGULAR_INTERVAL :
-		for i in range(recordCount) :
-			cal.setTimeInMillis(records[i][0])
-			record = ".A %s %8s" % (locations[station]["SHEF_LOC"], sdfDate.format(cal.getTime()))
-			record += " %s DH%4s /" % (tzInfo[tz]["SHEF"], sdfTime.format(cal.getTime()))
-			try    : param = locations[station]["SHEF_PARAMETER_OVERRIDES"][tsid]
-			except : param = decodeInfo["SHEF_PARAMETER"]
-			factor = decodeInfo["SHEF_FACTOR"]
-			unitSystem = "ES"[decodeInfo["SHEF_UNIT"]]
+	sources = [(filename, os.path.getmtime(filename), os.path.getsize(filename), fileDigest(filename)) for filename in configFiles]
+	tmpFilename = "%s.%d.%s.tmp" % (snapshotFilename, os.getpid(), threading.currentThread().getName())
+	f = open(tmpFilename, 'wb')
+	try :
+		cPickle.dump((CONFIG_SNAPSHOT_VERSION, sources, config), f, cPickle.HIGHEST_PROTOCOL)
+	finally :
+		f.close()
+	if os.path.exists(snapshotFilename) : os.remove(snapshotFilename)
+	os.rename(tmpFilename, snapshotFilename)
+
+def getParameterCd(locationInfo) :
+	'''
+	The comma-separated USGS parameter codes to request for a location, from its
+	PARAMETERS (already mapped through the parameter aliases), or None to
+	request all parameters if any of them isn't a parameter code
+	'''
+	codes = sorted(set(locationInfo["PARAMETERS"]))
+	for code in codes :
+		if len(code) != 5 or not code.isdigit() : return None
+	return ",".join(codes) or None
+
+def parseCommandLine(argv) :
+	'''
+	Parse the command line arguments into the options for GetUsgsEngine, keyed
+	like cmdlineOpts, returning the options and a list of any errors. Options
+	that don't take a value are True if they're specified.
+	'''
+	cmdlineSpecs = {}
+	errorLines = []
+	opts, args = [], []
+	try :
+		opts, args = getopt.getopt(argv, shortopts, longopts)
+	except Exception, e:
+		errorLines.append("Invalid command line: %s" % str(e))
+	for opt, val in opts :
+		for k in cmdlineKeys :
+			if opt.strip("-") in map(lambda s : s.strip("=:"), cmdlineOpts[k].values()) :
+				if cmdlineOpts[k]["long"].endswith("=") :
+					cmdlineSpecs[k] = val.strip("=")
+				else :
+					cmdlineSpecs[k] = True
+				break
+	if args :
+		errorLines.append("Unexpected command line argument(s): %s" % ",".join(args))
+	return cmdlineSpecs, errorLines
+class CwmsWriter :
+	'''
+	Collect time series containers and store them to the CWMS database in
+	batches of up to batchSize on a connection that is opened (and has its store
+	rule set) once. DBAPI has no transactions, so each container is put on its
+	own, and the containers of a batch that fail are retried once as a batch of
+	their own, leaving those already stored alone. For each container
+	onStored(True) or onStored(False) is called once its outcome is known. The
+	size and latency of each batch are recorded.
+	'''
+	def __init__(self, batchSize, storeRule, log) :
+		self.batchSize = batchSize
+		self.storeRule = storeRule
+		self.log       = log
+		self.queue     = []
+		self.db        = None
+		self.latencies = []
+		self.stored    = 0
+		self.failed    = 0
+
+	def connect(self) :
+		if not self.db :
+			#-----------------------------------------#
+			# delay CWMS imports until they're needed #
+			#-----------------------------------------#
+			import DBAPI
+			self.db = DBAPI.open()
+			self.db.setStoreRule(self.storeRule)
+		return self.db
+
+	def put(self, tsc, onStored=None) :
+		self.queue.append((tsc, onStored))
+		if len(self.queue) >= self.batchSize : self.flush()
+
+	def flush(self) :
+		if not self.queue : return
+		batch, self.queue = self.queue, []
+		self.store(batch)
+
+	def store(self, batch, retry=True) :
+		start = time.time()
+		stored, failed = self.putBatch(batch)
+		elapsed = time.time() - start
+		self.latencies.append((len(batch), elapsed, not failed))
+		self.log.verbose("CWMS batch of %d time series stored in %.3f seconds, %d failed", len(batch), elapsed, len(failed))
+		for tsc, onStored in stored :
+			self.stored += 1
+			self.log.normal("*** Saved record: %s to CWMS Database. ***", tsc.fullName)
+			if onStored : onStored(True)
+		if not failed : return
+		if retry :
+			self.log.normal("*** Retrying %d time series not stored to CWMS Database. ***", len(failed))
+			self.store(failed, False)
+			return
+		for tsc, onStored in failed :
+			self.failed += 1
+			self.log.normal("*** Unable to Save record: %s to CWMS Database. ***", tsc.fullName)
+			if onStored : onStored(False)
+
+	def putBatch(self, batch) :
+		'''
+		Put the containers of a batch one after another, returning the entries of
+		the batch that were stored and those that couldn't be
+		'''
+		try :
+			db = self.connect()
+		except :
+			self.log.normal("*** Unable to connect to CWMS Database. ***")
+			if self.log.level > NONE : self.log.output(traceback.format_exc())
+			return [], list(batch)
+		stored, failed = [], []
+		for entry in batch :
 			try :
-				record += " DU%s / %s %s /" % (unitSystem, param, fmtFloat(float(records[i][1]) * factor))
+				db.put(entry[0])
+				stored.append(entry)
 			except :
-				record += " %s M /" % (param)
-			outputShefRecord(record)
-	else :
-		cal.setTimeInMillis(records[0][0])
-		try    : param = locations[station]["SHEF_PARAMETER_OVERRIDES"][tsid]
-		except :  param = decodeInfo["SHEF_PARAMETER"]
-		factor = decodeInfo["SHEF_FACTOR"]
-		unitSystem = "ES"[decodeInfo["SHEF_UNIT"]]
-		record = ".E %s %8s" % (locations[station]["SHEF_LOC"], sdfDate.format(cal.getTime()))
-		record += " %s DH%4s / DU%s / %s /" % (tzInfo[tz]["SHEF"], sdfTime.format(cal.getTime()), unitSystem, param)
-		if interval % 60 :
-			record += " DIN+%2.2d /" % interval
+				failed.append(entry)
+				if self.log.level > NORMAL : self.log.output(traceback.format_exc())
+		return stored, failed
+
+	def close(self) :
+		try :
+			self.flush()
+		finally :
+			if self.db : self.db.close()
+class DssWriter :
+	'''
+	Queue time series containers and write them to a DSS file in pathname
+	order in a single session. With skipUnchanged, each container's window is
+	read first and the container isn't written if its data are already stored.
+	The queue is written when it reaches queueLimit containers and when the
+	writer is closed, and onStored is called for each container once it is
+	written or found unchanged. A container that can't be written is logged
+	and counted, and the rest of the queue is still written. The time spent
+	in DSS I/O is accumulated.
+	'''
+	def __init__(self, filename, log, skipUnchanged=False, queueLimit=DSS_QUEUE_LIMIT) :
+		self.filename      = filename
+		self.log           = log
+		self.skipUnchanged = skipUnchanged
+		self.queueLimit    = queueLimit
+		self.queue         = []
+		self.dssfile       = None
+		self.written       = 0
+		self.unchanged     = 0
+		self.failed        = 0
+		self.ioTime        = 0.
+
+	def put(self, tsc, onStored=None) :
+		self.queue.append((tsc.fullName, tsc, onStored))
+		if len(self.queue) >= self.queueLimit : self.flush()
+
+	def flush(self) :
+		if not self.queue : return
+		queue, self.queue = self.queue, []
+		queue.sort(key=lambda item : item[0])
+		start = time.time()
+		try :
+			if not self.dssfile :
+				Heclib.zset("MLVL", "", 0)
+#         Heclib.zset("DSSV", "", 6)
+				self.dssfile = HecDss.open(self.filename)
+			for pathname, tsc, onStored in queue :
+				try :
+					if self.skipUnchanged and self.isStored(tsc) :
+						self.log.normal("Unchanged %s:%s (%d values)", tsc.fileName, pathname, tsc.numberValues)
+						self.unchanged += 1
+					else :
+						self.log.normal("Storing %s:%s (%d values)", tsc.fileName, pathname, tsc.numberValues)
+						self.dssfile.put(tsc)
+						self.written += 1
+				except Exception, e :
+					self.log.normal("*** Unable to store %s:%s (%s) ***", tsc.fileName, pathname, str(e))
+					if self.log.level > NORMAL : self.log.output(traceback.format_exc())
+					self.failed += 1
+					continue
+				if onStored : onStored()
+		finally :
+			self.ioTime += time.time() - start
+
+	def isStored(self, tsc) :
+		'''
+		Whether the DSS file already holds the same times and values for the
+		container's pathname and time window
+		'''
+		t = HecTime()
+		t.set(tsc.startTime)
+		startTime = t.dateAndTime(4)
+		t.set(tsc.endTime)
+		endTime = t.dateAndTime(4)
+		try :
+			stored = self.dssfile.get(tsc.fullName, startTime, endTime)
+		except :
+			return False
+		if not stored or stored.numberValues != tsc.numberValues : return False
+		if str(stored.units).upper() != str(tsc.units).upper() : return False
+		if str(stored.type).upper() != str(tsc.type).upper() : return False
+		if list(stored.times) != list(tsc.times) : return False
+		if tsc.quality is not None and (stored.quality is None or list(stored.quality) != list(tsc.quality)) : return False
+		for storedValue, value in zip(stored.values, tsc.values) :
+			if abs(storedValue - value) > 1e-6 * max(1., abs(value)) : return False
+		return True
+
+	def close(self) :
+		try :
+			self.flush()
+		finally :
+			if self.dssfile : self.dssfile.done()
+class LocationResult :
+	'''
+	The outcome of retrieving and parsing the data for one location
+	'''
+	def __init__(self, location) :
+		self.location     = location
+		self.status       = None # None (parsed), "nodata", "notfound", or "haserror"
+		self.data         = None # the USGS text, only kept if it is to be output
+		self.tz           = ""
+		self.usgsTimezone = None
+		self.series       = []   # (interval, records, OutputPlan) for each time series
+		self.columns      = None # (OutputPlan, Series) for each column read, before its interval is known
+		self.partial      = False # whether some chunks of the time window weren't retrieved
+
+	def setStatus(self, status) :
+		self.status = status
+		return self
+
+class Series :
+	'''
+	The times (UTC milliseconds) and text values of one time series, with the
+	text of their qualifiers if the data has them. Once decoded, the values
+	are numbers (None where there is none) and the qualifiers are quality
+	codes. Indexing returns a (millis, value) tuple.
+	'''
+	def __init__(self, times=None, values=None, codes=None) :
+		if times is None : times = array.array('l')
+		if values is None : values = []
+		self.times   = times
+		self.values  = values
+		self.codes   = codes
+		self.quality = None
+
+	def append(self, millis, value, code=None) :
+		self.times.append(millis)
+		self.values.append(value)
+		if self.codes is not None : self.codes.append(code)
+
+	def decode(self, decoder) :
+		'''
+		Replace the text values and qualifiers with numbers and quality codes
+		'''
+		self.values, self.quality = decoder.decode(self.values, self.codes)
+		self.codes = None
+
+	def __len__(self) :
+		return len(self.times)
+
+	def __getitem__(self, i) :
+		return self.times[i], self.values[i]
+
+def mergeSeries(merged, series) :
+	'''
+	Append the text values of the series for a later chunk of the time window
+	to those merged so far, skipping any at or before the last time merged
+	(the boundary the chunks share)
+	'''
+	first = 0
+	if len(merged) :
+		last = merged.times[-1]
+		while first < len(series) and series.times[first] <= last : first += 1
+	merged.times.extend(series.times[first:])
+	merged.values.extend(series.values[first:])
+	if merged.codes is not None :
+		if series.codes is not None : merged.codes.extend(series.codes[first:])
+		else                        : merged.codes.extend([""] * (len(series) - first))
+
+class RdbBlock :
+	'''
+	A block of rdb-formatted data as read by readRdb: the comment lines that
+	precede it, its header line, the site it holds data for, and a generator
+	of its data lines. The text of the block is kept only if requested.
+	'''
+	def __init__(self, comments, header, formatLine, site, lines, keepText) :
+		self.comments = comments
+		self.header   = header
+		self.site     = site
+		self.lines    = lines
+		self.text     = None
+		if keepText :
+			self.text = comments + [line for line in (header, formatLine) if line is not None]
+
+	def rows(self) :
+		'''
+		Generator of the data lines of the block
+		'''
+		for line in self.lines :
+			if self.text is not None : self.text.append(line)
+			yield line
+
+	def drain(self) :
+		for line in self.rows() : pass
+
+	def getText(self) :
+		if self.text is None : return None
+		return "\n".join(self.text) + "\n"
+
+	def isNotFound(self) :
+		for comment in self.comments :
+			if comment.find(NOT_FOUND_TEXT) != -1 : return True
+		return False
+
+def readRdb(lines, keepText=False) :
+	'''
+	Generator that reads rdb-formatted text one line at a time from an iterable
+	of lines (an open file or URL connection) and yields an RdbBlock for each
+	header line and the data lines following it. Each block is finished before
+	the next one is read, so only one line is ever held beyond what the caller
+	keeps. Comment lines following the last block are yielded as a block
+	without a header.
+	'''
+	source  = iter(lines)
+	pending = []
+	def nextLine() :
+		if pending : return pending.pop()
+		for line in source :
+			line = line.rstrip("\r\n")
+			if line.strip() : return line
+		return None
+
+	def isDataLine(line) :
+		return line is not None and line[0] != "#" and not line.startswith("agency_cd")
+
+	def dataLines(first) :
+		if first is not None : yield first
+		while True :
+			line = nextLine()
+			if not isDataLine(line) :
+				if line is not None : pending.append(line)
+				return
+			yield line
+
+	comments = []
+	while True :
+		line = nextLine()
+		if line is None : break
+		if line[0] == "#" :
+			comments.append(line)
+			continue
+		#----------------------------------------------------------------------#
+		# the 2nd header line (e.g., "5s 15s 20d ...") is followed by the data #
+		#----------------------------------------------------------------------#
+		formatLine, first = nextLine(), None
+		if isDataLine(formatLine) :
+			first = nextLine()
+			if not isDataLine(first) :
+				if first is not None : pending.append(first)
+				first = None
 		else :
-			record += " DIH+%2.2d /" % (interval / 60)
-		for j in range(recordCount) :
+			if formatLine is not None : pending.append(formatLine)
+			formatLine = None
+		site = None
+		if first is not None :
+			fields = first.split("\t", 2)
+			if len(fields) > 1 : site = fields[1]
+		else :
+			for comment in comments :
+				matcher = re.match(r"#\s+Data provided for site (\S+)", comment)
+				if matcher : site = matcher.group(1)
+		block = RdbBlock(comments, line, formatLine, site, dataLines(first), keepText)
+		comments = []
+		yield block
+		block.drain()
+	if comments :
+		yield RdbBlock(comments, None, None, None, iter(()), keepText)
+def retrieveConcurrently(func, tasks, workers) :
+	'''
+	Generator that calls func(*task) for each of the tasks on a pool of worker
+	threads and yields the results in the order of the tasks. No more than
+	twice the number of workers tasks are in progress or waiting to be consumed
+	at any time. An exception raised by func is re-raised to the consumer when
+	its result is reached.
+	'''
+	taskQueue = Queue.Queue()
+	results   = {}
+	condition = threading.Condition()
+
+	def worker() :
+		while True :
+			item = taskQueue.get()
+			if item is None : return
+			index, task = item
+			try    : outcome = (True, func(*task))
+			except : outcome = (False, sys.exc_info())
+			condition.acquire()
 			try :
-				record += " %s /" % fmtFloat(float(records[j][1]) * factor)
-			except :
-				record += " M /"
-		outputShefRecord(record)
+				results[index] = outcome
+				condition.notifyAll()
+			finally :
+				condition.release()
+
+	threads = []
+	for i in range(workers) :
+		thread = threading.Thread(target=worker, name="getUsgs-worker-%d" % (i+1))
+		thread.setDaemon(True)
+		thread.start()
+		threads.append(thread)
+	submitted = 0
+	try :
+		for index in range(len(tasks)) :
+			while submitted < len(tasks) and submitted < index + 2 * workers :
+				taskQueue.put((submitted, tasks[submitted]))
+				submitted += 1
+			condition.acquire()
+			try :
+				while not results.has_key(index) : condition.wait()
+				ok, outcome = results.pop(index)
+			finally :
+				condition.release()
+			if not ok : raise outcome[0], outcome[1], outcome[2]
+			yield outcome
+	finally :
+		try :
+			while True : taskQueue.get_nowait()
+		except Queue.Empty :
+			pass
+		for thread in threads : taskQueue.put(None)
+		for thread in threads : thread.join()
+intervalNames = {}
+
+def getIntervalNames(interval) :
+	'''
+	The DSS E part and CWMS interval for an interval in minutes
+	'''
+	try :
+		return intervalNames[interval]
+	except KeyError :
+		if interval == IRREGULAR_INTERVAL :
+			names = ("IR-MONTH", "0")
+		else :
+			cwmsInterval = Interval(interval).getInterval()
+			names = (cwmsInterval.upper().replace("S","").replace("MINUTE","MIN").replace("MONTH","MON"), cwmsInterval)
+		intervalNames[interval] = names
+		return names
 
-def processLocation(location, locationInfo, seq=None, total=None) :
+class OutputPlan :
+	'''
+	How to output one time series (USGS TS_ID and parameter code) of a location:
+	the DSS pathname, CWMS time series identifier, and SHEF code with their
+	sub-locations, sub-parameters, and overrides already applied, and the units
+	and factors. Only the interval is left to fill in. Only the parts for the
+	output formats used are worked out.
+	'''
+	def __init__(self, locationInfo, tsid, paramName, paramInfo, outputFormat) :
+		self.tsid      = tsid
+		self.paramName = paramName
+		if outputFormat & SHEF_TEXT :
+			overrides = locationInfo.get("SHEF_PARAMETER_OVERRIDES", {})
+			self.shefLocation   = locationInfo["SHEF_LOC"]
+			self.shefParameter  = paramInfo["SHEF_PARAMETER"]
+			if overrides.has_key(tsid) : self.shefParameter = overrides[tsid]
+			self.shefFactor     = paramInfo["SHEF_FACTOR"]
+			self.shefUnitSystem = "ES"[paramInfo["SHEF_UNIT"]]
+		if outputFormat & DSS_FILE :
+			bPart = self.withSub(locationInfo["DSS_B-PART"], locationInfo, "DSS_SUB-LOCATIONS")
+			cPart = self.withSub(paramInfo["DSS_PARAMETER"], locationInfo, "DSS_SUB-PARAMETERS")
+			self.dssPrefix = "/%s/%s/%s//" % (locationInfo["DSS_A-PART"], bPart, cPart)
+			self.dssSuffix = "/%s/" % locationInfo["DSS_F-PART"]
+			self.dssWatershed = locationInfo["DSS_A-PART"]
+			self.dssLocation = bPart.split("-", 1)
+			self.dssParameter = cPart.split("-", 1)
+			self.dssUnit   = paramInfo["DSS_UNIT"]
+			self.dssType   = paramInfo["DSS_TYPE"]
+			self.dssFactor = paramInfo["DSS_FACTOR"]
+		if outputFormat & CWMS_DB :
+			self.cwmsLocation  = self.withSub(locationInfo["CWMS_LOC"], locationInfo, "CWMS_SUB-LOCATIONS")
+			self.cwmsParameter = self.withSub(paramInfo["CWMS_PARAMETER"], locationInfo, "CWMS_SUB-PARAMETERS")
+			self.cwmsType      = paramInfo["CWMS_TYPE"]
+			self.cwmsVersion   = locationInfo["CWMS_VER"]
+			self.cwmsUnit      = paramInfo["CWMS_UNIT"]
+			self.cwmsFactor    = paramInfo["CWMS_FACTOR"]
+			self.cwmsPrefix    = "%s.%s.%s." % (self.cwmsLocation, self.cwmsParameter, self.cwmsType)
+
+	def withSub(self, name, locationInfo, key) :
+		subs = locationInfo.get(key, {})
+		if subs.has_key(self.tsid) : return "%s-%s" % (name, subs[self.tsid])
+		return name
+
+	def dssPathname(self, interval) :
+		return self.dssPrefix + getIntervalNames(interval)[0] + self.dssSuffix
+
+	def cwmsTsid(self, interval) :
+		intvl = getIntervalNames(interval)[1]
+		if self.cwmsType == "Inst" :
+			duration = "0"
+		else :
+			duration = intvl
+		return "%s%s.%s.%s" % (self.cwmsPrefix, intvl, duration, self.cwmsVersion)
 
-	global timezones, parameters, successful, notfound, nodata, haserror, storeToCwmsDbSuccessful
+class ConfigurationError(Exception) :
+	'''
+	Invalid options for GetUsgsEngine, with a message for each in errors
+	'''
+	def __init__(self, errors) :
+		Exception.__init__(self, "\n".join(errors))
+		self.errors = errors
 
-	if os.path.isfile(location) :
-		f = open(location)
-		data = f.read().strip().replace('\r', '')
-		f.close()
-		location = os.path.splitext(os.path.basename(location))[0]
-	else :
-		data = getData(location, seq, total)
-	if not data :
-		if outputLevel > NONE : log.output("*** No data ***")
-		nodata.append(location)
-		return
-
-	tz = ""
-	tzField = None
-	paramsToOutput = locationInfo["PARAMETERS"]
-
-	if outputFormat & USGS_TEXT :
-		sys.stdout.write(data)
-
-	if data.find("No sites/data found using the selection criteria specified") != -1 :
-		if outputLevel > NONE : log.output("*** Site not found ***")
-		notfound.append(location)
-		notfoundDb[location] = "True"
-		return
-
-	if outputFormat & (SHEF_TEXT | DSS_FILE | CWMS_DB) :
-		if outputLevel > NORMAL :
-			log.output("Parsing the following data:\n---------------------------")
-			log.output("%s\n" % data)
-
-		#------------------------------------------------------------------------------#
-		# read through all the comment lines, and find the location name and time zone #
-		#------------------------------------------------------------------------------#
-		stationText = "#  USGS %s " % location
-		lines = data.replace("\r\n", "\n").split("\n")
-		for i in range(len(lines)) :
-			line = lines[i].strip()
-			if not line : continue
-			if line[0] == "#" :
-				pass
+class GetUsgsEngine :
+	'''
+	Retrieves data for the locations in the locations file from the USGS (or
+	from an input file) and outputs and/or stores it. The options are keyword
+	arguments named like the keys of cmdlineOpts, with the same values as on
+	the command line, e.g. GetUsgsEngine(locationsfile="Locations.csv",
+	dssfile="usgs.dss", hours="48"), or the options parsed from a command line
+	by parseCommandLine(). Raises ConfigurationError if any are invalid.
+
+	An engine may be run any number of times. The parameter aliases,
+	parameters, and locations files are read again only when they change, and
+	the not found locations, response cache, and circuit breaker are kept
+	between runs, so repeated runs cost only the retrieval itself.
+	'''
+	def __init__(self, **specs) :
+		self.specs = specs
+		errorLines = []
+		self.dbmFilename        = os.path.join(programDir, "getUsgs.notfound")
+		self.wmDbmFilename      = os.path.join(programDir, "getUsgs.watermarks")
+		self.locationsFilename  = "Locations.csv"
+		self.parametersFilename = "Parameters.csv"
+		self.paramAliasFilename = "Parameter_Aliases.csv"
+		self.retryCount         = None
+		self.retryBudget        = None
+		self.workerCount        = None
+		self.batchSize          = None
+		self.cwmsBatchSize      = None
+		self.chunkDays          = None
+		self.intervalPolicy     = timeseries.SMALLEST_DOMINANT
+		self.cacheDir           = None
+		self.cacheTtl           = None
+		self.incremental        = False
+		self.overlap            = None
+		usgsSpec                = None
+		shefSpec                = None
+		cwmsSpec                = None
+		self.shefTimezone       = None
+		self.shefFilename       = None
+		self.shefFlush          = None
+		self.shefRotate         = None
+		self.dssFilename        = None
+		self.dssTimezone        = None
+		self.skipUnchanged      = False
+		self.inputFilename      = None
+		self.storeRule          = "REPLACE ALL"
+		self.outputFormat       = NONE
+		self.outputLevel        = NORMAL
+		self.logFormat          = "TEXT"
+		self.hourCount          = None
+		self.forget             = False
+		self.notfoundTtl        = None
+		self.workdir            = None
+		self.beginTime          = None
+		self.endTime            = None
+		self.timeZone           = TimeZone.getDefault()
+		#---------------------------------------------#
+		# override program defaults from command line #
+		#---------------------------------------------#
+		if specs.has_key("locationsfile")  : self.locationsFilename  = specs["locationsfile"]
+		if specs.has_key("parametersfile") : self.parametersFilename = specs["parametersfile"]
+		if specs.has_key("aliasfile")      : self.paramAliasFilename = specs["aliasfile"]
+		if specs.has_key("retrycount")     : self.retryCount         = specs["retrycount"]
+		if specs.has_key("retrybudget")    : self.retryBudget        = specs["retrybudget"]
+		if specs.has_key("workercount")    : self.workerCount        = specs["workercount"]
+		if specs.has_key("batchsize")      : self.batchSize          = specs["batchsize"]
+		if specs.has_key("cwmsbatchsize")  : self.cwmsBatchSize      = specs["cwmsbatchsize"]
+		if specs.has_key("chunkdays")      : self.chunkDays          = specs["chunkdays"]
+		if specs.has_key("intervalpolicy") : self.intervalPolicy     = specs["intervalpolicy"].lower()
+		if specs.has_key("cachedir")       : self.cacheDir           = specs["cachedir"]
+		if specs.has_key("cachettl")       : self.cacheTtl           = specs["cachettl"]
+		if specs.has_key("incremental")    : self.incremental        = bool(specs["incremental"])
+		if specs.has_key("overlap")        : self.overlap            = specs["overlap"]
+		if specs.has_key("usgsspec")       : usgsSpec                = specs["usgsspec"]
+		if specs.has_key("dssfile")        : self.dssFilename        = specs["dssfile"]
+		if specs.has_key("shefspec")       : shefSpec                = specs["shefspec"]
+		if specs.has_key("cwmsspec")       : cwmsSpec                = specs["cwmsspec"]
+		if specs.has_key("hours")          : self.hourCount          = specs["hours"]
+		if specs.has_key("output")         : self.outputLevel        = specs["output"].upper()
+		if specs.has_key("logformat")      : self.logFormat          = specs["logformat"].upper()
+		if specs.has_key("tzshef")         : self.shefTimezone       = specs["tzshef"].upper()
+		if specs.has_key("sheffile")       : self.shefFilename       = specs["sheffile"]
+		if specs.has_key("shefflush")      : self.shefFlush          = specs["shefflush"]
+		if specs.has_key("shefrotate")     : self.shefRotate         = specs["shefrotate"]
+		if specs.has_key("tzdss")          : self.dssTimezone        = specs["tzdss"].upper()
+		if specs.has_key("skipunchanged")  : self.skipUnchanged      = bool(specs["skipunchanged"])
+		if specs.has_key("storerule")      : self.storeRule          = specs["storerule"].upper()
+		if specs.has_key("forget")         : self.forget             = bool(specs["forget"])
+		if specs.has_key("notfoundttl")    : self.notfoundTtl        = specs["notfoundttl"]
+		if specs.has_key("inputfile")      : self.inputFilename      = specs["inputfile"]
+		if specs.has_key("workdir")        : self.workdir            = specs["workdir"]
+		if specs.has_key("begindate")      : self.beginTime          = specs["begindate"]
+		if specs.has_key("enddate")        : self.endTime            = specs["enddate"]
+		if specs.has_key("timezone")       : self.timeZone           = TimeZone.getTimeZone(specs["timezone"])
+		#-----------------#
+		# process workdir #
+		#-----------------#
+		if self.workdir is None : self.workdir = programDir
+		self.workdir = os.path.abspath(self.workdir)
+		if not os.path.isabs(self.locationsFilename)  : self.locationsFilename  = os.path.join(self.workdir, self.locationsFilename)
+		if not os.path.isabs(self.parametersFilename) : self.parametersFilename = os.path.join(self.workdir, self.parametersFilename)
+		if not os.path.isabs(self.paramAliasFilename) : self.paramAliasFilename = os.path.join(self.workdir, self.paramAliasFilename)
+		if self.dssFilename :
+			if not os.path.isabs(self.dssFilename) : self.dssFilename = os.path.join(self.workdir, self.dssFilename)
+		if self.shefFilename :
+			if not os.path.isabs(self.shefFilename) : self.shefFilename = os.path.join(self.workdir, self.shefFilename)
+		if self.inputFilename :
+			if not os.path.isabs(self.inputFilename) : self.inputFilename = os.path.join(self.workdir, self.inputFilename)
+		if self.cacheDir :
+			if not os.path.isabs(self.cacheDir) : self.cacheDir = os.path.join(self.workdir, self.cacheDir)
+		#---------------------------------#
+		# setup for input time processing #
+		#---------------------------------#
+		cal = Calendar.getInstance()
+		self.sdfHecTime = SimpleDateFormat("ddMMMyyyy, HH:mm")
+		self.sdfIso8601 = SimpleDateFormat(ISO_8601_FORMAT)
+		for sdf in self.sdfHecTime, self.sdfIso8601 : sdf.setTimeZone(self.timeZone)
+		#-----------------------------#
+		# validate command line specs #
+		#-----------------------------#
+		if isinstance(self.outputLevel, types.StringTypes) :
+			if OUTPUT_LEVELS.has_key(self.outputLevel) :
+				self.outputLevel = OUTPUT_LEVELS[self.outputLevel]
 			else :
-				break
+				errorLines.append("Invalid output level (%s), must be NONE, NORMAL, or VERBOSE" % self.outputLevel)
+				self.outputLevel = NORMAL
+		if self.logFormat not in ("TEXT", "JSON") :
+			errorLines.append("Invalid log format (%s), must be TEXT or JSON" % self.logFormat)
+		if not self.locationsFilename :
+			errorLines.append("Locations file parameter specified without file name")
+		elif not os.path.exists(self.locationsFilename) or not os.path.isfile(self.locationsFilename) :
+			errorLines.append("Locations file does not exist: %s" % self.locationsFilename)
+		if not self.parametersFilename :
+			errorLines.append("Parameters file parameter specified without file name")
+		elif not os.path.exists(self.parametersFilename) or not os.path.isfile(self.parametersFilename) :
+			errorLines.append("Parameters file does not exist: %s" % self.parametersFilename)
+		if not self.paramAliasFilename :
+			errorLines.append("Parameter alias file parameter specified without file name")
+		elif not os.path.exists(self.paramAliasFilename) or not os.path.isfile(self.paramAliasFilename) :
+			errorLines.append("Parameter alias file does not exist: %s" % self.paramAliasFilename)
+		if self.retryCount is None :
+			self.retryCount = dfltRetryCount
 		else :
-			if outputLevel > NONE : log.output("*** No values ***")
-			nodata.append(location)
-			return
-
-		#-----------------------------------------------------#
-		# process the 1st header line, describing field names #
-		#-----------------------------------------------------#
-		fields = lines[i].split()
-		fieldCount = len(fields)
-		if fieldCount < 3 or " ".join(fields[:3]) != "agency_cd site_no datetime" :
-			if outputLevel > NONE :
-				log.output("*** Unexpected format on header line 1 ***")
-				log.output("%s" % lines[i])
-			haserror.append(location)
-			return
-		paramCount = fieldCount - 3
-		if paramCount < 1 :
-			if outputLevel > NONE : log.output("*** No parameters ***")
-			nodata.append(location)
-			return
-
-		paramNames = fields[:]
-		fieldsToOutput = []
-		decodeInfo = []
-		for j in range(3, len(paramNames)) :
-			if paramNames[j] == "tz_cd" :
-				tzField = j
+			try :
+				self.retryCount = int(self.retryCount)
+				if not 0 <= self.retryCount < 100 :
+					errorLines.append("Retry count must be in the range of [0..99]")
+			except :
+				errorLines.append("Invalid retry count parameter {}".format(self.retryCount))
+		if self.retryBudget is None :
+			self.retryBudget = dfltRetryBudget
+		else :
+			try :
+				self.retryBudget = int(self.retryBudget)
+				if self.retryBudget < 0 :
+					errorLines.append("Retry budget must not be negative")
+			except :
+				errorLines.append("Invalid retry budget parameter: %s" % self.retryBudget)
+		if self.workerCount is None :
+			self.workerCount = dfltWorkerCount
+		else :
+			try :
+				self.workerCount = int(self.workerCount)
+				if not 1 <= self.workerCount <= 32 :
+					errorLines.append("Worker count must be in the range of [1..32]")
+			except :
+				errorLines.append("Invalid worker count parameter: %s" % self.workerCount)
+		if self.batchSize is None :
+			self.batchSize = dfltBatchSize
+		else :
+			try :
+				self.batchSize = int(self.batchSize)
+				if not 1 <= self.batchSize <= 100 :
+					errorLines.append("Batch size must be in the range of [1..100]")
+			except :
+				errorLines.append("Invalid batch size parameter: %s" % self.batchSize)
+		if self.chunkDays is None :
+			self.chunkDays = dfltChunkDays
+		else :
+			try :
+				self.chunkDays = int(self.chunkDays)
+				if not 0 <= self.chunkDays <= 366 :
+					errorLines.append("Chunk days must be in the range of [0..366]")
+			except :
+				errorLines.append("Invalid chunk days parameter: %s" % self.chunkDays)
+		if self.cwmsBatchSize is None :
+			self.cwmsBatchSize = dfltCwmsBatchSize
+		else :
+			try :
+				self.cwmsBatchSize = int(self.cwmsBatchSize)
+				if not 1 <= self.cwmsBatchSize <= 1000 :
+					errorLines.append("CWMS batch size must be in the range of [1..1000]")
+			except :
+				errorLines.append("Invalid CWMS batch size parameter: %s" % self.cwmsBatchSize)
+		if self.intervalPolicy not in timeseries.POLICIES.keys() :
+			errorLines.append("Interval policy (%s) not in valid interval policies (%s)" % (self.intervalPolicy, ",".join(sorted(timeseries.POLICIES.keys())).upper()))
+		if self.cacheDir is not None :
+			if not self.cacheDir :
+				errorLines.append("Cache directory parameter specified without directory name")
+			elif os.path.exists(self.cacheDir) and not os.path.isdir(self.cacheDir) :
+				errorLines.append("Cache directory parameter specified with invalid directory name")
+		if self.cacheTtl is None :
+			self.cacheTtl = dfltCacheTtl
+		else :
+			try :
+				self.cacheTtl = int(self.cacheTtl)
+				if self.cacheTtl < 0 :
+					errorLines.append("Cache time to live must not be negative")
+			except :
+				errorLines.append("Invalid cache time to live parameter: %s" % self.cacheTtl)
+		if self.notfoundTtl is None :
+			self.notfoundTtl = dfltNotfoundTtl
+		else :
+			try :
+				self.notfoundTtl = int(self.notfoundTtl)
+				if self.notfoundTtl < 0 :
+					errorLines.append("Not found time to live must not be negative")
+			except :
+				errorLines.append("Invalid not found time to live parameter: %s" % self.notfoundTtl)
+		if self.overlap is None :
+			self.overlap = dfltOverlap
+		else :
+			try :
+				self.overlap = int(self.overlap)
+				if self.overlap < 0 :
+					errorLines.append("Overlap must not be negative")
+			except :
+				errorLines.append("Invalid overlap parameter: %s" % self.overlap)
+		if self.dssFilename is not None :
+			self.outputFormat |= DSS_FILE
+			if os.path.exists(self.dssFilename) and not os.path.isfile(self.dssFilename) :
+				errorLines.append("DSS parameter specified with invalid file name")
+		if usgsSpec :
+			self.outputFormat |= USGS_TEXT
+		if shefSpec :
+			self.outputFormat |= SHEF_TEXT
+		if cwmsSpec :
+			self.outputFormat |= CWMS_DB
+		if self.shefFilename is not None :
+			if not self.shefFilename :
+				errorLines.append("SHEF file parameter specified without file name")
+			elif os.path.exists(self.shefFilename) and not os.path.isfile(self.shefFilename) :
+				errorLines.append("SHEF file parameter specified with invalid file name")
+		if self.shefFlush is None :
+			self.shefFlush = dfltShefFlush
+		else :
+			try :
+				self.shefFlush = int(self.shefFlush)
+				if self.shefFlush < 0 :
+					errorLines.append("SHEF flush record count must not be negative")
+			except :
+				errorLines.append("Invalid SHEF flush record count parameter: %s" % self.shefFlush)
+		if self.shefRotate is None :
+			self.shefRotate = 0
+		else :
+			try :
+				self.shefRotate = float(self.shefRotate)
+				if self.shefRotate < 0 :
+					errorLines.append("SHEF rotation size must not be negative")
+			except :
+				errorLines.append("Invalid SHEF rotation size parameter: %s" % self.shefRotate)
+		if self.shefTimezone is not None and self.shefTimezone not in timezoneNames :
+			errorLines.append("SHEF time zone (%s) not in valid time zones (%s)" % (self.shefTimezone, ",".join(timezoneNames)))
+		if self.storeRule is not None and self.storeRule not in storeRules :
+			errorLines.append("CWMS store rule (%s) not in valid store rules (%s)" % (self.storeRule, ",".join(storeRules)))
+		if self.hourCount is None :
+			self.hourCount = dfltHourCount
+		else :
+			if self.beginTime is not None and self.endTime is not None :
+				errorLines.append("Can specify only zero, one, or two of hours, begindate, and enddate - all three are specified")
 			else :
-				tsCode, paramName = paramNames[j].split("_", 1)
-				if locationInfo.has_key("TS_IDS") and tsCode not in locationInfo["TS_IDS"] : continue
-				if paramName in paramsToOutput :
-					fieldsToOutput.append(j)
-					try :
-						decodeInfo.append(((tsCode, paramName), parameters[paramName]))
-					except :
-						if outputLevel > NONE : log.output("*** Unexpected parameter %s ***" % paramName)
-						haserror.append(location)
-						return
-
-		if not fieldsToOutput :
-			if outputLevel > NONE : log.output("*** No data ***")
-			nodata.append(location)
-			return
-
-		if not tzField :
-			if outputLevel > NONE : log.output("*** No timezone field specified ***")
-			haserror.append(location)
-			return
-
+				try :
+					self.hourCount = int(self.hourCount)
+				except :
+					errorLines.append("Invalid hour count parameter: %s" % self.hourCount)
+				else :
+					if self.hourCount < 1 :
+						errorLines.append("Hour count (%d) must be greater than 0" % self.hourCount)
+		if self.beginTime is not None :
+			t = HecTime()
+			try :
+				if t.set(self.beginTime) != 0 : raise Exception
+				if not t.isTimeDefined() : t.set("%s 00:00" % self.beginTime)
+				cal.setTime(self.sdfHecTime.parse(t.dateAndTime(4)))
+				self.beginTime = self.sdfIso8601.format(cal.getTime())
+			except :
+				errorLines.append("Invalid beginddate format: %s" % self.beginTime)
+		if self.endTime is not None :
+			t = HecTime()
+			try :
+				if t.set(self.endTime) != 0 : raise Exception
+				if not t.isTimeDefined() : t.set("%s 24:00" % self.endTime)
+				cal.setTime(self.sdfHecTime.parse(t.dateAndTime(4)))
+				self.endTime = self.sdfIso8601.format(cal.getTime())
+			except :
+				errorLines.append("Invalid endddate format: %s" % self.endTime)
+		if not self.outputFormat :
+			errorLines.append("No output format(s) specified")
+		if self.inputFilename is not None :
+			if not os.path.isfile(self.inputFilename) :
+				errorLines.append("Invalid input file specified")
+		if not os.path.isdir(self.workdir) :
+			errorLines.append("Invalid working directory specified")
+		if errorLines : raise ConfigurationError(errorLines)
+		#-----------------------#
+		# normalize time window #
+		#-----------------------#
+		if self.beginTime and not self.endTime :
+			cal.setTime(self.sdfIso8601.parse(self.beginTime))
+			cal.add(Calendar.HOUR_OF_DAY, self.hourCount)
+			self.endTime = self.sdfIso8601.format(cal.getTime())
+		elif self.endTime and not self.beginTime :
+			cal.setTime(self.sdfIso8601.parse(self.endTime))
+			cal.add(Calendar.HOUR_OF_DAY, -self.hourCount)
+			self.beginTime = self.sdfIso8601.format(cal.getTime())
 		#--------------------------#
-		# skip the 2nd header line #
+		# state kept between runs  #
 		#--------------------------#
-		i += 1
-
-		#-----------------------------------------------------------------------------#
-		# read the data records, keeping track of whether we have regular time-series #
-		#-----------------------------------------------------------------------------#
-		records = []
-		tList = []
-		sdf = SimpleDateFormat("yyyy-MM-dd HH:mm")
-		cal = Calendar.getInstance()
-		recordCount = 0
-		for i in range(i+1, len(lines)) :
-			if not lines[i].strip() : continue
-			fields = lines[i].split("\t")
-			if fields[0] not in agencies :
+		self.responseCache = None
+		if self.cacheDir and not self.inputFilename :
+			self.responseCache = cache.ResponseCache(self.cacheDir, ttl=self.cacheTtl * 60)
+		self.notfoundDb    = notfoundStore.NotFoundStore(self.dbmFilename, ttl=self.notfoundTtl * 3600, max_ttl=NOTFOUND_MAX_TTL)
+		self.watermarkDb   = watermarkStore.WatermarkStore(self.wmDbmFilename)
+		self.breaker       = retry.CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+		self.httpClient    = http.shared_client()
+		self.decoder       = rdbvalues.ValueDecoder()
+		self.log           = Logger(sys.stderr, self.outputLevel, self.logFormat == "JSON")
+		self.configStamp   = None
+		self.allLocations  = {}
+		self.locationOrder = []
+		self.outputPlans   = {}
+		self.plansLock     = threading.Lock()
+		self.parameterAliases, self.parameters = {}, {}
+		self.resetRun()
+		#-----------------------------------#
+		# set up the Java time zones to use #
+		#-----------------------------------#
+		self.timezones = {"USGS" : None, "SHEF" : None, "DSS" : None}
+		if self.shefTimezone :
+			self.timezones["SHEF"] = TimeZone.getTimeZone(tzInfo[self.shefTimezone]["JAVA"])
+		if self.dssTimezone :
+			self.timezones["DSS"] = TimeZone.getTimeZone(tzInfo[self.dssTimezone]["JAVA"])
+
+	def outputShefRecord(self, parts) :
+		'''
+		Output a shef record from its parts, splitting it as necessary
+		'''
+		if not self.shefWriter :
+			self.shefWriter = shef.ShefWriter(self.shefFilename, flush_every=self.shefFlush, max_bytes=int(self.shefRotate * 1024 * 1024))
+		self.shefWriter.write(shef.encode(parts))
+
+	def getUrl(self, station, start=None, parameterCd=None, end=None) :
+		'''
+		Get the URL to retrieve the data for a station or comma-separated list of
+		stations, beginning at start and ending at end if they are specified, for
+		only the parameter codes in parameterCd if it is specified
+		'''
+		end = end or self.endTime
+		if start and end :
+			url = URL_TEMPLATE_ABS % (station, start, end)
+		elif start :
+			url = URL_TEMPLATE_BEG % (station, start)
+		elif self.beginTime and self.endTime :
+			url = URL_TEMPLATE_ABS % (station, self.beginTime, self.endTime)
+		else:
+			url = URL_TEMPLATE_REL % (station, self.hourCount)
+		if parameterCd :
+			url += "&parameterCd=%s" % parameterCd
+		return url
+
+	def getWindow(self, start=None, end=None) :
+		'''
+		Get the normalized time window for a request, which is part of the key of
+		cached responses
+		'''
+		if start :
+			return "%s/%s" % (start, end or self.endTime or "")
+		elif self.beginTime and self.endTime :
+			return "%s/%s" % (self.beginTime, self.endTime)
+		else :
+			return "PT%dH" % self.hourCount
+
+	def getChunks(self, start=None) :
+		'''
+		Get the (start, end) ISO 8601 times of the chunks to retrieve the time
+		window in, beginning at start if it is specified, or None if the window
+		is no longer than chunkDays. Each chunk ends where the next one begins,
+		so the data at the boundary are retrieved twice and merged.
+		'''
+		if not self.chunkDays : return None
+		sdf = hectime.date_format(ISO_8601_FORMAT, self.timeZone)
+		if self.endTime :
+			end = sdf.parse(self.endTime).getTime()
+		else :
+			end = long(time.time() * 1000) / 60000 * 60000
+		if start or self.beginTime :
+			begin = sdf.parse(start or self.beginTime).getTime()
+		else :
+			begin = end - self.hourCount * 3600000L
+		chunkLength = self.chunkDays * 86400000L
+		if end - begin <= chunkLength : return None
+		chunks = []
+		while begin < end :
+			chunks.append((sdf.format(Date(begin)), sdf.format(Date(min(begin + chunkLength, end)))))
+			begin += chunkLength
+		return chunks
+
+	def getSinks(self) :
+		'''
+		Get the names of the stores being output to, which are part of the keys of
+		the watermarks
+		'''
+		sinks = []
+		if self.outputFormat & DSS_FILE : sinks.append("DSS:%s" % self.dssFilename)
+		if self.outputFormat & CWMS_DB  : sinks.append("CWMS")
+		return sinks
+
+	def watermarkKey(self, sink, station, plan) :
+		'''
+		Get the key of the watermark for a time series of a station in a store
+		'''
+		return "%s|%s|%s|%s" % (sink, station, plan.tsid, plan.paramName)
+
+	def updateWatermark(self, sink, station, interval, records, plan, unstored) :
+		'''
+		Record the last time (in milliseconds) stored for a time series, and its
+		interval if it is regular, to be saved to the watermarks file at the end
+		of the run. unstored holds, for each store, the number of the station's
+		time series not yet stored and the earliest last time of those that
+		are. Once all of them are stored, that time is recorded for the station
+		as the time all of its time series have been checked through.
+		'''
+		if not records : return
+		key = self.watermarkKey(sink, station, plan)
+		last = records[len(records)-1][0]
+		marks = [(key, last)]
+		if interval != IRREGULAR_INTERVAL : self.pendingIntervals[key] = interval
+		count = unstored[sink]
+		count[0] -= 1
+		if count[1] is None or last < count[1] : count[1] = last
+		if count[0] == 0 : marks.append(("%s|%s" % (sink, station), count[1]))
+		for key, last in marks :
+			if not self.pendingMarks.has_key(key) or self.pendingMarks[key] < last :
+				self.pendingMarks[key] = last
+
+	def getStart(self, station) :
+		'''
+		Get the ISO 8601 time to begin retrieving a station with --incremental, or
+		None to retrieve the whole time window. The start is the earliest time
+		stored for the station in any of the stores being output to, less the
+		overlap, if it is after the beginning of the time window. A time series
+		stored before the time all of the station's time series were last
+		checked through had no data since, so that time is used for it instead.
+		'''
+		if not self.incremental : return None
+		if self.watermarks is None :
+			#----------------------------------------------------------#
+			# find the earliest watermark of each station in each sink #
+			# and the time the station was checked through, and the    #
+			# interval of each time series                             #
+			#----------------------------------------------------------#
+			self.watermarks = {}
+			for key, last in self.watermarkDb.marks().items() :
+				parts = key.split("|")
+				stationMarks = self.watermarks.setdefault(parts[1], {})
+				sinkMarks = stationMarks.setdefault(parts[0], [None, None])
+				if len(parts) == 2 :
+					sinkMarks[1] = last
+				elif sinkMarks[0] is None or last < sinkMarks[0] :
+					sinkMarks[0] = last
+			for key, interval in self.watermarkDb.intervals().items() :
+				sink, stn, tsid, paramName = key.split("|")
+				self.knownIntervals[(stn, tsid, paramName)] = interval
+		stationMarks = self.watermarks.get(station, {})
+		marks = []
+		for sink in self.getSinks() :
+			earliest, checked = stationMarks.get(sink, [None, None])
+			if earliest is None : return None
+			marks.append(max(earliest, checked))
+		if not marks : return None
+		start = min(marks) - self.overlap * 60000L
+		if self.beginTime :
+			windowStart = self.sdfIso8601.parse(self.beginTime).getTime()
+		else :
+			windowStart = long(time.time() * 1000) - self.hourCount * 3600000L
+		if start <= windowStart : return None
+		if self.endTime : start = min(start, self.sdfIso8601.parse(self.endTime).getTime())
+		return self.sdfIso8601.format(Date(start))
+
+	def openData(self, station, seq=None, total=None, start=None, parameterCd=None, end=None) :
+		'''
+		Open a connection to read the rdb-formatted table from the USGS, returning
+		None if no connection could be made. The station may be a comma-
+		separated list of stations, in which case seq is that of the first one.
+		The end is specified only for a chunk of the time window.
+		'''
+		connection = None
+		url = self.getUrl(station, start, parameterCd, end)
+		self.log.setContext(station=station)
+		stationCount = station.count(",") + 1
+		if self.outputLevel > NONE :
+			chunk = ""
+			if end : chunk = " from %s to %s" % (start, end)
+			if stationCount > 1 :
+				if seq and total :
+					self.log.output("\nRetrieving data for stations %s (%d-%d of %d)%s" % (station, seq, seq + stationCount - 1, total, chunk))
+				else :
+					self.log.output("\nRetrieving data for stations %s%s" % (station, chunk))
+			elif seq and total :
+				self.log.output("\nRetrieving data for station %s (%d of %d)%s" % (station, seq, total, chunk))
+			else :
+				self.log.output("\nRetrieving data for station %s%s" % (station, chunk))
+			self.log.output("URL= %s" % url)
+		key = meta = None
+		headers = dict(http.ACCEPT_ENCODING)
+		if self.responseCache :
+			key = self.responseCache.key(station, self.getWindow(start, end), parameterCd)
+			meta = self.responseCache.lookup(key)
+			if self.responseCache.is_fresh(meta) :
+				self.log.normal("Using cached response %s", self.responseCache.body_path(key))
+				return self.responseCache.open(key)
+			headers.update(self.responseCache.conditional_headers(meta))
+		try :
+			connection = http.DecodedResponse(retry.open_url(urllib2.Request(url, headers=headers), self.retryPolicy, self.breaker, self.logRetry, self.httpClient.open), self.logTransfer)
+		except urllib2.HTTPError, e :
+			#-------------------------------------------------------#
+			# read the body of any other error response as before,  #
+			# since it holds the USGS message                       #
+			#-------------------------------------------------------#
+			if e.code == 304 and meta :
+				self.responseCache.refresh(key, meta, e.info())
+				self.log.normal("Using revalidated cached response %s", self.responseCache.body_path(key))
+				return self.responseCache.open(key)
+			connection = http.DecodedResponse(e, self.logTransfer)
+		except retry.CircuitOpenError, e :
+			self.log.normal("*** %s, not retrieving ***", e)
+		except Exception, e :
+			self.log.normal("*** Connection failed: %s ***", e)
+		if connection and self.responseCache and connection.getcode() == 200 :
+			try :
+				self.responseCache.store(key, url, connection, connection.info())
+			finally :
+				connection.close()
+			connection = self.responseCache.open(key)
+		return connection
+
+	def logRetry(self, attempt, error, delay) :
+		'''
+		Report a connection error that is about to be retried
+		'''
+		self.log.normal("*** Connection error %d (%s), retrying in %.1f seconds ***", attempt, error, delay)
+
+	def logTransfer(self, response) :
+		'''
+		Report the bytes received for a response once it is closed
+		'''
+		if response.compressed :
+			self.log.normal("Received %d bytes (%d compressed, %.1fx)", response.decoded, response.received, float(response.decoded) / max(response.received, 1))
+		else :
+			self.log.normal("Received %d bytes (not compressed)", response.decoded)
+
+	def probeSites(self, stations) :
+		'''
+		Return the stations of those specified that the USGS site service lists
+		as active with instantaneous values, or None if the service can't be
+		reached. Only the site information is requested, not the data.
+		'''
+		found = []
+		i = 0
+		while i < len(stations) :
+			#--------------------------------------------------#
+			# use as many stations per request as fit in a URL #
+			#--------------------------------------------------#
+			j = i + 1
+			while j < len(stations) and len(URL_TEMPLATE_SITE % ",".join(stations[i:j+1])) <= MAX_URL_LENGTH : j += 1
+			url = URL_TEMPLATE_SITE % ",".join(stations[i:j])
+			self.log.verbose("Checking the site service for locations\nURL= %s", url)
+			i = j
+			try :
+				connection = http.DecodedResponse(retry.open_url(urllib2.Request(url, headers=http.ACCEPT_ENCODING), self.retryPolicy, self.breaker, self.logRetry, self.httpClient.open), self.logTransfer)
+			except urllib2.HTTPError, e :
+				#----------------------------------------#
+				# the site service answers 404 when none #
+				# of the sites match                     #
+				#----------------------------------------#
+				if e.code != 404 : return None
 				continue
-			if fields[1] != location :
-				if outputLevel > NONE :
-					log.output("*** Unexpected location on data record %d ***" % recordCount)
-					if outputLevel > NORMAL :
-						log.output("%s" % lines[i])
-				haserror.append(location)
-				return
-			if not tz :
-				tz = fields[tzField]
-				timezones["USGS"] = TimeZone.getTimeZone(tzInfo[tz]["JAVA"])
-				sdf.setTimeZone(timezones["USGS"])
-				if outputLevel > NORMAL :
-					log.output("Initial time zone is %s" % tz)
+			except :
+				return None
+			try :
+				for line in connection.read().split("\n") :
+					fields = line.strip().split("\t")
+					if len(fields) > 1 and fields[0] in agencies and fields[1] not in found : found.append(fields[1])
+			finally :
+				connection.close()
+		return found
+	def storeToCwmsDb(self, station, interval, tz, records, plan, onStored=None) :
+		'''
+		Queue a time series to be stored to the CWMS database, returning whether
+		it had any values to store
+		'''
+		#-----------------------------------------#
+		# delay CWMS imports until they're needed #
+		#-----------------------------------------#
+		try    : TimeSeriesContainer
+		except : from hec.io import TimeSeriesContainer
+
+		if not self.cwmsWriter :
+			self.cwmsWriter = CwmsWriter(self.cwmsBatchSize, self.storeRule, self.log)
+		factor = plan.cwmsFactor
+		cwmsTsid = plan.cwmsTsid(interval)
+		times, values, quality = records.times, records.values, records.quality
+		builder = tsbuilder.ContainerBuilder(len(records), quality is not None)
+		for j in range(len(records)) :
+			if values[j] is None : continue
+			builder.append(hectime.minutes(times[j]), values[j] * factor, quality and quality[j])
+		if not len(builder) :
+			self.log.normal("*** No values in time window for %s. ***", cwmsTsid)
+			return False
+		self.log.normal("Storing %s (%d values)", cwmsTsid, len(builder))
+		tsc = TimeSeriesContainer()
+		tsc.fullName     = cwmsTsid
+		tsc.location     = plan.cwmsLocation
+		tsc.parameter    = plan.cwmsParameter
+		tsc.type         = plan.cwmsType
+		tsc.version      = plan.cwmsVersion
+		tsc.interval     = interval
+		tsc.units        = plan.cwmsUnit
+		builder.fill(tsc)
+		self.cwmsWriter.put(tsc, onStored)
+		return True
+
+	def cwmsStored(self, location, ok) :
+		'''
+		Account for the outcome of storing one of the queued time series of a
+		location to the CWMS database. The location is successful once all of
+		them are stored, or has errors if any of them couldn't be.
+		'''
+		pending = self.cwmsPending[location]
+		pending[0] -= 1
+		if not ok : pending[1] = False
+		if pending[0] == 0 :
+			del self.cwmsPending[location]
+			if pending[1] :
+				self.log.normal("successful list appended.")
+				self.successful.append(location)
 			else :
-				if fields[tzField] != tz :
-					if outputLevel > NORMAL :
-						log.output("Time zone switched from %s to %s" % (tz, fields[tzField]))
+				self.log.normal("haserror list appended.")
+				self.haserror.append(location)
+	def storeToDss(self, _tsc, station, plan, onStored=None) :
+		if not self.dssWriter :
+			self.dssWriter = DssWriter(self.dssFilename, self.log, self.skipUnchanged)
+		tsc = _tsc.clone()
+		tsc.units = plan.dssUnit
+		tsc.type  = plan.dssType
+		tsc.fullName = plan.dssPathname(tsc.interval)
+		tsc.watershed = plan.dssWatershed
+		tsc.location = plan.dssLocation[0]
+		if len(plan.dssLocation) > 1 : tsc.subLocation = plan.dssLocation[1]
+		tsc.parameter = plan.dssParameter[0]
+		if len(plan.dssParameter) > 1 : tsc.subParameter = plan.dssParameter[1]
+		tsc.fileName = self.dssFilename
+		self.dssWriter.put(tsc, onStored)
+
+	def makeTimeSeriesContainer(self, station, interval, tz, records, plan) :
+		if self.dssTimezone :
+			if not self.timezones["DSS"] :
+				if tzInfo.hasKey(self.dssTimezone) :
+					self.timezones["DSS"] = TimeZone.getTimeZone(tzInfo[self.dssTimezone]["JAVA"])
+				else :
+					self.timezones["DSS"] = TimeZone.getTimeZone(self.dssTimezone)
+					if self.timezones["DSS"].getID() != self.dssTimezone and self.outputLevel > NONE :
+						self.log.output("WARNING: Couldn't set DSS time zone to %s, using %s" % (self.dssTimezone,self.timezones["DSS"].getID()))
+					if self.timezones["DSS"].observesDaylightTime() and self.outputLevel > NONE :
+						self.log.output("WARNING: DSS time zone observes daylight saving time")
+			zone = self.timezones["DSS"]
+		else :
+			zone = self.timezones["USGS"]
+		tsc = TimeSeriesContainer()
+		tsc.interval = interval
+		#--------------------------------------------------------------------#
+		# convert, scale, and store each value straight into the container's #
+		# arrays, without building lists of them first                       #
+		#--------------------------------------------------------------------#
+		minutes = hectime.zone_offsets(zone).minutes
+		factor = plan.dssFactor
+		times, values, quality = records.times, records.values, records.quality
+		builder = tsbuilder.ContainerBuilder(len(records), quality is not None)
+		for j in range(len(records)) :
+			value = values[j]
+			if value is None : value = Constants.UNDEFINED
+			else             : value *= factor
+			builder.append(minutes(times[j]), value, quality and quality[j])
+		builder.fill(tsc)
+		tsc.timeZoneID = zone.getID()
+		tsc.timeZoneRawOffset = zone.getRawOffset()
+		return tsc
+
+	def outputShefText(self, station, interval, tz, records, plan) :
+		'''
+		Output the rdb-formatted data retrieved from the USGS
+		'''
+		cal = Calendar.getInstance()
+		if self.shefTimezone :
+			tz = tzInfo[self.shefTimezone]["SHEF"]
+			if not self.timezones["SHEF"] :
+				self.timezones["SHEF"] = TimeZone.getTimeZone(tzInfo[self.shefTimezone]["JAVA"])
+			zone = self.timezones["SHEF"]
+		else :
+			zone = self.timezones["USGS"]
+		sdfDate = hectime.date_format("yyyyMMdd", zone)
+		sdfTime = hectime.date_format("HHmm", zone)
+
+		recordCount = len(records)
+		param = plan.shefParameter
+		factor = plan.shefFactor
+		values = rdbvalues.scaled(records.values, factor)
+		unitSystem = plan.shefUnitSystem
+		if interval == IRREGULAR_INTERVAL :
+			for i in range(recordCount) :
+				cal.setTimeInMillis(records[i][0])
+				parts = [".A %s %8s %s DH%4s /" % (plan.shefLocation, sdfDate.format(cal.getTime()), tzInfo[tz]["SHEF"], sdfTime.format(cal.getTime()))]
+				if values[i] is None :
+					parts.append(" %s M /" % (param))
+				else :
+					parts.extend([" DU%s /" % unitSystem, " %s %s /" % (param, fmtFloat(values[i]))])
+				self.outputShefRecord(parts)
+		else :
+			cal.setTimeInMillis(records[0][0])
+			parts = [
+				".E %s %8s %s DH%4s /" % (plan.shefLocation, sdfDate.format(cal.getTime()), tzInfo[tz]["SHEF"], sdfTime.format(cal.getTime())),
+				" DU%s /" % unitSystem,
+				" %s /" % param]
+			if interval % 60 :
+				parts.append(" DIN+%2.2d /" % interval)
+			else :
+				parts.append(" DIH+%2.2d /" % (interval / 60))
+			for j in range(recordCount) :
+				if values[j] is None :
+					parts.append(" M /")
+				else :
+					parts.append(" %s /" % fmtFloat(values[j]))
+			self.outputShefRecord(parts)
+	def makeBatches(self, tasks) :
+		'''
+		Group the retrieval tasks for individual locations into batches of up to
+		batchSize locations with the same start time and parameter codes, limited
+		so each request URL fits in MAX_URL_LENGTH
+		'''
+		batches = []
+		groupKeys = []
+		groups = {}
+		for task in tasks :
+			groupKey = (task[4], getParameterCd(task[1]))
+			if not groups.has_key(groupKey) :
+				groupKeys.append(groupKey)
+				groups[groupKey] = []
+			groups[groupKey].append(task)
+		for groupKey in groupKeys :
+			start, parameterCd = groupKey
+			batch = []
+			for task in groups[groupKey] :
+				stations = ",".join([t[0] for t in batch + [task]])
+				if batch and (len(batch) == self.batchSize or len(self.getUrl(stations, start, parameterCd)) > MAX_URL_LENGTH) :
+					batches.append(batch)
+					batch = []
+				batch.append(task)
+			if batch :
+				batches.append(batch)
+		return batches
+
+	def retrieveBatch(self, batch) :
+		'''
+		Retrieve the data for a batch of locations with one request, parsing the
+		data for each location as it is read. Locations missing from the response
+		(including locations that aren't found) are retrieved individually. Returns
+		a list of results in the order of the batch.
+		'''
+		chunks = self.getChunks(batch[0][4])
+		if chunks :
+			return self.retrieveChunks(batch, chunks)
+		if len(batch) == 1 :
+			return [self.retrieveLocation(*batch[0])]
+		location, locationInfo, seq, total, start = batch[0]
+		tasks = {}
+		for task in batch : tasks[task[0]] = task
+		results = {}
+		connection = self.openData(",".join([task[0] for task in batch]), seq, total, start, getParameterCd(locationInfo))
+		if connection :
+			try :
+				for block in readRdb(connection, self.keepText()) :
+					if block.header is None or results.has_key(block.site) or not tasks.has_key(block.site) : continue
+					location, locationInfo, seq, total, start = tasks[block.site]
+					results[location] = self.retrieveLocation(location, locationInfo, seq, total, start, block)
+			finally :
+				connection.close()
+		for location, locationInfo, seq, total, start in batch :
+			if not results.has_key(location) :
+				self.log.verbose("Station %s not in batch response", location)
+				results[location] = self.retrieveLocation(location, locationInfo, seq, total, start)
+		return [results[task[0]] for task in batch]
+
+	def retrieveChunk(self, batch, chunk) :
+		'''
+		Retrieve one chunk of the time window for a batch of locations, returning
+		the results read for the locations in the response, which are parsed but
+		not finished (see finishSeries), and whether the response said no sites
+		were found, or None if the chunk couldn't be retrieved
+		'''
+		location, locationInfo, seq, total, start = batch[0]
+		tasks = {}
+		for task in batch : tasks[task[0]] = task
+		connection = self.openData(",".join([task[0] for task in batch]), seq, total, chunk[0], getParameterCd(locationInfo), chunk[1])
+		#---------------------------------------------------------------#
+		# an error response that outlasted the retries is a failure,    #
+		# not a chunk without data (a cached response has no code, and  #
+		# 404 comes with the USGS message that no sites were found)     #
+		#---------------------------------------------------------------#
+		code = getattr(connection, "getcode", lambda : None)()
+		if code and code not in (200, 404) :
+			self.log.normal("*** HTTP error %d ***", code)
+			connection.close()
+			connection = None
+		if not connection :
+			self.log.normal("*** Chunk from %s to %s not retrieved ***", chunk[0], chunk[1])
+			return None
+		results = {}
+		notFound = False
+		try :
+			for block in readRdb(connection, self.keepText()) :
+				if block.header is None :
+					if block.isNotFound() : notFound = True
+					continue
+				if results.has_key(block.site) or not tasks.has_key(block.site) : continue
+				results[block.site] = self.parseBlock(LocationResult(block.site), block, tasks[block.site][1], False)
+		finally :
+			connection.close()
+		return results, notFound
+
+	def retrieveChunks(self, batch, chunks) :
+		'''
+		Retrieve the time window for a batch of locations in chunks, retrieving
+		the chunks concurrently, and merge the chunks of each location. The times
+		are already in UTC, so the merge is unaffected by the time zone changing
+		between chunks; a time at the boundary of two chunks is taken from the
+		first. The columns are merged by USGS TS_ID and parameter code. A location is not found only if the response for every chunk said
+		so. Returns a list of results in the order of the batch.
+		'''
+		self.log.verbose("Retrieving %d chunks of up to %d days", len(chunks), self.chunkDays)
+		tasks = [(batch, chunk) for chunk in chunks]
+		outcomes = [outcome for outcome in retrieveConcurrently(self.retrieveChunk, tasks, min(CHUNK_WORKERS, len(chunks)))]
+		failed = outcomes.count(None)
+		outcomes = [outcome for outcome in outcomes if outcome is not None]
+		allNotFound = outcomes and not failed and not [notFound for results, notFound in outcomes if not notFound]
+		merged = []
+		for location, locationInfo, seq, total, start in batch :
+			result = LocationResult(location)
+			result.partial = failed > 0
+			parts = [results[location] for results, notFound in outcomes if results.has_key(location)]
+			texts = [part.data for part in parts if part.data]
+			if texts : result.data = "".join(texts)
+			if [part for part in parts if part.status == "haserror"] :
+				merged.append(result.setStatus("haserror"))
+				continue
+			retrieved = [part for part in parts if part.status is None]
+			if not retrieved :
+				#----------------------------------------------------------#
+				# keep the status the chunks gave the location, only       #
+				# treating it as not found if every chunk response said so #
+				#----------------------------------------------------------#
+				statuses = [part.status for part in parts]
+				if "nodata" in statuses or not allNotFound :
+					self.log.normal("*** No data ***")
+					result.setStatus("nodata")
+				else :
+					self.log.normal("*** Site not found ***")
+					result.setStatus("notfound")
+				merged.append(result)
+				continue
+			parts = [part for part in retrieved if part.columns]
+			if not parts :
+				#------------------------------------------------#
+				# the data weren't parsed, only the text is kept #
+				#------------------------------------------------#
+				result.tz, result.usgsTimezone = retrieved[-1].tz, retrieved[-1].usgsTimezone
+				merged.append(result)
+				continue
+			columns = []
+			bySeries = {}
+			for part in parts :
+				result.tz, result.usgsTimezone = part.tz, part.usgsTimezone
+				for plan, series in part.columns :
+					key = (plan.tsid, plan.paramName)
+					if not bySeries.has_key(key) :
+						bySeries[key] = Series(codes=[] if series.codes is not None else None)
+						columns.append((plan, bySeries[key]))
+					mergeSeries(bySeries[key], series)
+			result.columns = columns
+			merged.append(self.finishSeries(result))
+		return merged
+
+	def keepText(self) :
+		'''
+		Whether the USGS text is needed for output or logging
+		'''
+		return self.outputFormat & USGS_TEXT or self.outputLevel > NORMAL
+
+	def retrieveLocation(self, location, locationInfo, seq=None, total=None, start=None, block=None) :
+		'''
+		Retrieve and parse the data for a location, beginning at start if it is
+		specified, unless the block of data for the location is specified. This
+		doesn't touch any output or storage, so it may be run concurrently for
+		multiple locations.
+		'''
+		self.log.setContext(station=os.path.splitext(os.path.basename(location))[0])
+		if block is not None :
+			return self.parseBlock(LocationResult(location), block, locationInfo)
+		if os.path.isfile(location) :
+			connection = open(location)
+			location = os.path.splitext(os.path.basename(location))[0]
+		else :
+			connection = self.openData(location, seq, total, start, getParameterCd(locationInfo))
+		result = LocationResult(location)
+		if not connection :
+			self.log.normal("*** No data ***")
+			return result.setStatus("nodata")
+		try :
+			for block in readRdb(connection, self.keepText()) :
+				if block.header is not None :
+					return self.parseBlock(result, block, locationInfo)
+				if self.outputFormat & USGS_TEXT :
+					result.data = block.getText()
+				if block.isNotFound() :
+					self.log.normal("*** Site not found ***")
+					return result.setStatus("notfound")
+		finally :
+			connection.close()
+		self.log.normal("*** No values ***")
+		return result.setStatus("nodata")
+
+	def getOutputPlan(self, location, locationInfo, tsid, paramName) :
+		'''
+		Get the output plan for a time series of a location, making it the first
+		time the time series is seen after the configuration is loaded. The TS_IDs
+		are known only from the rdb header, so plans are made as the data are
+		parsed, possibly by several workers at once; the lock makes sure they all
+		get the same plan for a time series.
+		'''
+		key = (location, tsid, paramName)
+		try :
+			return self.outputPlans[key]
+		except KeyError :
+			pass
+		self.plansLock.acquire()
+		try :
+			if not self.outputPlans.has_key(key) :
+				self.outputPlans[key] = OutputPlan(locationInfo, tsid, paramName, self.parameters[paramName], self.outputFormat)
+			return self.outputPlans[key]
+		finally :
+			self.plansLock.release()
+
+	def parseBlock(self, result, block, locationInfo, finish=True) :
+		'''
+		Parse a block of rdb-formatted data into the time series for a location,
+		leaving the columns read unfinished (see finishSeries) if finish is False
+		'''
+		try :
+			return self._parseBlock(result, block, locationInfo, finish)
+		finally :
+			block.drain()
+			if self.outputFormat & USGS_TEXT :
+				result.data = block.getText()
+			if self.outputLevel > NORMAL :
+				self.log.output("Parsed the following data:\n---------------------------")
+				self.log.output(block.getText() + "\n")
+
+	def _parseBlock(self, result, block, locationInfo, finish=True) :
+		location = result.location
+		tz = ""
+		tzField = None
+		usgsTimezone = None
+		paramsToOutput = locationInfo["PARAMETERS"]
+
+		if block.isNotFound() :
+			self.log.normal("*** Site not found ***")
+			return result.setStatus("notfound")
+
+		if self.outputFormat & (SHEF_TEXT | DSS_FILE | CWMS_DB) :
+			#-----------------------------------------------------#
+			# process the 1st header line, describing field names #
+			#-----------------------------------------------------#
+			fields = block.header.split()
+			fieldCount = len(fields)
+			if fieldCount < 3 or " ".join(fields[:3]) != "agency_cd site_no datetime" :
+				if self.outputLevel > NONE :
+					self.log.output("*** Unexpected format on header line 1 ***")
+					self.log.output("%s" % block.header)
+				return result.setStatus("haserror")
+			paramCount = fieldCount - 3
+			if paramCount < 1 :
+				self.log.normal("*** No parameters ***")
+				return result.setStatus("nodata")
+
+			paramNames = fields[:]
+			fieldsToOutput = []
+			codeFields = []
+			plans = []
+			for j in range(3, len(paramNames)) :
+				if paramNames[j] == "tz_cd" :
+					tzField = j
+				else :
+					tsCode, paramName = paramNames[j].split("_", 1)
+					if locationInfo.has_key("TS_IDS") and tsCode not in locationInfo["TS_IDS"] : continue
+					if paramName in paramsToOutput :
+						fieldsToOutput.append(j)
+						if j + 1 < len(paramNames) and paramNames[j+1] == paramNames[j] + "_cd" :
+							codeFields.append(j + 1)
+						else :
+							codeFields.append(None)
+						if not self.parameters.has_key(paramName) :
+							self.log.normal("*** Unexpected parameter %s ***", paramName)
+							return result.setStatus("haserror")
+						plans.append(self.getOutputPlan(location, locationInfo, tsCode, paramName))
+
+			if not fieldsToOutput :
+				self.log.normal("*** No data ***")
+				return result.setStatus("nodata")
+
+			if not tzField :
+				self.log.normal("*** No timezone field specified ***")
+				return result.setStatus("haserror")
+
+			#-----------------------------------------------------------------------#
+			# read the data records straight into the time series of each parameter #
+			#-----------------------------------------------------------------------#
+			ts = [Series(codes=[] if codeField else None) for codeField in codeFields]
+			#--------------------------------------------------------------------#
+			# project only the columns needed: each line is split only as far as #
+			# the last of them, leaving any columns after it unsplit             #
+			#--------------------------------------------------------------------#
+			projection = zip(fieldsToOutput, codeFields, ts)
+			maxSplit = max(fieldsToOutput + [tzField] + codeFields) + 1
+			sdf = SimpleDateFormat("yyyy-MM-dd HH:mm")
+			recordCount = 0
+			for line in block.rows() :
+				fields = line.split("\t", maxSplit)
+				if fields[0] not in agencies :
+					continue
+				if fields[1] != location :
+					if self.outputLevel > NONE :
+						self.log.output("*** Unexpected location on data record %d ***" % recordCount)
+						if self.outputLevel > NORMAL :
+							self.log.output("%s" % line)
+					return result.setStatus("haserror")
+				if not tz :
 					tz = fields[tzField]
-					timezones["USGS"] = TimeZone.getTimeZone(tzInfo[tz]["JAVA"])
-					sdf.setTimeZone(timezones["USGS"])
-			recordCount += 1
-			cal.setTime(sdf.parse(fields[2]))
-
-			valueFields = []
-			for j in fieldsToOutput :
-				valueFields.append(fields[j])
-			records.append((cal.getTimeInMillis(), valueFields))
-			tList.append(cal.getTime())
-		if recordCount == 0 :
-			if outputLevel > NONE : log.output("*** No data ***")
-			nodata.append(location)
-			return
-
-		#--------------------------------------------------#
-		# create individual time series for each parameter #
-		#--------------------------------------------------#
-		intvl = [None for i in range(len(fieldsToOutput))]
-		ts    = [[] for i in range(len(fieldsToOutput))]
-		for i in range(len(records)) :
-			millis, values = records[i]
-			for j in range(len(values)) :
-				if values[j] != "" : ts[j].append((millis, values[j]))
+					usgsTimezone = TimeZone.getTimeZone(tzInfo[tz]["JAVA"])
+					sdf.setTimeZone(usgsTimezone)
+					self.log.verbose("Initial time zone is %s", tz)
+				else :
+					if fields[tzField] != tz :
+						self.log.verbose("Time zone switched from %s to %s", tz, fields[tzField])
+						tz = fields[tzField]
+						usgsTimezone = TimeZone.getTimeZone(tzInfo[tz]["JAVA"])
+						sdf.setTimeZone(usgsTimezone)
+				recordCount += 1
+				millis = sdf.parse(fields[2]).getTime()
+				for column, codeColumn, series in projection :
+					value = fields[column]
+					if value != "" : series.append(millis, value, codeColumn and fields[codeColumn])
+			if recordCount == 0 :
+				self.log.normal("*** No data ***")
+				return result.setStatus("nodata")
+
+			result.tz = tz
+			result.usgsTimezone = usgsTimezone
+			result.columns = zip(plans, ts)
+			if finish : self.finishSeries(result)
+		return result
+
+	def finishSeries(self, result) :
+		'''
+		Determine the interval of each column read for a location, fill in its
+		missing values and decode it, keeping each time series that has an
+		interval and data
+		'''
+		plans = [column[0] for column in result.columns]
+		ts = [column[1] for column in result.columns]
+		result.columns = None
+		intvl = [None for i in range(len(ts))]
 		#--------------------------------------------------------------------#
 		# analyze interval for each time series, allowing for missing values #
 		#--------------------------------------------------------------------#
 		for i in range(len(ts)) :
-			intervalCounts = {}
-			for j in range(1, len(ts[i])) :
-				# 60,000 milliseconds per minute
-				intv = (ts[i][j][0] - ts[i][j-1][0]) / 60000
-				count = intervalCounts.setdefault(intv, 0)
-				intervalCounts[intv] = count + 1
-			intvs = intervalCounts.keys()
-			intvs.sort()
-			if len(intvs) == 0 :
+			#-----------------------------------------------------------#
+			# the interval recorded with the watermark of the series is #
+			# kept for a window too short to determine it, as long as   #
+			# the values are on it                                      #
+			#-----------------------------------------------------------#
+			known = self.knownIntervals.get((result.location, plans[i].tsid, plans[i].paramName))
+			if known and [t for t in ts[i].times if (t - ts[i].times[0]) % (known * 60000)] : known = None
+			if known and len(ts[i]) < MIN_DETECT_VALUES :
+				intvl[i] = known
+				self.log.verbose("Too few values to determine an interval, keeping %d minutes", intvl[i])
+			elif len(ts[i]) < 2 :
 				#------------------------------------------------#
 				# not enough values (2) to determine an interval #
 				#------------------------------------------------#
 				intvl[i] = IRREGULAR_INTERVAL
-				log.output("not enough values to determine an interval, setting to: Irregular Interval")
-			elif len(intvs) == 1 :
-				#---------------------------------#
-				# only one interval found in data #
-				#---------------------------------#
-				intvl[i] = intvs[0]
+				self.log.normal("not enough values to determine an interval, setting to: Irregular Interval")
 			else :
-
-				if intvl[i] is None :
-					#--------------------------------#
-					# interval still hasn't been set #
-					#--------------------------------#
-
-					if intervalCounts[intvs[0]] > 3 * max([intervalCounts[intvs[x]] for x in range(1, len(intvs))]) :
-						#---------------------------------------------------#
-						# smallest interval accounts for > 75% of intervals #
-						#---------------------------------------------------#
-						intvl[i] = intvs[0]
-						log.output("smallest interval accounts for > 75% of data: " + str(intvl[i]))
-#                     elif max([intervalCounts[intvs[x]] for x in range(1, len(intvs))]) > (0.75 * len(intvs)) :
-#                         #--------------------------------------------------------------------------#
-#                         # most common encountered interval accounts for > 75% of intervals, use it #
-#                         # and clobber any additional data in between predominant interval          #
-#                         #--------------------------------------------------------------------------#
-#                         intvl[i] = max(intervalCounts.iteritems(), key=operator.itemgetter(1))[0]
-#                         log.output("interval accounts for > 75% of data: " + str(intvl[i]))
-					else:
-						#----------------------------------------------------------------------#
-						# multiple intervals found in data and smallest is not >75% prevailing #
-						#----------------------------------------------------------------------#
-						for j in range(1, len(intvs)) :
-#                             print 'intvs[j] % intvs[0]' , intvs[j] % intvs[0]
-							if intvs[j] % intvs[0] :
-								#-------------------------------------------------#
-								# interval is not a multiple of smallest interval #
-								#-------------------------------------------------#
-								intvl[i] = IRREGULAR_INTERVAL
-								log.output("interval found that is not a multiple of smallest interval and no dominant interval found, setting to: Irregular Interval")
-#                             elif not intvs[j] % intvs[0] :
-#                                 intvl[i] = intvs[0]
-#                                 log.output("All intervals are a multiple of smallest interval. Using smallest interval.")
-							else :
-								#------------------------------------------------#
-								# can't determine a predominant regular interval #
-								#------------------------------------------------#
-								intvl[i] = IRREGULAR_INTERVAL
-								log.output("Unable to determine interval, setting to: Irregular Interval")
+				interval = timeseries.detect_interval(ts[i].times, self.intervalPolicy)
+				if interval is None and known :
+					intvl[i] = known
+					self.log.verbose("Unable to determine %s interval, keeping %d minutes", self.intervalPolicy, intvl[i])
+				elif interval is None :
+					#------------------------------------------------#
+					# can't determine a predominant regular interval #
+					#------------------------------------------------#
+					intvl[i] = IRREGULAR_INTERVAL
+					self.log.normal("Unable to determine %s interval, setting to: Irregular Interval", self.intervalPolicy)
+				else :
+					# 60,000 milliseconds per minute
+					intvl[i] = interval / 60000
+					self.log.verbose("Interval (%s) is %d minutes", self.intervalPolicy, intvl[i])
 
 			#------------------------------------------------------------#
 			# add in any missing values for regular interval time series #
 			#------------------------------------------------------------#
 			if intvl[i] != IRREGULAR_INTERVAL :
-				for j in range(1, len(ts[i]))[::-1] :
-#                     print 'ts[i][j][0]: ', ts[i][j][0]/60000
-					intv = (ts[i][j][0] - ts[i][j-1][0]) / 60000
-					intervalsToAdd = range((ts[i][j-1][0] / 60000) + intvl[i], ts[i][j][0] / 60000, intvl[i])
-					for k in intervalsToAdd[::-1] :
-						ts[i].insert(j, (k * 60000, ""))
-
-			#------------------------------------------------------------------#
-			# Remove any values that are not of the chosen interval #
-			#------------------------------------------------------------------#
-#             if intvl[i] != IRREGULAR_INTERVAL :
-#                 intervalsToRemove = None
-#                 for j in range(1, len(ts[i]))[::-1] :
-#                     intv = (ts[i][j][0] - ts[i][j-1][0]) / 60000
-# #                     print 'intv & intvl[i]: ', intv, intvl[i]
-#                     if intv != intvl[i]:
-#                         #------------------------------------------------------#
-#                         # interval is not equal to the chosen regular interval #
-#                         #------------------------------------------------------#
-#                         intervalsToRemove = range((ts[i][j-1][0] / 60000) + intvl[i], ts[i][j][0] / 60000, intvl[i])
-#
-#                     if intervalsToRemove is not None:
-#                         print 'intervalsToRemove : ', intervalsToRemove
-# #                     print '\nintv ', intv
-#
+				times, values = timeseries.regularize(ts[i].times, ts[i].values, intvl[i] * 60000, "")
+				codes = ts[i].codes
+				if codes is not None :
+					codes = timeseries.regularize(ts[i].times, codes, intvl[i] * 60000, "")[1]
+				ts[i] = Series(times, values, codes)
 
+		#-----------------------------------------------------#
+		# keep each time series that has an interval and data #
+		#-----------------------------------------------------#
+		for i in range(len(ts)) :
+			if not intvl[i] or not ts[i] : continue
+			ts[i].decode(self.decoder)
+			result.series.append((intvl[i], ts[i], plans[i]))
+		return result
+
+	def storeLocation(self, result) :
+		'''
+		Output and/or store the parsed data for a location and account for the
+		outcome. This is only ever called from the main thread, one location at a
+		time, so the DSS file and the CWMS database are never used concurrently.
+		'''
+		location = result.location
+		self.log.setContext(station=location)
+		if result.data and self.outputFormat & USGS_TEXT :
+			sys.stdout.write(result.data)
+
+		if result.status == "notfound" :
+			if not self.inputFilename and getParameterCd(self.locations[location]) :
+				#-------------------------------------------------------#
+				# the data service says the same for a station that has #
+				# no data for the parameters requested, so leave it to  #
+				# the site service to confirm (see confirmNotFound)     #
+				#-------------------------------------------------------#
+				self.unconfirmed.append(location)
+				return
+			self.notfound.append(location)
+			self.notfoundDb.mark([location])
+			return
+		if result.status == "nodata" :
+			self.nodata.append(location)
+			return
+		if result.status == "haserror" :
+			self.haserror.append(location)
+			return
 
 		#------------------------------#
 		# output and/or store the data #
 		#------------------------------#
-		for i in range(len(ts)) :
-			if not intvl[i] or not ts[i] : continue
-			if outputFormat & SHEF_TEXT :
-				outputShefText(location, intvl[i], tz, ts[i], decodeInfo[i])
-
-			if outputFormat & DSS_FILE :
-				tsc = makeTimeSeriesContainer(location, intvl[i], tz, ts[i], decodeInfo[i])
-				storeToDss(tsc, location, decodeInfo[i])
-
-			if outputFormat & CWMS_DB  :
-				storeToCwmsDb(location, intvl[i], tz, ts[i], decodeInfo[i])
-
-	try:
-		if outputFormat & CWMS_DB and storeToCwmsDbSuccessful:
-			log.output("successful list appended.")
-			successful.append(location)
-		elif outputFormat & CWMS_DB and not storeToCwmsDbSuccessful:
-			haserror.append(location)
-			log.output("haserror list appended.")
-		else: successful.append(location)
-	except: pass
-#------------------------#
-# output run information #
-#------------------------#
-if outputLevel > NONE :
-	log.output("\n=== getUSGS version %s (%s) starting up ===" % (programVersion, programDate))
-	if cmdlineSpecs.has_key("timezone") and timeZone.getID() != cmdlineSpecs["timezone"] and beginTime is not None :
-		log.output("WARNING: Couldn't set input time zone to %s, using %s" % (dssTimezone,timezones["DSS"].getID()))
-	log.output("Using locations file %s" % locationsFilename)
-	log.output("Using parameters file %s" % parametersFilename)
-	log.output("Using parameter alias file %s" % paramAliasFilename)
-	if inputFilename :
-		log.output("Retrieving data from input file %s" % inputFilename)
-	elif beginTime and endTime :
-		log.output("Retrieving data for Start Date = %(x)s and End Date = %(y)s" % {"x" : str(beginTime), "y" : str(endTime)})
-	else:
-		log.output("Retrieving data for previous %d hours" % hourCount)
-	if outputFormat :
-		if outputFormat & USGS_TEXT :
-			log.output("Outputting USGS text")
-		if outputFormat & SHEF_TEXT :
-			if shefTimezone :
-				log.output("Outputting SHEF data in %s time zone (SHEF time zone code %s)" % (shefTimezone, tzInfo[shefTimezone]["SHEF"]))
-			else :
-				log.output("Outputting SHEF data in time zone used by USGS")
-		if outputFormat & DSS_FILE :
-			if dssTimezone :
-				log.output("Outputting to DSS file %s in %s time zone" % (dssFilename, dssTimezone))
+		self.timezones["USGS"] = result.usgsTimezone
+		if self.outputFormat & CWMS_DB :
+			#---------------------------------------------------------#
+			# hold the accounting for the location until all of its   #
+			# queued time series have been stored                     #
+			#---------------------------------------------------------#
+			self.cwmsPending[location] = [1, not result.partial]
+			queued = False
+		#---------------------------------------------------------#
+		# don't advance the watermarks past a chunk of the window #
+		# that wasn't retrieved                                   #
+		#---------------------------------------------------------#
+		if result.partial :
+			self.log.normal("*** Not all of the time window retrieved, watermarks not updated ***")
+		#---------------------------------------------------------#
+		# count the time series left to store to each sink, so    #
+		# the time the station is checked through is recorded     #
+		# once all of them are stored                             #
+		#---------------------------------------------------------#
+		unstored = dict([(sink, [len(result.series), None]) for sink in self.getSinks()])
+		for interval, records, plan in result.series :
+			if self.outputFormat & SHEF_TEXT :
+				self.outputShefText(location, interval, result.tz, records, plan)
+
+			if self.outputFormat & DSS_FILE :
+				def onDssStored(interval=interval, records=records, plan=plan) :
+					if not result.partial : self.updateWatermark("DSS:%s" % self.dssFilename, location, interval, records, plan, unstored)
+				tsc = self.makeTimeSeriesContainer(location, interval, result.tz, records, plan)
+				self.storeToDss(tsc, location, plan, onDssStored)
+
+			if self.outputFormat & CWMS_DB  :
+				def onStored(ok, interval=interval, records=records, plan=plan) :
+					if ok and not result.partial : self.updateWatermark("CWMS", location, interval, records, plan, unstored)
+					self.cwmsStored(location, ok)
+				self.cwmsPending[location][0] += 1
+				if self.storeToCwmsDb(location, interval, result.tz, records, plan, onStored) :
+					queued = True
+				else :
+					self.cwmsPending[location][0] -= 1
+
+		if self.outputFormat & CWMS_DB :
+			self.cwmsStored(location, queued)
+		elif result.partial :
+			self.haserror.append(location)
+		else :
+			self.successful.append(location)
+
+	def confirmNotFound(self) :
+		'''
+		Check the stations not found when only their parameters were requested
+		with the site service, which is asked for no parameters. The stations it
+		lists exist but have no data for their parameters (e.g., seasonal ones),
+		so they have no data rather than not being found. If the site service
+		can't be reached they are taken to have no data too, so that they aren't
+		skipped on later runs.
+		'''
+		if not self.unconfirmed : return
+		found = self.probeSites(self.unconfirmed)
+		if found is None :
+			self.log.normal("Couldn't check locations not found, taking them to have no data")
+			found = self.unconfirmed
+		notfound = []
+		for location in self.unconfirmed :
+			if location in found :
+				self.log.verbose("Location %s has no data for its parameters", location)
+				self.nodata.append(location)
 			else :
-				log.output("Outputting to DSS file %s in time zone used by USGS" % dssFilename)
-		if outputFormat & CWMS_DB :
-			log.output("Outputting to CWMS database with store rule %s" % storeRule)
-#-----------------------------------#
-# set up the Java time zones to use #
-#-----------------------------------#
-timezones = {"USGS" : None, "SHEF" : None, "DSS" : None}
-if shefTimezone :
-	timezones["SHEF"] = TimeZone.getTimeZone(tzInfo[shefTimezone]["JAVA"])
-if dssTimezone :
-	timezones["DSS"] = TimeZone.getTimeZone(tzInfo[dssTimezone]["JAVA"])
-#-----------------------------------------------#
-# read the parameter aliases file, if it exists #
-#-----------------------------------------------#
-"[USGS_PARAMETER],ALIAS"
-parameterAliases = {}
-aliasfile = open(paramAliasFilename, 'r')
-lines = aliasfile.read().strip().replace('\r', '').split("\n")
-aliasfile.close()
-parameterAliasKeys = parseCsv(lines[0].upper())
-for line in lines[1:] :
-		line = line.strip()
-		if not line or line.startswith("#") : continue
-		fields = parseCsv(line)
-		if not fields[0].strip() : continue
-		for i in range(1,len(parameterAliasKeys)) :
-			if parameterAliasKeys[i] == "ALIAS" :
-				parameterAliases[fields[i]] = fields[0]
-				break
-
-#---------------------------#
-# parse the parameters file #
-#---------------------------#
-"[USGS_PARAMETER],SHEF_PARAMETER,SHEF_FACTOR,SHEF_UNIT,DSS_PARAMETER,DSS_FACTOR,DSS_UNIT,DSS_TYPE,CWMS_FACTOR,CWMS_UNIT,CWMS_TYPE"
-parameters = {}
-parametersfile = open(parametersFilename, 'r')
-lines = parametersfile.read().strip().replace('\r', '').split('\n')
-parametersfile.close()
-parameterKeys = parseCsv(lines[0].upper())
-for line in lines[1:] :
-	line = line.strip()
-	if not line or line[0] == '#' : continue
-	fields = parseCsv(line)
-	if not fields[0].strip() : continue
-	parameters[fields[0]] = {}
-	for i in range(1,len(parameterKeys)) :
-		if parameterKeys[i].endswith("FACTOR") :
-			fields[i] = float(fields[i])
-		elif parameterKeys[i] == "SHEF_UNIT" :
-			fields[i] = fields[i].upper() != "ENGLISH"
-		parameters[fields[0]][parameterKeys[i]] = fields[i]
+				notfound.append(location)
+		if notfound :
+			self.notfound.extend(notfound)
+			self.notfoundDb.mark(notfound)
+		self.unconfirmed = []
+
+	def resetRun(self) :
+		'''
+		Reset the state kept for a single run. The retry budget is for a
+		single run, so the retry policy is reset too, and so are the request
+		counts of the circuit breaker, though not the state of its circuits.
+		'''
+		self.startTime    = time.time()
+		self.dssWriter    = None
+		self.shefWriter   = None
+		self.cwmsWriter   = None
+		self.watermarks   = None
+		self.pendingMarks = {}
+		self.pendingIntervals = {}
+		self.knownIntervals = {}
+		self.cwmsPending  = {}
+		self.unconfirmed  = []
+		self.locations    = {}
+		self.retryPolicy  = retry.RetryPolicy(self.retryCount, budget=self.retryBudget)
+		self.breaker.reset_counts()
+		self.successful, self.nodata, self.notfound, self.haserror = [], [], [], []
+
+	def logStartup(self) :
+		'''
+		Output the run information
+		'''
+		if self.outputLevel > NONE :
+			self.log.output("\n=== getUSGS version %s (%s) starting up ===" % (programVersion, programDate))
+			if self.specs.has_key("timezone") and self.timeZone.getID() != self.specs["timezone"] and self.beginTime is not None :
+				self.log.output("WARNING: Couldn't set input time zone to %s, using %s" % (self.specs["timezone"], self.timeZone.getID()))
+			self.log.output("Using locations file %s" % self.locationsFilename)
+			self.log.output("Using parameters file %s" % self.parametersFilename)
+			self.log.output("Using parameter alias file %s" % self.paramAliasFilename)
+			if self.inputFilename :
+				self.log.output("Retrieving data from input file %s" % self.inputFilename)
+			elif self.beginTime and self.endTime :
+				self.log.output("Retrieving data for Start Date = %(x)s and End Date = %(y)s" % {"x" : str(self.beginTime), "y" : str(self.endTime)})
+			else:
+				self.log.output("Retrieving data for previous %d hours" % self.hourCount)
+			if self.incremental and not self.inputFilename :
+				self.log.output("Retrieving only data after the last times stored, less %d minutes" % self.overlap)
+			if self.outputFormat :
+				if self.outputFormat & USGS_TEXT :
+					self.log.output("Outputting USGS text")
+				if self.outputFormat & SHEF_TEXT :
+					if self.shefTimezone :
+						self.log.output("Outputting SHEF data in %s time zone (SHEF time zone code %s)" % (self.shefTimezone, tzInfo[self.shefTimezone]["SHEF"]))
+					else :
+						self.log.output("Outputting SHEF data in time zone used by USGS")
+					if self.shefFilename :
+						self.log.output("Outputting SHEF data to file %s" % self.shefFilename)
+				if self.outputFormat & DSS_FILE :
+					if self.dssTimezone :
+						self.log.output("Outputting to DSS file %s in %s time zone" % (self.dssFilename, self.dssTimezone))
+					else :
+						self.log.output("Outputting to DSS file %s in time zone used by USGS" % self.dssFilename)
+				if self.outputFormat & CWMS_DB :
+					self.log.output("Outputting to CWMS database with store rule %s" % self.storeRule)
+
+	def loadConfig(self) :
+		'''
+		Load the parameter aliases, parameters, and locations, unless none of
+		their files has changed since they were last loaded. They're loaded from
+		the compiled snapshot next to the locations file if it's current, else
+		parsed from the files and saved to the snapshot for the next time.
+		'''
+		configFiles = (self.paramAliasFilename, self.parametersFilename, self.locationsFilename)
+		stamp = tuple([(os.path.getmtime(filename), os.path.getsize(filename)) for filename in configFiles])
+		if stamp == self.configStamp : return
+		snapshotFilename = self.locationsFilename + ".compiled"
+		config = readConfigSnapshot(snapshotFilename, configFiles)
+		if config is None :
+			config = self.parseConfig()
+			try :
+				writeConfigSnapshot(snapshotFilename, configFiles, config)
+			except Exception, e :
+				self.log.verbose("Couldn't save configuration snapshot %s: %s", snapshotFilename, e)
+		else :
+			self.log.verbose("Loaded configuration snapshot %s", snapshotFilename)
+		self.parameterAliases = config["parameterAliases"]
+		self.parameters       = config["parameters"]
+		self.allLocations     = config["locations"]
+		self.locationOrder    = config["locationOrder"]
+		self.outputPlans      = {}
+		self.configStamp      = stamp
+
+	def parseConfig(self) :
+		'''
+		Parse the parameter aliases, parameters, and locations files
+		'''
+		#-----------------------------------------------#
+		# read the parameter aliases file, if it exists #
+		#-----------------------------------------------#
+		"[USGS_PARAMETER],ALIAS"
+		parameterAliases = {}
+		aliasfile = open(self.paramAliasFilename, 'r')
+		lines = aliasfile.read().strip().replace('\r', '').split("\n")
+		aliasfile.close()
+		parameterAliasKeys = parseCsv(lines[0].upper())
+		for line in lines[1:] :
+				line = line.strip()
+				if not line or line.startswith("#") : continue
+				fields = parseCsv(line)
+				if not fields[0].strip() : continue
+				for i in range(1,len(parameterAliasKeys)) :
+					if parameterAliasKeys[i] == "ALIAS" :
+						parameterAliases[fields[i]] = fields[0]
+						break
+
+		#---------------------------#
+		# parse the parameters file #
+		#---------------------------#
+		"[USGS_PARAMETER],SHEF_PARAMETER,SHEF_FACTOR,SHEF_UNIT,DSS_PARAMETER,DSS_FACTOR,DSS_UNIT,DSS_TYPE,CWMS_FACTOR,CWMS_UNIT,CWMS_TYPE"
+		parameters = {}
+		parametersfile = open(self.parametersFilename, 'r')
+		lines = parametersfile.read().strip().replace('\r', '').split('\n')
+		parametersfile.close()
+		parameterKeys = parseCsv(lines[0].upper())
+		for line in lines[1:] :
+			line = line.strip()
+			if not line or line[0] == '#' : continue
+			fields = parseCsv(line)
+			if not fields[0].strip() : continue
+			parameters[fields[0]] = {}
+			for i in range(1,len(parameterKeys)) :
+				if parameterKeys[i].endswith("FACTOR") :
+					fields[i] = float(fields[i])
+				elif parameterKeys[i] == "SHEF_UNIT" :
+					fields[i] = fields[i].upper() != "ENGLISH"
+				parameters[fields[0]][parameterKeys[i]] = fields[i]
 
-#--------------------------#
-# parse the locations file #
-#--------------------------#
-"[USGS_LOC],SHEF_LOC,SHEF_PARAMETER_OVERRIDES,DSS_A-PART,DSS_B-PART,DSS_F-PART,DSS_SUB-LOCATIONS,DSS_SUB-PARAMETERS,CWMS_LOC,CWMS_VER,CWMS_SUB-LOCATIONS,CWMS_SUB-PARAMETERS,PARAMETERS"
-if forget :
-	for location in notfoundDb.keys() :
-		if outputLevel > NORMAL :
-			log.output("Forgetting previously not found location %s" % location)
-		del notfoundDb[location]
-locations = {}
-locationsfile = open(locationsFilename, 'r')
-lines = locationsfile.read().strip().replace('\r', '').split('\n')
-locationsfile.close()
-locationKeys = parseCsv(lines[0].upper())
-for line in lines[1:] :
-	line = line.strip()
-	if not line or line[0] == '#' : continue
-	fields = parseCsv(line)
-	if not fields[0].strip() : continue
-	location = fields[0]
-	if notfoundDb.has_key(location) :
-		if outputLevel > NORMAL and not inputFilename:
-			log.output("Skipping previously not found location %s" % location)
-		continue
-	locations[location] = {}
-	for i in range(1, len(locationKeys)) :
-		if locationKeys[i] in (
-			"SHEF_PARAMETER_OVERRIDES",
-			"DSS_SUB-LOCATIONS",
-			"DSS_SUB-PARAMETERS",
-			"CWMS_SUB-LOCATIONS",
-			"CWMS_SUB-PARAMETERS") :
-			pairs = fields[i].strip().split(",")
-			fields[i] = {}
-			for pair in pairs :
-				if not pair : continue
-				key, value = map(string.strip, pair.split("="))
-				if not key.isdigit():
-					raise Exception("Invalid key (%s) in %s column of %s for location %s" % (key, fields[i], locationsFilename, location))
-				if fields[i].has_key(key) :
-					raise Exception("Duplicate (%s) in %s column of %s for location %s" % (key, fields[i], locationsFilename, location))
-				fields[i][key] = value
-			log.output("\n%s : %s" % (locationKeys[i], str(fields[i])))
-		elif locationKeys[i] == "PARAMETERS" :
-			params = fields[i].split(",")
-			fields[i] = []
-			for param in params :
-				try    : fields[i].append(parameterAliases[param.strip()])
-				except : fields[i].append(param.strip())
-		elif locationKeys[i] == "TS_IDS" :
-			fields[i] = fields[i].split(",")
-		locations[location][locationKeys[i]] = fields[i]
-#-----------------------#
-# process the locations #
-#-----------------------#
-if inputFilename :
-	retrievalCount = 1
-else :
-	retrievalCount = len(locations)
-i = 0
-try :
-	if inputFilename :
-		location = os.path.splitext(os.path.basename(inputFilename))[0]
-		if location not in locations.keys() :
-			msg = 'Location "%s" is unknown (taken from input file name "%s")' % (location, inputFilename)
-			log.output("\n%s" % msg)
-			raise Exception(msg)
-		processLocation(inputFilename, locations[location], i, retrievalCount)
-	else :
-		for location in locations.keys() :
-			i += 1
-			processLocation(location, locations[location], i, retrievalCount)
-finally :
-	if dssfile    : dssfile.done()
-	if db         : db.close()
-	if notfoundDb : notfoundDb.close()
-#-----------------------#
-# output the statistics #
-#-----------------------#
-remainingCount = retrievalCount - len(successful) - len(notfound) - len(nodata) - len(haserror)
-if outputLevel > NONE :
-	log.output("\n%d of %d stations successfully processed" % (len(successful), retrievalCount))
-	if len(notfound) > 0 :
-		log.output("\n%d of %d stations were not found" % (len(notfound), retrievalCount))
-		if outputLevel > NORMAL :
-			for i in range(len(notfound)) :
-				loc = notfound[i]
-				line = "\t%s" % loc
-				if locations[loc].has_key("SHEF_LOC") and locations[loc]["SHEF_LOC"] : line += ", SHEF=%s" % locations[loc]["SHEF_LOC"]
-				if locations[loc].has_key("DSS_B-PART") and locations[loc]["DSS_B-PART"] : line += ", DSS=%s" % locations[loc]["DSS_B-PART"]
-				if locations[loc].has_key("CWMS_LOC") and locations[loc]["CWMS_LOC"] : line += ", CWMS=%s" % locations[loc]["CWMS_LOC"]
-				log.output(line)
-	if len(nodata) > 0 :
-		log.output("\n%d of %d stations had no data" % (len(nodata), retrievalCount))
-		if outputLevel > NORMAL :
-			for i in range(len(nodata)) :
-				loc = nodata[i]
-				line = "\t%s" % loc
-				if locations[loc].has_key("SHEF_LOC") and locations[loc]["SHEF_LOC"] : line += ", SHEF=%s" % locations[loc]["SHEF_LOC"]
-				if locations[loc].has_key("DSS_B-PART") and locations[loc]["DSS_B-PART"] : line += ", DSS=%s" % locations[loc]["DSS_B-PART"]
-				if locations[loc].has_key("CWMS_LOC") and locations[loc]["CWMS_LOC"] : line += ", CWMS=%s" % locations[loc]["CWMS_LOC"]
-				log.output(line)
-	if len(haserror) > 0 :
-		log.output("\n%d of %d stations had errors" % (len(haserror), retrievalCount))
-		if outputLevel > NORMAL :
-			for i in range(len(haserror)) :
-				loc = haserror[i]
-				line = "\t%s" % loc
-				if locations[loc].has_key("SHEF_LOC") and locations[loc]["SHEF_LOC"] : line += ", SHEF=%s" % locations[loc]["SHEF_LOC"]
-				if locations[loc].has_key("DSS_B-PART") and locations[loc]["DSS_B-PART"] : line += ", DSS=%s" % locations[loc]["DSS_B-PART"]
-				if locations[loc].has_key("CWMS_LOC") and locations[loc]["CWMS_LOC"] : line += ", CWMS=%s" % locations[loc]["CWMS_LOC"]
-				log.output(line)
-	if remainingCount > 0 :
-		log.output("\n%d of %d stations were not attempted due to abort" % (remainingCount, retrievalCount))
-	endTime = time.time()
-	elapsed = int(endTime - startTime)
-	h = elapsed / 3600
-	m = (elapsed - 3600 * h) / 60
-	s = elapsed % 60
-	log.output("\n=== getUSGS version %s (%s) was alive for %2.2d:%2.2d:%2.2d ===" % (programVersion, programDate, h, m, s))
-sys.exit()
+		#--------------------------#
+		# parse the locations file #
+		#--------------------------#
+		"[USGS_LOC],SHEF_LOC,SHEF_PARAMETER_OVERRIDES,DSS_A-PART,DSS_B-PART,DSS_F-PART,DSS_SUB-LOCATIONS,DSS_SUB-PARAMETERS,CWMS_LOC,CWMS_VER,CWMS_SUB-LOCATIONS,CWMS_SUB-PARAMETERS,PARAMETERS"
+		locations = {}
+		locationOrder = []
+		locationsfile = open(self.locationsFilename, 'r')
+		lines = locationsfile.read().strip().replace('\r', '').split('\n')
+		locationsfile.close()
+		locationKeys = parseCsv(lines[0].upper())
+		for line in lines[1:] :
+			line = line.strip()
+			if not line or line[0] == '#' : continue
+			fields = parseCsv(line)
+			if not fields[0].strip() : continue
+			location = fields[0]
+			locations[location] = {}
+			locationOrder.append(location)
+			for i in range(1, len(locationKeys)) :
+				if locationKeys[i] in (
+					"SHEF_PARAMETER_OVERRIDES",
+					"DSS_SUB-LOCATIONS",
+					"DSS_SUB-PARAMETERS",
+					"CWMS_SUB-LOCATIONS",
+					"CWMS_SUB-PARAMETERS") :
+					pairs = fields[i].strip().split(",")
+					fields[i] = {}
+					for pair in pairs :
+						if not pair : continue
+						key, value = map(string.strip, pair.split("="))
+						if not key.isdigit():
+							raise Exception("Invalid key (%s) in %s column of %s for location %s" % (key, fields[i], self.locationsFilename, location))
+						if fields[i].has_key(key) :
+							raise Exception("Duplicate (%s) in %s column of %s for location %s" % (key, fields[i], self.locationsFilename, location))
+						fields[i][key] = value
+					self.log.output("\n%s : %s" % (locationKeys[i], str(fields[i])))
+				elif locationKeys[i] == "PARAMETERS" :
+					params = fields[i].split(",")
+					fields[i] = []
+					for param in params :
+						try    : fields[i].append(parameterAliases[param.strip()])
+						except : fields[i].append(param.strip())
+				elif locationKeys[i] == "TS_IDS" :
+					fields[i] = fields[i].split(",")
+				locations[location][locationKeys[i]] = fields[i]
+		return {
+			"parameterAliases" : parameterAliases,
+			"parameters"       : parameters,
+			"locations"        : locations,
+			"locationOrder"    : locationOrder,
+		}
+
+	def selectLocations(self, stations=None) :
+		'''
+		The locations to retrieve - all of the locations in the locations file
+		or only the specified stations - less the previously not found
+		locations that aren't yet due to be checked again
+		'''
+		if stations is None :
+			stations = self.locationOrder
+		else :
+			for station in stations :
+				if not self.allLocations.has_key(station) :
+					raise Exception("Location %s is not in locations file %s" % (station, self.locationsFilename))
+		if self.forget :
+			#------------------------------#
+			# forget only on the first run #
+			#------------------------------#
+			for location in self.notfoundDb.forget() :
+				if self.outputLevel > NORMAL :
+					self.log.output("Forgetting previously not found location %s" % location)
+			self.forget = False
+		notfoundEntries = self.notfoundDb.entries()
+		locations = {}
+		reprobes = []
+		for location in stations :
+			if notfoundEntries.has_key(location) :
+				if self.inputFilename or not self.notfoundDb.is_due(notfoundEntries[location]) :
+					if self.outputLevel > NORMAL and not self.inputFilename:
+						self.log.output("Skipping previously not found location %s" % location)
+					continue
+				reprobes.append(location)
+			locations[location] = self.allLocations[location]
+		#--------------------------------------------------------#
+		# re-check the previously not found locations that are   #
+		# due, keeping only those that the USGS now has data for #
+		#--------------------------------------------------------#
+		if reprobes :
+			found = self.probeSites(reprobes)
+			if found is None :
+				self.log.normal("Couldn't check previously not found locations, skipping them")
+				found = []
+			else :
+				self.notfoundDb.forget(found)
+				self.notfoundDb.mark([location for location in reprobes if location not in found])
+			for location in reprobes :
+				if location in found :
+					self.log.verbose("Previously not found location %s has data again", location)
+				else :
+					if self.outputLevel > NORMAL :
+						self.log.output("Skipping previously not found location %s" % location)
+					del locations[location]
+		return locations
+
+	def logStatistics(self, retrievalCount) :
+		'''
+		Output the statistics for a run
+		'''
+		if self.outputLevel == NONE : return
+		remainingCount = retrievalCount - len(self.successful) - len(self.notfound) - len(self.nodata) - len(self.haserror)
+		self.log.output("\n%d of %d stations successfully processed" % (len(self.successful), retrievalCount))
+		for stations, description in (
+			(self.notfound, "were not found"),
+			(self.nodata,   "had no data"),
+			(self.haserror, "had errors")) :
+			if not stations : continue
+			self.log.output("\n%d of %d stations %s" % (len(stations), retrievalCount, description))
+			if self.outputLevel > NORMAL :
+				for loc in stations :
+					line = "\t%s" % loc
+					if self.locations[loc].has_key("SHEF_LOC") and self.locations[loc]["SHEF_LOC"] : line += ", SHEF=%s" % self.locations[loc]["SHEF_LOC"]
+					if self.locations[loc].has_key("DSS_B-PART") and self.locations[loc]["DSS_B-PART"] : line += ", DSS=%s" % self.locations[loc]["DSS_B-PART"]
+					if self.locations[loc].has_key("CWMS_LOC") and self.locations[loc]["CWMS_LOC"] : line += ", CWMS=%s" % self.locations[loc]["CWMS_LOC"]
+					self.log.output(line)
+		if remainingCount > 0 :
+			self.log.output("\n%d of %d stations were not attempted due to abort" % (remainingCount, retrievalCount))
+		if self.dssWriter :
+			self.log.output("\n%d DSS records stored, %d unchanged and %d failed in %.2f seconds of DSS I/O" % (self.dssWriter.written, self.dssWriter.unchanged, self.dssWriter.failed, self.dssWriter.ioTime))
+		if self.cwmsWriter and self.cwmsWriter.latencies :
+			latencies = [latency[1] for latency in self.cwmsWriter.latencies]
+			self.log.output("\n%d CWMS time series stored and %d failed in %d batches, %.2f seconds (longest batch %.2f seconds)" % (self.cwmsWriter.stored, self.cwmsWriter.failed, len(latencies), sum(latencies), max(latencies)))
+		hostLines = self.breaker.report()
+		if hostLines :
+			self.log.output("\nRequests by host:")
+			for line in hostLines : self.log.output("\t%s" % line)
+		elapsed = int(time.time() - self.startTime)
+		h = elapsed / 3600
+		m = (elapsed - 3600 * h) / 60
+		s = elapsed % 60
+		self.log.output("\n=== getUSGS version %s (%s) was alive for %2.2d:%2.2d:%2.2d ===" % (programVersion, programDate, h, m, s))
+
+	def run(self, stations=None) :
+		'''
+		Retrieve and output the data for all of the locations in the locations
+		file, or for only the specified stations. Returns the stations processed
+		keyed by outcome ("successful", "nodata", "notfound", and "haserror").
+		'''
+		self.resetRun()
+		self.logStartup()
+		self.loadConfig()
+		self.locations = self.selectLocations(stations)
+		#-----------------------#
+		# process the locations #
+		#-----------------------#
+		if self.inputFilename :
+			retrievalCount = 1
+		else :
+			retrievalCount = len(self.locations)
+		i = 0
+		try :
+			if self.inputFilename :
+				location = os.path.splitext(os.path.basename(self.inputFilename))[0]
+				if location not in self.locations.keys() :
+					msg = 'Location "%s" is unknown (taken from input file name "%s")' % (location, self.inputFilename)
+					self.log.output("\n%s" % msg)
+					raise Exception(msg)
+				self.storeLocation(self.retrieveLocation(self.inputFilename, self.locations[location], i, retrievalCount))
+			else :
+				tasks = []
+				for location in self.locations.keys() :
+					i += 1
+					tasks.append((location, self.locations[location], i, retrievalCount, self.getStart(location)))
+				batches = [(batch,) for batch in self.makeBatches(tasks)]
+				if self.workerCount > 1 :
+					for results in retrieveConcurrently(self.retrieveBatch, batches, self.workerCount) :
+						for result in results : self.storeLocation(result)
+				else :
+					for batch in batches :
+						for result in self.retrieveBatch(*batch) : self.storeLocation(result)
+				self.confirmNotFound()
+		finally :
+			if self.dssWriter  : self.dssWriter.close()
+			if self.shefWriter : self.shefWriter.close()
+			if self.cwmsWriter : self.cwmsWriter.close()
+			self.log.setContext()
+			self.log.flush()
+			if self.pendingMarks : self.watermarkDb.update(self.pendingMarks, self.pendingIntervals)
+			if self.responseCache :
+				evicted = self.responseCache.evict()
+				if evicted and self.outputLevel > NORMAL : self.log.output("\nRemoved %d responses from cache %s" % (evicted, self.cacheDir))
+		self.logStatistics(retrievalCount)
+		self.log.flush()
+		return {
+			"successful" : list(self.successful),
+			"nodata"     : list(self.nodata),
+			"notfound"   : list(self.notfound),
+			"haserror"   : list(self.haserror),
+		}
+
+	def run_station(self, station) :
+		'''
+		Retrieve and output the data for one station in the locations file.
+		Returns its outcome ("successful", "nodata", "notfound", or "haserror"),
+		or None if it was skipped as previously not found.
+		'''
+		results = self.run([station])
+		for outcome in results.keys() :
+			if station in results[outcome] : return outcome
+		return None
+
+def main(argv=None) :
+	'''
+	Run getUSGS with the command line arguments
+	'''
+	if argv is None : argv = sys.argv[1:]
+	specs, errorLines = parseCommandLine(argv)
+	engine = None
+	try :
+		engine = GetUsgsEngine(**specs)
+	except ConfigurationError, e :
+		errorLines.extend(e.errors)
+	if errorLines :
+		sys.stderr.write(__doc__)
+		sys.stderr.write("***\n")
+		for errorLine in errorLines :
+			sys.stderr.write("*** ERROR : %s\n" % errorLine)
+		sys.stderr.write("***\n")
+		System.exit(-1)
+	engine.run()
+	sys.exit()
+
+if __name__ == "__main__" : main()
@@ -0,0 +1,114 @@
+"""Stations the USGS reported as not found
+
+Each entry records when a station was first reported as not found, when it
+was last probed, and how many times in a row it has been found missing.  A
+station is skipped until its re-probe time, which doubles with each failure
+up to a maximum, so gauges that come back online are picked up again
+without spending a full data request on every dead gauge every run.
+
+The entries are kept in the anydbm file used by earlier versions of
+getusgs, which several getusgs processes and engines can share (see
+dbmstore).
+"""
+
+import time
+
+from rtsutils.usgs.dbmstore import LockedDbm
+
+
+class NotFoundStore(LockedDbm):
+    """Not-found entries with exponential re-probe intervals
+
+    Parameters
+    ----------
+    path : str
+        anydbm file holding the entries
+    ttl : int, optional
+        seconds before a station is first re-probed, by default 1 day
+    max_ttl : int, optional
+        maximum seconds between re-probes, by default 30 days
+    lock_timeout : int, optional
+        seconds to wait for the lock file, by default 30
+    """
+
+    def __init__(self, path, ttl=86400, max_ttl=30 * 86400, lock_timeout=30):
+        LockedDbm.__init__(self, path, lock_timeout)
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+
+    @staticmethod
+    def parse(value):
+        """entry from its stored value
+
+        Entries written by earlier versions of getusgs hold "True" and are
+        returned as one failure that is due for a re-probe.
+
+        Returns
+        -------
+        tuple
+            first seen and last probed (epoch seconds) and failure count
+        """
+        try:
+            first_seen, last_probe, failures = value.split(",")
+            return float(first_seen), float(last_probe), int(failures)
+        except ValueError:
+            return 0.0, 0.0, 1
+
+    def entries(self):
+        """all entries keyed by station
+
+        Returns
+        -------
+        dict
+            (first seen, last probed, failures) for each station
+        """
+        with self.opened() as db:
+            return dict([(key, self.parse(db[key])) for key in db.keys()])
+
+    def next_probe(self, entry):
+        """time (epoch seconds) an entry is due to be re-probed"""
+        first_seen, last_probe, failures = entry
+        return last_probe + min(self.ttl * 2 ** max(failures - 1, 0), self.max_ttl)
+
+    def is_due(self, entry, now=None):
+        """whether an entry is due to be re-probed"""
+        return (now or time.time()) >= self.next_probe(entry)
+
+    def mark(self, stations):
+        """record another failure for each station, now
+
+        Parameters
+        ----------
+        stations : sequence of str
+            stations reported or probed as not found
+        """
+        now = time.time()
+        with self.opened() as db:
+            for station in stations:
+                if db.has_key(station):
+                    first_seen, last_probe, failures = self.parse(db[station])
+                    first_seen = first_seen or now
+                else:
+                    first_seen, failures = now, 0
+                db[station] = "{:.0f},{:.0f},{:d}".format(first_seen, now, failures + 1)
+
+    def forget(self, stations=None):
+        """remove the entries for stations, or all entries
+
+        Parameters
+        ----------
+        stations : sequence of str, optional
+            stations to remove, by default None to remove all
+
+        Returns
+        -------
+        list
+            stations whose entries were removed
+        """
+        with self.opened() as db:
+            if stations is None:
+                stations = db.keys()
+            removed = [station for station in set(stations) if db.has_key(station)]
+            for station in removed:
+                del db[station]
+            return removed
@@ -0,0 +1,160 @@
+"""Numbers and qualities of the values in USGS rdb data
+
+A value column of rdb data holds a number or, when there is none, a flag
+such as "Ice", "Eqp" (equipment malfunction) or "Ssn" (monitored
+seasonally), and the "_cd" column after it qualifies the value, e.g. "P"
+(provisional), "A" (approved) or "A:e" (approved, estimated).  Converting
+the values with float() inside try/except raises an exception for every
+flag, which is slow in Jython; a ValueDecoder instead classifies each
+distinct token once with a regular expression and remembers the outcome,
+and maps each distinct qualifier to a HEC/CWMS quality code.
+
+The quality codes use the screened and validity bits of the HEC/CWMS
+quality word:
+
+    ==========================  =====================================
+    qualifier                   quality
+    ==========================  =====================================
+    A (approved)                SCREENED | OKAY
+    P (provisional), none       0 (not screened)
+    e, <, > (estimated, bound)  SCREENED | QUESTIONABLE
+    no number (flag or gap)     MISSING, keeping the screened bit
+    ==========================  =====================================
+"""
+
+import re
+
+SCREENED = 1
+OKAY = 2
+MISSING = 4
+QUESTIONABLE = 8
+REJECTED = 16
+VALIDITY = OKAY | MISSING | QUESTIONABLE | REJECTED
+
+NUMBER = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$")
+CACHE_LIMIT = 65536
+
+
+class ValueDecoder:
+    """Numbers and qualities of rdb value and qualifier tokens
+
+    The outcome for each distinct token is cached, up to cache_limit
+    tokens, so a decoder is best shared by all the series it decodes.
+
+    Parameters
+    ----------
+    cache_limit : int, optional
+        most number tokens cached, the cache being emptied when full, by
+        default CACHE_LIMIT
+    """
+
+    def __init__(self, cache_limit=CACHE_LIMIT):
+        self.cache_limit = cache_limit
+        self.numbers = {"": None}
+        self.qualities = {}
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({count} tokens)".format(self=self, count=len(self.numbers))
+
+    def number(self, token):
+        """number of a value token
+
+        Parameters
+        ----------
+        token : str
+            value token
+
+        Returns
+        -------
+        float
+            the number, or None if the token is a flag or empty
+        """
+        try:
+            return self.numbers[token]
+        except KeyError:
+            pass
+        number = float(token) if NUMBER.match(token) else None
+        if len(self.numbers) >= self.cache_limit:
+            self.numbers = {"": None}
+        self.numbers[token] = number
+        return number
+
+    def quality(self, code):
+        """quality code of a qualifier token for a value with a number
+
+        Parameters
+        ----------
+        code : str
+            qualifier, e.g. "P" or "A:e"
+
+        Returns
+        -------
+        int
+            HEC/CWMS quality code
+        """
+        try:
+            return self.qualities[code]
+        except KeyError:
+            pass
+        quality = 0
+        for part in code.split(":"):
+            if part == "A":
+                quality |= SCREENED | OKAY
+            elif part in ("e", "E", "<", ">"):
+                quality |= SCREENED | QUESTIONABLE
+        if quality & QUESTIONABLE:
+            quality &= ~OKAY
+        self.qualities[code] = quality
+        return quality
+
+    def decode(self, tokens, codes=None):
+        """numbers and qualities of a series of values
+
+        Parameters
+        ----------
+        tokens : sequence of str
+            value tokens
+        codes : sequence of str, optional
+            qualifier tokens for each value, by default None
+
+        Returns
+        -------
+        tuple[list, list]
+            the numbers (None where there is none) and the quality codes,
+            or None for the quality codes if no qualifiers were given
+        """
+        numbers = self.numbers
+        number = self.number
+        values = [numbers[t] if t in numbers else number(t) for t in tokens]
+        if codes is None:
+            return values, None
+        qualities = self.qualities
+        quality = self.quality
+        flags = [qualities[c] if c in qualities else quality(c) for c in codes]
+        for i in range(len(values)):
+            if values[i] is None:
+                flags[i] = (flags[i] & ~VALIDITY) | MISSING
+        return values, flags
+
+
+def scaled(numbers, factor, missing=None):
+    """numbers multiplied by a unit factor
+
+    Parameters
+    ----------
+    numbers : sequence of float
+        numbers, None where there is none
+    factor : float
+        unit factor
+    missing : object, optional
+        value for the missing numbers, by default None
+
+    Returns
+    -------
+    list
+        the scaled numbers
+    """
+    if factor == 1:
+        return [missing if n is None else n for n in numbers]
+    return [missing if n is None else n * factor for n in numbers]
+
@@ -0,0 +1,71 @@
+"""Last times stored for the time series retrieved by getusgs
+
+Each entry maps a key naming a store, station and time series to the last
+time (epoch milliseconds) stored for it, and is used to retrieve only the
+newer data with --incremental.  The interval (minutes) of a regular time
+series is kept with its watermark, for windows too short to determine it.
+An engine collects its watermarks during a run and merges them into the
+file once at the end, keeping the later of its time and the stored one, so
+runs sharing the file never move a watermark back.
+"""
+
+from rtsutils.usgs.dbmstore import LockedDbm
+
+
+class WatermarkStore(LockedDbm):
+    """Watermarks kept in an anydbm file
+
+    Parameters
+    ----------
+    path : str
+        anydbm file holding the watermarks
+    lock_timeout : int, optional
+        seconds to wait for the lock file, by default 30
+    """
+
+    def marks(self):
+        """all watermarks
+
+        Returns
+        -------
+        dict
+            last time stored (epoch milliseconds) keyed by watermark key
+        """
+        with self.opened() as db:
+            return dict([(key, long(db[key].split()[0])) for key in db.keys()])
+
+    def intervals(self):
+        """intervals kept with the watermarks
+
+        Returns
+        -------
+        dict
+            interval (minutes) keyed by watermark key, for the keys that have
+            one
+        """
+        with self.opened() as db:
+            fields = [(key, db[key].split()) for key in db.keys()]
+            return dict([(key, int(f[1])) for key, f in fields if len(f) > 1])
+
+    def update(self, marks, intervals=None):
+        """merge watermarks, keeping the later time for each key
+
+        Parameters
+        ----------
+        marks : dict
+            last time stored (epoch milliseconds) keyed by watermark key
+        intervals : dict, optional
+            interval (minutes) keyed by watermark key, kept with the time
+            where it is the later one, by default None
+        """
+        intervals = intervals or {}
+        with self.opened() as db:
+            for key, last in marks.items():
+                stored = db.has_key(key) and db[key].split() or []
+                if stored and long(stored[0]) >= last:
+                    continue
+                interval = intervals.get(key, stored[1] if len(stored) > 1 else None)
+                if interval is None:
+                    db[key] = str(last)
+                else:
+                    db[key] = "%s %s" % (last, interval)
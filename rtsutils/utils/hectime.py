@@ -0,0 +1,250 @@
+"""Epoch milliseconds to HecTime values without formatting date strings
+
+A HecTime value is the count of minutes (or seconds) of local wall-clock
+time since the HEC epoch, so an instant converts to it by adding the time
+zone's offset from UTC and rescaling.  The offsets are kept per time zone
+in a table of UTC days, each holding the offsets before and after the
+transition (if any) that falls in the day, so converting a series asks the
+TimeZone only once per day instead of formatting and parsing a date string
+for every value.
+
+SimpleDateFormat instances are expensive to make and not thread safe;
+date_format keeps one per pattern and time zone for each thread.
+"""
+
+import threading
+
+from java.text import SimpleDateFormat
+from java.util import TimeZone
+
+HEC_EPOCH_MINUTES = 25568 * 1440  # HecTime value of 01Jan1970, 00:00
+HEC_EPOCH_SECONDS = HEC_EPOCH_MINUTES * 60
+MINUTE_MILLIS = 60000
+SECOND_MILLIS = 1000
+DAY_MILLIS = 86400000
+
+_zones = {}
+_zones_lock = threading.Lock()
+_local = threading.local()
+
+
+def _time_zone(zone):
+    """TimeZone for a TimeZone or time zone ID"""
+    if isinstance(zone, basestring):
+        return TimeZone.getTimeZone(zone)
+    return zone
+
+
+class ZoneOffsets:
+    """Offsets of a time zone from UTC, cached by UTC day
+
+    Parameters
+    ----------
+    zone : java.util.TimeZone
+        time zone
+    """
+
+    def __init__(self, zone):
+        self.zone = zone.clone()
+        self.days = {}
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({id})".format(self=self, id=self.zone.getID())
+
+    def _day(self, day):
+        """(transition, offset before, offset after) for a UTC day, finding
+        the millisecond of a transition in the day by bisection"""
+        begin = day * DAY_MILLIS
+        end = begin + DAY_MILLIS - 1
+        before = self.zone.getOffset(begin)
+        after = self.zone.getOffset(end)
+        if before == after:
+            entry = (end + 1, before, after)
+        else:
+            while end - begin > 1:
+                middle = (begin + end) // 2
+                if self.zone.getOffset(middle) == before:
+                    begin = middle
+                else:
+                    end = middle
+            entry = (end, before, after)
+        self.days[day] = entry
+        return entry
+
+    def offset(self, millis):
+        """offset from UTC in milliseconds
+
+        Parameters
+        ----------
+        millis : int
+            epoch milliseconds
+
+        Returns
+        -------
+        int
+            milliseconds to add to UTC for the local time at the instant
+        """
+        try:
+            transition, before, after = self.days[millis // DAY_MILLIS]
+        except KeyError:
+            transition, before, after = self._day(millis // DAY_MILLIS)
+        if millis < transition:
+            return before
+        return after
+
+    def minutes(self, millis):
+        """HecTime value (minute granularity) of an instant in the time zone
+
+        Parameters
+        ----------
+        millis : int
+            epoch milliseconds
+
+        Returns
+        -------
+        int
+            minutes of local time since the HEC epoch
+        """
+        return (millis + self.offset(millis)) // MINUTE_MILLIS + HEC_EPOCH_MINUTES
+
+
+def zone_offsets(zone):
+    """shared ZoneOffsets of a time zone
+
+    Parameters
+    ----------
+    zone : java.util.TimeZone or str
+        time zone or time zone ID
+
+    Returns
+    -------
+    ZoneOffsets
+        offsets cached for every caller using the time zone
+    """
+    zone = _time_zone(zone)
+    key = zone.getID()
+    try:
+        return _zones[key]
+    except KeyError:
+        with _zones_lock:
+            if key not in _zones:
+                _zones[key] = ZoneOffsets(zone)
+            return _zones[key]
+
+
+def minutes(millis, zone=None):
+    """HecTime value (minute granularity) of an instant
+
+    Parameters
+    ----------
+    millis : int
+        epoch milliseconds
+    zone : java.util.TimeZone or str, optional
+        time zone of the HecTime value, by default None for UTC
+
+    Returns
+    -------
+    int
+        minutes of local time since the HEC epoch, the same as setting a
+        HecTime from the instant formatted as "ddMMMyyyy, HH:mm"
+    """
+    if zone is not None:
+        millis += zone_offsets(zone).offset(millis)
+    return millis // MINUTE_MILLIS + HEC_EPOCH_MINUTES
+
+
+def seconds(millis, zone=None):
+    """HecTime value (second granularity) of an instant
+
+    Parameters
+    ----------
+    millis : int
+        epoch milliseconds
+    zone : java.util.TimeZone or str, optional
+        time zone of the HecTime value, by default None for UTC
+
+    Returns
+    -------
+    int
+        seconds of local time since the HEC epoch
+    """
+    if zone is not None:
+        millis += zone_offsets(zone).offset(millis)
+    return millis // SECOND_MILLIS + HEC_EPOCH_SECONDS
+
+
+def minutes_list(millis, zone=None):
+    """HecTime values (minute granularity) of a sequence of instants
+
+    Parameters
+    ----------
+    millis : sequence of int
+        epoch milliseconds
+    zone : java.util.TimeZone or str, optional
+        time zone of the HecTime values, by default None for UTC
+
+    Returns
+    -------
+    list of int
+        minutes of local time since the HEC epoch
+    """
+    if zone is None:
+        return [m // MINUTE_MILLIS + HEC_EPOCH_MINUTES for m in millis]
+    to_minutes = zone_offsets(zone).minutes
+    return [to_minutes(m) for m in millis]
+
+
+def date_format(pattern, zone=None):
+    """SimpleDateFormat of the calling thread
+
+    The instance is shared by every call from the thread with the same
+    pattern and time zone, so it must not be changed by the caller.
+
+    Parameters
+    ----------
+    pattern : str
+        SimpleDateFormat pattern
+    zone : java.util.TimeZone or str, optional
+        time zone to format and parse in, by default None for the default
+        time zone
+
+    Returns
+    -------
+    java.text.SimpleDateFormat
+        format for the calling thread
+    """
+    try:
+        formats = _local.formats
+    except AttributeError:
+        formats = _local.formats = {}
+    zone = _time_zone(zone) if zone is not None else None
+    key = (pattern, zone.getID() if zone is not None else None)
+    try:
+        return formats[key]
+    except KeyError:
+        sdf = SimpleDateFormat(pattern)
+        if zone is not None:
+            sdf.setTimeZone(zone)
+        formats[key] = sdf
+        return sdf
+
+
+def parse_millis(text, pattern, zone=None):
+    """epoch milliseconds of a date string
+
+    Parameters
+    ----------
+    text : str
+        date string
+    pattern : str
+        SimpleDateFormat pattern of the string
+    zone : java.util.TimeZone or str, optional
+        time zone of the string if the pattern has none, by default None
+        for the default time zone
+
+    Returns
+    -------
+    int
+        epoch milliseconds
+    """
+    return date_format(pattern, zone).parse(text).getTime()
@@ -0,0 +1,429 @@
+"""HTTP helpers shared by the rtsutils fetchers
+
+Requests are made by an HttpClient on the JVM's HttpURLConnection, which
+keeps idle connections to each host alive for reuse and caches TLS sessions,
+so a run of many requests pays for the connection and TLS handshake about
+once per host rather than once per request.  The client limits the requests
+open to each host at once, applies connect and read timeouts and reports the
+timing of each request to an optional hook.  Its open method stands in for
+urllib2.urlopen, e.g. as the opener of retry.open_url.
+
+Requests ask for gzip-compressed bodies with ACCEPT_ENCODING, and responses
+are wrapped in a DecodedResponse, which decompresses the body as it is read
+(never holding the whole body) and counts the bytes received before and
+after decompression.
+"""
+
+import StringIO
+import threading
+import time
+import urllib2
+import urlparse
+import zlib
+
+import jarray
+from java.io import IOException
+from java.lang import System
+from java.net import InetSocketAddress
+from java.net import Proxy
+from java.net import URL
+
+ACCEPT_ENCODING = {"Accept-Encoding": "gzip"}
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 300
+MAX_PER_HOST = 8
+
+
+def header(response, name):
+    """value of a response header, or None
+
+    Works with the mimetools.Message of a urllib2 response or HTTPError as
+    well as a plain dict.
+    """
+    info = response.info() if hasattr(response, "info") else None
+    if info is None:
+        return None
+    if hasattr(info, "getheader"):
+        return info.getheader(name)
+    for key in info.keys():
+        if key.lower() == name.lower():
+            return info[key]
+    return None
+
+
+class Headers(dict):
+    """Response headers looked up without regard to case, like the
+    mimetools.Message of a urllib2 response"""
+
+    def __init__(self, items=()):
+        dict.__init__(self)
+        for name, value in items:
+            self[name] = value
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name.lower(), value)
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+    def has_key(self, name):
+        return name in self
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+    def getheader(self, name, default=None):
+        return self.get(name, default)
+
+
+class ConnectionResponse:
+    """File-like response read from an HttpURLConnection
+
+    The body is streamed from the connection as it is read.  Closing the
+    response after reading the whole body returns the connection to the
+    JVM's pool of idle connections for the next request to the host.
+
+    Attributes
+    ----------
+    url : str
+        URL requested
+    host : str
+        host (and port) of the URL
+    code : int
+        HTTP status code
+    msg : str
+        HTTP status message
+    headers : Headers
+        response headers
+    waited : float
+        seconds spent waiting for a free connection to the host
+    first_byte : float
+        seconds from sending the request to receiving the status line
+    elapsed : float
+        seconds from sending the request to closing the response, once
+        closed
+    received : int
+        bytes of the body read
+    """
+
+    def __init__(self, connection, url, host, waited, started, on_close=None):
+        self.connection = connection
+        self.url = url
+        self.host = host
+        self.waited = waited
+        self.started = started
+        self.on_close = on_close
+        self.code = connection.getResponseCode()
+        self.first_byte = time.time() - started
+        self.msg = connection.getResponseMessage()
+        self.headers = Headers()
+        i = 1
+        while connection.getHeaderFieldKey(i) is not None:
+            self.headers[connection.getHeaderFieldKey(i)] = connection.getHeaderField(i)
+            i += 1
+        if self.code >= 400:
+            self.stream = connection.getErrorStream()
+        else:
+            self.stream = connection.getInputStream()
+        self.elapsed = None
+        self.received = 0
+        self.closed = False
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.code} {self.url})".format(self=self)
+
+    def read(self, size=-1):
+        """read up to size bytes of the body, or all of it"""
+        if self.stream is None:
+            return ""
+        if size is None or size < 0:
+            parts = []
+            while True:
+                chunk = self.read(65536)
+                if not chunk:
+                    return "".join(parts)
+                parts.append(chunk)
+        buf = jarray.zeros(size, "b")
+        try:
+            count = self.stream.read(buf, 0, size)
+        except IOException as e:
+            raise IOError(str(e))
+        if count <= 0:
+            return ""
+        self.received += count
+        return buf[:count].tostring()
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        """close the body stream, calling on_close the first time"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.stream is not None:
+                self.stream.close()
+        finally:
+            self.elapsed = time.time() - self.started
+            if self.on_close:
+                self.on_close(self)
+
+
+class HttpClient:
+    """Pooled HTTP client on the JVM's HttpURLConnection
+
+    Parameters
+    ----------
+    connect_timeout : float, optional
+        seconds to wait for a connection, by default CONNECT_TIMEOUT
+    read_timeout : float, optional
+        seconds to wait for data from the connection, by default
+        READ_TIMEOUT
+    max_per_host : int, optional
+        most requests open to a host at once, further requests waiting for
+        one to be closed, by default MAX_PER_HOST
+    proxy : str, optional
+        "host:port" of an HTTP proxy, by default None for the JVM's proxy
+        settings
+    on_complete : callable, optional
+        called with the ConnectionResponse of each request once it is
+        closed, e.g. to report its timing, by default None
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_per_host=MAX_PER_HOST, proxy=None, on_complete=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_per_host = max_per_host
+        self.proxy = None
+        if proxy:
+            proxy_host, proxy_port = proxy.rsplit(":", 1)
+            self.proxy = Proxy(Proxy.Type.HTTP, InetSocketAddress(proxy_host, int(proxy_port)))
+        self.on_complete = on_complete
+        self.lock = threading.Lock()
+        self.slots = {}
+        if System.getProperty("http.maxConnections") is None:
+            System.setProperty("http.maxConnections", str(max_per_host))
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.max_per_host} per host)".format(self=self)
+
+    def _slot(self, host):
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.slots[host]
+
+    def open(self, request):
+        """make a request, like urllib2.urlopen
+
+        Parameters
+        ----------
+        request : str or urllib2.Request
+            URL or request to open
+
+        Returns
+        -------
+        ConnectionResponse
+            the response, which must be closed to free its connection
+
+        Raises
+        ------
+        urllib2.HTTPError
+            for a status code other than 2xx, holding the body of the
+            response
+        urllib2.URLError
+            if the host can't be reached or doesn't answer in time
+        """
+        if isinstance(request, basestring):
+            request = urllib2.Request(request)
+        url = request.get_full_url()
+        host = urlparse.urlparse(url)[1]
+        slot = self._slot(host)
+        queued = time.time()
+        slot.acquire()
+        waited = time.time() - queued
+
+        def on_close(response):
+            slot.release()
+            if self.on_complete:
+                self.on_complete(response)
+
+        try:
+            if self.proxy:
+                connection = URL(url).openConnection(self.proxy)
+            else:
+                connection = URL(url).openConnection()
+            connection.setConnectTimeout(int(self.connect_timeout * 1000))
+            connection.setReadTimeout(int(self.read_timeout * 1000))
+            connection.setRequestMethod(request.get_method())
+            for name, value in request.header_items():
+                connection.setRequestProperty(name, value)
+            started = time.time()
+            data = request.get_data()
+            if data is not None:
+                connection.setDoOutput(True)
+                stream = connection.getOutputStream()
+                try:
+                    stream.write(data)
+                finally:
+                    stream.close()
+            response = ConnectionResponse(connection, url, host, waited, started, on_close)
+        except IOException as e:
+            slot.release()
+            raise urllib2.URLError(str(e))
+        except:
+            slot.release()
+            raise
+        if not 200 <= response.code < 300:
+            try:
+                body = response.read()
+            finally:
+                response.close()
+            raise urllib2.HTTPError(url, response.code, response.msg, response.headers, StringIO.StringIO(body))
+        return response
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+    """the HttpClient shared by the fetchers in this JVM
+
+    Returns
+    -------
+    HttpClient
+        client with the default timeouts and per-host limit
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpClient()
+        return _shared
+
+
+class DecodedResponse:
+    """File-like response whose body is decompressed as it is read
+
+    Bodies with a Content-Encoding of gzip (or x-gzip) are decompressed a
+    chunk at a time; other bodies are passed through.  Either way the bytes
+    read from the connection and the bytes returned are counted.
+
+    Parameters
+    ----------
+    response : file
+        ConnectionResponse, urllib2 response or HTTPError to read the body
+        from
+    on_close : callable, optional
+        called with this object when it is closed, e.g. to report the byte
+        counts, by default None
+    chunk_size : int, optional
+        bytes to read from the connection at a time, by default 65536
+    """
+
+    def __init__(self, response, on_close=None, chunk_size=65536):
+        self.response = response
+        self.on_close = on_close
+        self.chunk_size = chunk_size
+        encoding = (header(response, "Content-Encoding") or "").strip().lower()
+        self.compressed = encoding in ("gzip", "x-gzip")
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if self.compressed else None
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.closed = False
+        self.received = 0
+        self.decoded = 0
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.received}/{self.decoded} bytes)".format(self=self)
+
+    def _fill(self):
+        """read and decompress one chunk onto the unread part of the buffer,
+        returning False at the end of the body"""
+        if self.eof:
+            return False
+        chunk = self.response.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            if not self.decompressor:
+                return False
+            chunk = self.decompressor.flush()
+        else:
+            self.received += len(chunk)
+            if self.decompressor:
+                chunk = self.decompressor.decompress(chunk)
+        self.decoded += len(chunk)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def read(self, size=-1):
+        """read up to size decompressed bytes, or all of them"""
+        if size is None or size < 0:
+            parts = [self.buffer[self.pos:]]
+            self.buffer, self.pos = "", 0
+            while self._fill():
+                parts.append(self.buffer)
+                self.buffer = ""
+            return "".join(parts)
+        while len(self.buffer) - self.pos < size and self._fill():
+            pass
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def readline(self):
+        """read one decompressed line, including its newline"""
+        start = self.pos
+        while True:
+            end = self.buffer.find("\n", start) + 1
+            if end:
+                break
+            start = len(self.buffer) - self.pos
+            if not self._fill():
+                end = len(self.buffer)
+                break
+        line = self.buffer[self.pos:end]
+        self.pos = end
+        return line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def info(self):
+        return self.response.info()
+
+    def getcode(self):
+        return self.response.getcode() if hasattr(self.response, "getcode") else None
+
+    def geturl(self):
+        return self.response.geturl() if hasattr(self.response, "geturl") else None
+
+    def close(self):
+        """close the connection, calling on_close the first time"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.response, "close"):
+                self.response.close()
+        finally:
+            if self.on_close:
+                self.on_close(self)
@@ -0,0 +1,247 @@
+"""Retrying HTTP requests with exponential backoff and a circuit breaker
+
+A RetryPolicy says how often and how long to wait between attempts, with
+the waits growing exponentially and randomized ("full jitter") so that
+concurrent workers don't retry in lockstep, and a budget that caps the
+retries of a whole run.  A CircuitBreaker watches the outcomes for each
+host and, once a host has failed enough times in a row, rejects requests
+to it immediately until a trial request succeeds.  open_url combines the
+two around urllib2.urlopen.
+"""
+
+import random
+import threading
+import time
+import urllib2
+import urlparse
+
+RETRY_CODES = (408, 429, 500, 502, 503, 504)
+COUNTS = ("requests", "succeeded", "failed", "retries", "rejected")
+
+
+class CircuitOpenError(IOError):
+    """a request was rejected because the circuit for its host is open"""
+
+
+class RetryPolicy:
+    """Attempts, backoff and retry budget
+
+    Parameters
+    ----------
+    retries : int, optional
+        retries after the first attempt of a request, by default 5
+    base_delay : float, optional
+        seconds to wait before the first retry, on average half of this
+        with jitter, by default 0.5
+    max_delay : float, optional
+        maximum seconds to wait before a retry, by default 30
+    budget : int, optional
+        retries allowed for all requests together, by default None for no
+        limit
+    retry_codes : sequence of int, optional
+        HTTP status codes that are retried, by default RETRY_CODES
+    """
+
+    def __init__(self, retries=5, base_delay=0.5, max_delay=30.0, budget=None, retry_codes=RETRY_CODES):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retry_codes = retry_codes
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.retries}, budget={self.budget})".format(self=self)
+
+    def delay(self, attempt):
+        """seconds to wait before retry number attempt (1 for the first)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def take(self):
+        """use one retry from the budget
+
+        Returns
+        -------
+        bool
+            False if the budget is spent
+        """
+        with self.lock:
+            if self.budget is None:
+                return True
+            if self.budget <= 0:
+                return False
+            self.budget -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker and outcome counts
+
+    A host's circuit opens after threshold consecutive failures.  While open,
+    requests to the host are rejected until reset_timeout seconds have
+    passed, after which one trial request is let through; its success closes
+    the circuit and its failure opens it again.
+
+    Parameters
+    ----------
+    threshold : int, optional
+        consecutive failures that open the circuit, by default 5
+    reset_timeout : float, optional
+        seconds the circuit stays open before a trial request, by default 60
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.threshold}, {self.reset_timeout})".format(self=self)
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {
+                "requests": 0,
+                "succeeded": 0,
+                "failed": 0,
+                "retries": 0,
+                "rejected": 0,
+                "consecutive": 0,
+                "opened": None,
+                "trial": False,
+            }
+        return self.hosts[host]
+
+    def allow(self, host):
+        """whether a request to host may be made now, counting it if so"""
+        with self.lock:
+            state = self._host(host)
+            if state["opened"] is not None:
+                if state["trial"] or time.time() - state["opened"] < self.reset_timeout:
+                    state["rejected"] += 1
+                    return False
+                state["trial"] = True
+            state["requests"] += 1
+            return True
+
+    def success(self, host):
+        """record a response from host, closing its circuit"""
+        with self.lock:
+            state = self._host(host)
+            state["succeeded"] += 1
+            state["consecutive"] = 0
+            state["opened"] = None
+            state["trial"] = False
+
+    def failure(self, host):
+        """record a failed request to host, opening its circuit if the
+        threshold is reached or a trial request failed"""
+        with self.lock:
+            state = self._host(host)
+            state["failed"] += 1
+            state["consecutive"] += 1
+            if state["trial"] or state["consecutive"] >= self.threshold:
+                state["opened"] = time.time()
+            state["trial"] = False
+
+    def retried(self, host):
+        """record a retry of a request to host"""
+        with self.lock:
+            self._host(host)["retries"] += 1
+
+    def is_open(self, host):
+        """whether the circuit for host is open"""
+        with self.lock:
+            return host in self.hosts and self.hosts[host]["opened"] is not None
+
+    def reset_counts(self):
+        """zero the outcome counts of every host, e.g. at the start of a run,
+        keeping the state of its circuit"""
+        with self.lock:
+            for state in self.hosts.values():
+                for count in COUNTS:
+                    state[count] = 0
+
+    def report(self):
+        """one line of outcomes for each host with requests since the counts
+        were reset, sorted by host"""
+        with self.lock:
+            lines = []
+            for host in sorted(self.hosts.keys()):
+                state = self.hosts[host]
+                if not state["requests"] and not state["rejected"]:
+                    continue
+                lines.append(
+                    "{}: {} requests, {} succeeded, {} failed, {} retries, {} rejected{}".format(
+                        host,
+                        state["requests"],
+                        state["succeeded"],
+                        state["failed"],
+                        state["retries"],
+                        state["rejected"],
+                        " (circuit open)" if state["opened"] is not None else "",
+                    )
+                )
+            return lines
+
+
+def open_url(request, policy, breaker, on_retry=None, opener=urllib2.urlopen):
+    """open a URL, retrying connection errors and retryable status codes
+
+    HTTP errors with other status codes (e.g., 304 or 404) are responses
+    from the host and are raised without retrying.
+
+    Parameters
+    ----------
+    request : str or urllib2.Request
+        URL or request to open
+    policy : RetryPolicy
+        attempts, backoff and budget
+    breaker : CircuitBreaker
+        breaker recording the outcomes for the host
+    on_retry : callable, optional
+        called with the retry number, the error and the seconds to wait
+        before each retry, by default None
+    opener : callable, optional
+        function to open the request, by default urllib2.urlopen
+
+    Returns
+    -------
+    file
+        the response
+
+    Raises
+    ------
+    CircuitOpenError
+        if the circuit for the host is open
+    urllib2.HTTPError, urllib2.URLError, IOError
+        the last error if the retries or the budget are spent
+    """
+    url = request if isinstance(request, basestring) else request.get_full_url()
+    host = urlparse.urlparse(url)[1]
+    attempt = 0
+    while True:
+        if not breaker.allow(host):
+            raise CircuitOpenError("Circuit open for {}".format(host))
+        try:
+            response = opener(request)
+        except urllib2.HTTPError as e:
+            if e.code not in policy.retry_codes:
+                breaker.success(host)
+                raise
+            error = e
+        except Exception as e:
+            error = e
+        else:
+            breaker.success(host)
+            return response
+        breaker.failure(host)
+        attempt += 1
+        if attempt > policy.retries or breaker.is_open(host) or not policy.take():
+            raise error
+        breaker.retried(host)
+        delay = policy.delay(attempt)
+        if on_retry:
+            on_retry(attempt, error, delay)
+        time.sleep(delay)
@@ -0,0 +1,131 @@
+"""SHEF record encoding and output
+"""
+
+import os
+import sys
+
+MAX_LINE_LENGTH = 80
+
+
+def encode(parts, max_len=MAX_LINE_LENGTH):
+    """assemble a SHEF .A or .E record from its parts, splitting it into
+    numbered continuation lines in one pass
+
+    Each part ends with the "/" that separates it from the next, e.g.
+    [".E ABCD1 20210901 Z DH0000 /", " DUE /", " HG /", " DIH+01 /",
+    " 4.5 /", " M /"].  The parts are joined once and each line is ended at
+    the last "/" that keeps it within max_len, found by searching from the
+    end of the previous line.  Continuation lines begin with the record type
+    and the continuation number, e.g. ".E1 ".
+
+    Parameters
+    ----------
+    parts : sequence of str
+        parts of the record, the first beginning with ".A" or ".E"
+    max_len : int, optional
+        maximum length of a line (unless a single part is longer), by
+        default 80
+
+    Returns
+    -------
+    str
+        the lines of the record, each ending with a newline
+    """
+    record = "".join(parts)
+    record_type = record[1]
+    lines = []
+    prefix = ""
+    start = 0
+    count = 0
+    while len(prefix) + len(record) - start > max_len:
+        end = record.rfind("/", start, start + max_len - len(prefix)) + 1
+        if end <= start:
+            end = record.find("/", start) + 1 or len(record)
+        lines.append(prefix + record[start:end])
+        start = end
+        count += 1
+        prefix = ".%s%d " % (record_type, count % 10)
+    lines.append(prefix + record[start:])
+    lines.append("")
+    return "\n".join(lines)
+
+
+class ShefWriter:
+    """Buffered output of SHEF records to a stream or a rotating file
+
+    Parameters
+    ----------
+    path : str, optional
+        file to write, by default None to write to the stream
+    stream : file, optional
+        stream to write if no path is given, by default sys.stdout
+    flush_every : int, optional
+        number of records between flushes, by default 100 (0 to flush only
+        when closed)
+    max_bytes : int, optional
+        size at which the file is rotated to path.1, path.2, ..., by default
+        0 to never rotate
+    backups : int, optional
+        number of rotated files to keep, by default 5
+    """
+
+    def __init__(self, path=None, stream=None, flush_every=100, max_bytes=0, backups=5):
+        self.path = path
+        self.flush_every = flush_every
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = 0
+        self.pending = 0
+        if path:
+            self.stream = open(path, "a")
+            self.size = os.path.getsize(path)
+        else:
+            self.stream = stream or sys.stdout
+            self.size = 0
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.path})".format(self=self)
+
+    def write(self, text):
+        """write one encoded record"""
+        if self.path and self.max_bytes and self.size and self.size + len(text) > self.max_bytes:
+            self.rotate()
+        self.stream.write(text)
+        self.size += len(text)
+        self.records += 1
+        self.pending += 1
+        if self.flush_every and self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """flush the buffered records"""
+        self.stream.flush()
+        self.pending = 0
+
+    def rotate(self):
+        """move the file to path.1, shifting older files up to the number of
+        backups, and start a new file"""
+        self.stream.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = "{}.{}".format(self.path, i)
+            if os.path.exists(older):
+                newer = "{}.{}".format(self.path, i + 1)
+                if os.path.exists(newer):
+                    os.remove(newer)
+                os.rename(older, newer)
+        if self.backups:
+            first = "{}.1".format(self.path)
+            if os.path.exists(first):
+                os.remove(first)
+            os.rename(self.path, first)
+        else:
+            os.remove(self.path)
+        self.stream = open(self.path, "w")
+        self.size = 0
+
+    def close(self):
+        """flush the records, closing the file if there is one"""
+        self.flush()
+        if self.path:
+            self.stream.close()
+
@@ -0,0 +1,159 @@
+"""Time series utilities shared by the data retrieval modules
+"""
+
+SMALLEST_DOMINANT = "smallest-dominant"
+SMALLEST = "smallest"
+MODE = "mode"
+GCD = "gcd"
+
+
+def interval_histogram(times):
+    """count the occurrences of each difference between successive times
+
+    Parameters
+    ----------
+    times : sequence of int
+        times, in any integer unit
+
+    Returns
+    -------
+    dict
+        number of occurrences of each nonzero (absolute) difference
+    """
+    counts = {}
+    for i in range(1, len(times)):
+        delta = abs(times[i] - times[i - 1])
+        if delta:
+            counts[delta] = counts.get(delta, 0) + 1
+    return counts
+
+
+def _smallest_dominant(counts, dominance=3):
+    """the smallest interval if it occurs more than dominance times as often
+    as any other interval (> 75% of intervals by default), otherwise None"""
+    intervals = sorted(counts)
+    others = [counts[i] for i in intervals[1:]]
+    if counts[intervals[0]] > dominance * max(others):
+        return intervals[0]
+    return None
+
+
+def _smallest(counts, dominance=None):
+    """the smallest interval"""
+    return min(counts)
+
+
+def _mode(counts, dominance=None):
+    """the most common interval, the smallest one on ties"""
+    return sorted(counts, key=lambda i: (-counts[i], i))[0]
+
+
+def _gcd(counts, dominance=None):
+    """the greatest common divisor of the intervals"""
+    result = 0
+    for i in counts:
+        while i:
+            result, i = i, result % i
+    return result
+
+
+POLICIES = {
+    SMALLEST_DOMINANT: _smallest_dominant,
+    SMALLEST: _smallest,
+    MODE: _mode,
+    GCD: _gcd,
+}
+
+
+def detect_interval(times, policy=SMALLEST_DOMINANT, dominance=3):
+    """determine the regular interval of a series of times
+
+    Differences of zero (duplicate times) are ignored.  If all of the
+    differences are equal that difference is returned without building a
+    histogram, otherwise the policy chooses the interval from it.
+
+    Parameters
+    ----------
+    times : sequence of int
+        times, in any integer unit
+    policy : str or callable, optional
+        one of the POLICIES names, or a function taking the histogram from
+        interval_histogram and the dominance and returning the interval or
+        None, by default SMALLEST_DOMINANT
+    dominance : int, optional
+        how many times more often the smallest interval must occur than any
+        other for SMALLEST_DOMINANT, by default 3
+
+    Returns
+    -------
+    int
+        interval in the unit of the times, or None if there are fewer than
+        two distinct times or the policy finds no regular interval
+    """
+    if not callable(policy):
+        policy = POLICIES[policy]
+    first = None
+    for i in range(1, len(times)):
+        delta = abs(times[i] - times[i - 1])
+        if not delta:
+            continue
+        if first is None:
+            first = delta
+        elif delta != first:
+            break
+    else:
+        return first
+    return policy(interval_histogram(times), dominance)
+
+
+def regularize(times, values, interval, missing=None):
+    """fill the gaps in a regular interval time series in one pass
+
+    When every time is on the interval grid starting at the first time, the
+    values are placed into a preallocated grid indexed by
+    (time - start) / interval.  Otherwise the missing times are generated
+    from each preceding time, the way values were previously inserted.
+
+    Parameters
+    ----------
+    times : sequence of int
+        ascending times, in any integer unit
+    values : sequence
+        values for each time
+    interval : int
+        interval in the same unit as the times
+    missing : object, optional
+        value used for the missing times, by default None
+
+    Returns
+    -------
+    tuple[list, list]
+        times and values with the missing times filled in
+    """
+    count = len(times)
+    if count < 2 or interval <= 0:
+        return list(times), list(values)
+    start = times[0]
+    for t in times:
+        if (t - start) % interval:
+            break
+    else:
+        size = (times[-1] - start) // interval + 1
+        grid_times = [start + i * interval for i in range(size)]
+        grid_values = [missing] * size
+        for i in range(count):
+            grid_values[(times[i] - start) // interval] = values[i]
+        return grid_times, grid_values
+
+    filled_times = [start]
+    filled_values = [values[0]]
+    for i in range(1, count):
+        t = times[i - 1] + interval
+        while t < times[i]:
+            filled_times.append(t)
+            filled_values.append(missing)
+            t += interval
+        filled_times.append(times[i])
+        filled_values.append(values[i])
+    return filled_times, filled_values
+
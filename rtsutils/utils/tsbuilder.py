@@ -0,0 +1,127 @@
+"""TimeSeriesContainer construction on primitive arrays
+
+Assigning Python lists to the times, values and quality of a
+TimeSeriesContainer makes Jython box every element into the list and then
+convert the list to a Java array.  A ContainerBuilder instead stores the
+elements straight into int[] and double[] buffers, growing them
+geometrically, and gives the buffers to the container as they are when they
+are full (as they are if the capacity was the number of elements), copying
+them only to trim them otherwise.
+"""
+
+import jarray
+from java.util import Arrays
+
+DEFAULT_CAPACITY = 64
+
+
+class ContainerBuilder:
+    """Times, values and qualities of a time series in primitive arrays
+
+    Parameters
+    ----------
+    capacity : int, optional
+        number of elements to allocate for, by default DEFAULT_CAPACITY
+    quality : bool, optional
+        whether to keep qualities, by default False
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, quality=False):
+        capacity = max(capacity, 1)
+        self.times = jarray.zeros(capacity, "i")
+        self.values = jarray.zeros(capacity, "d")
+        self.quality = jarray.zeros(capacity, "i") if quality else None
+        self.size = 0
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.size}/{capacity})".format(self=self, capacity=len(self.times))
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, needed):
+        """grow the buffers to hold needed elements, at least doubling them"""
+        capacity = max(needed, 2 * len(self.times))
+        self.times = Arrays.copyOf(self.times, capacity)
+        self.values = Arrays.copyOf(self.values, capacity)
+        if self.quality is not None:
+            self.quality = Arrays.copyOf(self.quality, capacity)
+
+    def append(self, time, value, quality=0):
+        """add an element
+
+        Parameters
+        ----------
+        time : int
+            HecTime value
+        value : float
+            value
+        quality : int, optional
+            quality, ignored if qualities aren't kept, by default 0
+        """
+        i = self.size
+        if i == len(self.times):
+            self._grow(i + 1)
+        self.times[i] = time
+        self.values[i] = value
+        if self.quality is not None:
+            self.quality[i] = quality
+        self.size = i + 1
+
+    def extend(self, times, values, quality=None):
+        """add elements
+
+        Parameters
+        ----------
+        times : sequence of int
+            HecTime values
+        values : sequence of float
+            values, as many as times
+        quality : sequence of int, optional
+            qualities, ignored if qualities aren't kept, by default None for
+            all 0
+        """
+        start = self.size
+        count = len(times)
+        if start + count > len(self.times):
+            self._grow(start + count)
+        buf_times, buf_values = self.times, self.values
+        for j in range(count):
+            buf_times[start + j] = times[j]
+            buf_values[start + j] = values[j]
+        if self.quality is not None and quality is not None:
+            buf_quality = self.quality
+            for j in range(count):
+                buf_quality[start + j] = quality[j]
+        self.size = start + count
+
+    def _trimmed(self, buf):
+        if buf is None or len(buf) == self.size:
+            return buf
+        return Arrays.copyOf(buf, self.size)
+
+    def fill(self, tsc):
+        """give the elements to a container
+
+        The builder must not be changed afterwards, since the container may
+        hold its buffers.
+
+        Parameters
+        ----------
+        tsc : hec.io.TimeSeriesContainer
+            container to set the times, values, quality, numberValues,
+            startTime and endTime of
+
+        Returns
+        -------
+        hec.io.TimeSeriesContainer
+            the container
+        """
+        tsc.times = self._trimmed(self.times)
+        tsc.values = self._trimmed(self.values)
+        tsc.quality = self._trimmed(self.quality)
+        tsc.numberValues = self.size
+        if self.size:
+            tsc.startTime = self.times[0]
+            tsc.endTime = self.times[self.size - 1]
+        return tsc
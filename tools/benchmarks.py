@@ -0,0 +1,254 @@
+"""Benchmarks of rtsutils against the implementations they replaced
+
+Each benchmark first checks that the current implementation gives the same
+results as the legacy one kept here for reference, then times both.  Run
+all of them, or only those named, with Jython and the HEC libraries on the
+class path:
+
+    jython tools/benchmarks.py [name ...]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def best(func, repeat=3):
+    """the shortest of repeat timings of func and its result
+
+    Parameters
+    ----------
+    func : callable
+        function to time, called without arguments
+    repeat : int, optional
+        number of timings to take the best of, by default 3
+
+    Returns
+    -------
+    tuple[float, object]
+        seconds and the result of the last call
+    """
+    elapsed = []
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed.append(time.time() - start)
+    return min(elapsed), result
+
+
+def report(text, old_time, new_time):
+    """print a benchmark's outcome with the speedup"""
+    print("{}: legacy {:.4f}s, current {:.4f}s ({:.1f}x)".format(text, old_time, new_time, old_time / max(new_time, 1e-9)))
+
+
+# --------------------------------------------------------------------------
+# getusgs.parseCsv
+# --------------------------------------------------------------------------
+def legacy_parse_csv(line):
+    """getusgs.parseCsv as it was, marking the commas outside quotes one
+    character at a time"""
+    quote_char = None
+    chars = list(zip(*line)[0])
+    for i in range(len(line)):
+        if chars[i] in "'\"":
+            if quote_char:
+                if chars[i] == quote_char:
+                    quote_char = None
+            else:
+                quote_char = chars[i]
+        elif chars[i] == "," and not quote_char:
+            chars[i] = "\0"
+    fields = "".join(chars).replace('"', "").split("\0")
+    for i in range(len(fields)):
+        if len(fields[i]) > 0 and fields[i][0] == "[" and fields[i][-1] == "]":
+            fields[i] = fields[i][1:-1]
+    return fields
+
+
+def parse_csv(line_count=200000, row_count=5000, seed=1):
+    """check that parseCsv splits lines exactly as the legacy parser did, on
+    line_count random lines of commas, quotes, brackets and text and on the
+    rows of a locations file of row_count locations, and time both on the
+    locations file"""
+    from rtsutils.usgs import getusgs
+
+    rand = random.Random(seed)
+    alphabet = "ab1 ,,\"\"''[]"
+    lines = ["".join([rand.choice(alphabet) for _ in range(rand.randint(1, 30))]) for _ in range(line_count)]
+    rows = ['[%08d],LOC%d,,LOC%d-Creek,dcp-rev,147721=Sub,"Stage,Flow,00010"' % (i, i, i) for i in range(row_count)]
+    mismatches = [line for line in lines + rows if getusgs.parseCsv(line) != legacy_parse_csv(line)]
+    for line in mismatches[:20]:
+        print("\t%r" % line)
+    assert not mismatches, "%d lines parsed differently" % len(mismatches)
+    old_time, _ = best(lambda: [legacy_parse_csv(row) for row in rows])
+    new_time, _ = best(lambda: [getusgs.parseCsv(row) for row in rows])
+    report("parseCsv, {} lines identical, {} rows".format(len(lines) + len(rows), len(rows)), old_time, new_time)
+
+
+# --------------------------------------------------------------------------
+# timeseries.regularize
+# --------------------------------------------------------------------------
+def legacy_insert_fill(times, values, interval, missing=None):
+    """fill gaps by inserting into lists, the approach regularize replaced"""
+    records = list(zip(times, values))
+    for j in range(1, len(records))[::-1]:
+        for k in range(records[j - 1][0] + interval, records[j][0], interval)[::-1]:
+            records.insert(j, (k, missing))
+    return [r[0] for r in records], [r[1] for r in records]
+
+
+def regularize(days=30, interval=5, gaps=((7, 14),)):
+    """compare regularize with insertion on a synthetic series with an
+    outage for each (first day, last day) of gaps and a value missing here
+    and there"""
+    from rtsutils.utils import timeseries
+
+    per_day = 1440 // interval
+    times, values = [], []
+    for i in range(days * per_day):
+        day = i // per_day
+        if [g for g in gaps if g[0] <= day < g[1]]:
+            continue
+        if i % 97 == 0:
+            continue
+        times.append(i * interval)
+        values.append(str(i))
+    old_time, old_result = best(lambda: legacy_insert_fill(times, values, interval, ""))
+    new_time, new_result = best(lambda: timeseries.regularize(times, values, interval, ""))
+    assert old_result == new_result, "regularize filled differently"
+    report("regularize, {} values, {} filled".format(len(times), len(new_result[0]) - len(times)), old_time, new_time)
+
+
+# --------------------------------------------------------------------------
+# shef.encode and shef.ShefWriter
+# --------------------------------------------------------------------------
+def legacy_shef_record(record, stream, max_len=80):
+    """split and write a SHEF record the way getusgs did before encode"""
+    record_type = record[1]
+    i = 0
+    while len(record) > max_len:
+        i += 1
+        last = record[:max_len].rfind("/")
+        last += 1
+        stream.write("%s\n" % record[:last])
+        record = ".%s%d %s" % (record_type, i % 10, record[last:])
+    stream.write("%s\n" % record)
+    stream.flush()
+
+
+class Capture:
+    """stream keeping the text written to it"""
+
+    def __init__(self):
+        self.text = []
+
+    def write(self, text):
+        self.text.append(text)
+
+    def flush(self):
+        pass
+
+
+def shef(stations=1000, values=96):
+    """compare encode and ShefWriter with string concatenation and a flush
+    per record on a run of stations regular 15-minute series of values
+    each"""
+    from rtsutils.utils.shef import ShefWriter, encode
+
+    head = [".E ST%04d 20210901 Z DH0000 /", " DUE /", " HG /", " DIN+15 /"]
+    series = [
+        ["%.2f" % (4 + (i * j % 97) / 100.0) if (i + j) % 31 else None for j in range(values)]
+        for i in range(stations)
+    ]
+
+    def parts(i):
+        return [head[0] % i] + head[1:] + [" M /" if v is None else " %s /" % v for v in series[i]]
+
+    for i in range(min(stations, 10)):
+        captured = Capture()
+        legacy_shef_record("".join(parts(i)), captured)
+        assert "".join(captured.text) == encode(parts(i)), "encode split station %d differently" % i
+
+    null = open(os.devnull, "w")
+
+    def legacy():
+        for i in range(stations):
+            record = head[0] % i + "".join(head[1:])
+            for value in series[i]:
+                if value is None:
+                    record += " M /"
+                else:
+                    record += " %s /" % value
+            legacy_shef_record(record, null)
+
+    def current():
+        writer = ShefWriter(stream=null)
+        for i in range(stations):
+            writer.write(encode(parts(i)))
+        writer.close()
+
+    try:
+        old_time, _ = best(legacy)
+        new_time, _ = best(current)
+    finally:
+        null.close()
+    report("SHEF, {} stations x {} values".format(stations, values), old_time, new_time)
+
+
+# --------------------------------------------------------------------------
+# rdbvalues.ValueDecoder
+# --------------------------------------------------------------------------
+def legacy_decode(tokens, factor, missing):
+    """convert with float() inside try/except, the way getusgs did"""
+    values = []
+    for token in tokens:
+        try:
+            values.append(float(token) * factor)
+        except:
+            values.append(missing)
+    return values
+
+
+def rdb_values(days=365, interval=15, ice=(0, 90)):
+    """compare the decoder with try/except conversion on a synthetic year of
+    values from a site whose values are flagged "Ice" from the first to the
+    last day of ice"""
+    from rtsutils.usgs import rdbvalues
+
+    per_day = 1440 // interval
+    tokens, codes = [], []
+    for i in range(days * per_day):
+        if ice[0] <= i // per_day < ice[1]:
+            tokens.append("Ice")
+            codes.append("P")
+        elif i % 101 == 0:
+            tokens.append("Eqp")
+            codes.append("P")
+        else:
+            tokens.append("%.2f" % (10 + (i % 500) / 100.0))
+            codes.append("A:e" if i % 37 == 0 else "A")
+    old_time, old_result = best(lambda: legacy_decode(tokens, 0.3048, -1.0))
+    new_time, new_result = best(
+        lambda: rdbvalues.scaled(rdbvalues.ValueDecoder().decode(tokens, codes)[0], 0.3048, -1.0)
+    )
+    assert old_result == new_result, "the decoder converted differently"
+    report("rdb values, {} values, {} flagged".format(len(tokens), old_result.count(-1.0)), old_time, new_time)
+
+
+BENCHMARKS = [
+    ("parse_csv", parse_csv),
+    ("regularize", regularize),
+    ("shef", shef),
+    ("rdb_values", rdb_values),
+]
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or [name for name, func in BENCHMARKS]
+    for name, func in BENCHMARKS:
+        if name in names:
+            func()
@@ -0,0 +1,227 @@
+"""Stress test of getusgs engines running concurrently in one JVM
+
+Several USGSDataRetrieve instances may run at once in a CAVI session, each
+with its own GetUsgsEngine.  This runs several engines at once, each with
+its own stations, DSS file, worker count and batch size and all of them
+sharing the not found and watermarks files, against stubbed USGS responses,
+and checks that they don't affect each other: each engine must succeed for
+exactly its own stations, its DSS file must hold exactly its own time
+series with only its own sites' values, and the watermark of every time
+series must be kept.
+
+Run it with Jython and the HEC libraries on the class path:
+
+    jython tools/stress_engines.py
+"""
+
+import os
+import re
+import shutil
+import StringIO
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hec.heclib.dss import HecDss
+
+from rtsutils.usgs import getusgs
+from rtsutils.usgs import notfound
+from rtsutils.usgs import watermarks
+from rtsutils.utils import hectime
+
+
+class StubResponse:
+    """A canned USGS response"""
+
+    def __init__(self, url, body):
+        self.url = url
+        self.body = StringIO.StringIO(body)
+
+    def read(self, size=-1):
+        return self.body.read(size)
+
+    def info(self):
+        return {}
+
+    def getcode(self):
+        return 200
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        self.body.close()
+
+
+class StubClient:
+    """Stands in for the HTTP client of the engines, answering each request
+    with a day of hourly flows for each site requested
+
+    Each value is the site number plus the hour / 100, so every value
+    stored shows which site it came from.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def open(self, request):
+        url = request.get_full_url()
+        lines = []
+        for site in re.search(r"site=([^&]+)", url).group(1).split(","):
+            lines.append("# Data provided for site %s" % site)
+            lines.append("agency_cd\tsite_no\tdatetime\ttz_cd\t1_00060\t1_00060_cd")
+            lines.append("5s\t15s\t20d\t6s\t14n\t10s")
+            for hour in range(24):
+                value = getusgs.fmtFloat(int(site) + hour / 100.0)
+                lines.append("USGS\t%s\t2021-09-01 %02d:00\tUTC\t%s\tP" % (site, hour, value))
+        with self.lock:
+            self.requests += 1
+        return StubResponse(url, "\n".join(lines) + "\n")
+
+
+def make_engines(tmpdir, client, engine_count, station_count):
+    """engines, each with its own stations, and their stations"""
+    engines = []
+    for e in range(engine_count):
+        sites = ["9%02d%05d" % (e, s) for s in range(station_count)]
+        locations_file = os.path.join(tmpdir, "Locations%d.csv" % e)
+        with open(locations_file, "w") as f:
+            f.write("[USGS_LOC],SHEF_LOC,DSS_A-PART,DSS_B-PART,DSS_F-PART,PARAMETERS\n")
+            for site in sites:
+                f.write("[%s],,STRESS,S%s,E%d,Flow\n" % (site, site, e))
+        engine = getusgs.GetUsgsEngine(
+            workdir=tmpdir,
+            locationsfile=locations_file,
+            parametersfile=os.path.join(getusgs.programDir, "parameters.csv"),
+            aliasfile=os.path.join(getusgs.programDir, "parameter_aliases.csv"),
+            dssfile="stress%d.dss" % e,
+            begindate="01Sep2021, 00:00",
+            enddate="02Sep2021, 00:00",
+            timezone="UTC",
+            workercount=str(1 + e % 3),
+            batchsize=str(1 + e % 4),
+            incremental=True,
+            output="NONE",
+        )
+        # keep the shared files in the temporary directory and answer the
+        # requests with the stub
+        engine.notfoundDb = notfound.NotFoundStore(os.path.join(tmpdir, "getUsgs.notfound"))
+        engine.watermarkDb = watermarks.WatermarkStore(os.path.join(tmpdir, "getUsgs.watermarks"))
+        engine.httpClient = client
+        engines.append((engine, sites))
+    return engines
+
+
+def run_all(engines, run_count):
+    """run the engines run_count times over, all at once each time,
+    returning the errors"""
+    errors = []
+
+    def run_engine(engine, outcomes, i):
+        try:
+            outcomes[i] = engine.run()
+        except Exception as e:
+            outcomes[i] = e
+
+    for run in range(run_count):
+        outcomes = [None] * len(engines)
+        threads = [
+            threading.Thread(target=run_engine, args=(engine, outcomes, i))
+            for i, (engine, sites) in enumerate(engines)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i, outcome in enumerate(outcomes):
+            if isinstance(outcome, Exception):
+                errors.append("run %d, engine %d: %s" % (run + 1, i, outcome))
+            elif sorted(outcome["successful"]) != engines[i][1]:
+                errors.append("run %d, engine %d: succeeded for %s" % (run + 1, i, sorted(outcome["successful"])))
+    return errors
+
+
+def check_dss(engines):
+    """errors of DSS files holding other engines' time series or values"""
+    errors = []
+    for i, (engine, sites) in enumerate(engines):
+        dss = HecDss.open(engine.dssFilename)
+        try:
+            stored = set()
+            for pathname in dss.getCatalogedPathnames():
+                parts = pathname.split("/")
+                site = parts[2][1:]
+                stored.add(site)
+                if parts[1] != "STRESS" or parts[6] != "E%d" % i or site not in sites:
+                    errors.append("engine %d: DSS file has %s" % (i, pathname))
+                    continue
+                tsc = dss.get(pathname, True)
+                others = [v for v in tsc.values if int(v) != int(site)]
+                if others or tsc.numberValues != 24:
+                    errors.append(
+                        "engine %d: %s has %d values, %d of other sites" % (i, pathname, tsc.numberValues, len(others))
+                    )
+            if sorted(stored) != sites:
+                errors.append("engine %d: DSS file has %d of %d sites" % (i, len(stored), len(sites)))
+        finally:
+            dss.done()
+    return errors
+
+
+def check_watermarks(tmpdir, engines):
+    """errors of watermarks lost or moved"""
+    errors = []
+    last = hectime.parse_millis("2021-09-01 23:00", "yyyy-MM-dd HH:mm", "UTC")
+    marks = watermarks.WatermarkStore(os.path.join(tmpdir, "getUsgs.watermarks")).marks()
+    for i, (engine, sites) in enumerate(engines):
+        for site in sites:
+            key = "DSS:%s|%s|1|00060" % (engine.dssFilename, site)
+            if marks.get(key) != last:
+                errors.append("engine %d: watermark %s is %s" % (i, key, marks.get(key)))
+    return errors
+
+
+def stress(engine_count=6, station_count=20, run_count=3):
+    """run the engines and check them, returning the errors
+
+    Parameters
+    ----------
+    engine_count : int, optional
+        number of engines, by default 6
+    station_count : int, optional
+        number of stations of each engine, by default 20
+    run_count : int, optional
+        number of times to run the engines, by default 3
+
+    Returns
+    -------
+    list of str
+        errors found
+    """
+    tmpdir = tempfile.mkdtemp(prefix="getusgs-stress-")
+    try:
+        client = StubClient()
+        engines = make_engines(tmpdir, client, engine_count, station_count)
+        start = time.time()
+        errors = run_all(engines, run_count)
+        elapsed = time.time() - start
+        errors.extend(check_dss(engines))
+        errors.extend(check_watermarks(tmpdir, engines))
+    finally:
+        shutil.rmtree(tmpdir, True)
+    print(
+        "{} engines x {} runs of {} stations, {} requests in {:.2f} seconds, {} errors".format(
+            engine_count, run_count, station_count, client.requests, elapsed, len(errors)
+        )
+    )
+    for error in errors[:20]:
+        print("\t" + error)
+    return errors
+
+
+if __name__ == "__main__":
+    sys.exit(1 if stress() else 0)